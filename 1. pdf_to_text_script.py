@@ -1,9 +1,22 @@
 import fitz         # PyMuPDF
 from PIL import Image
-import pytesseract
-import io
+import numpy as np
 from pathlib import Path
 import os
+import math
+import re
+import json
+import unicodedata
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from disk_cache import make_cache_key, cache_get, cache_put, evict_cache, atomic_write_text
+from metrics import timed, peak_rss_bytes
+from ocr_engines import DEFAULT_OCR_ENGINE, get_ocr_engine, resolve_ocr_engine, take_engine_load_seconds
 
 # Define the GitHub repository name for display purposes
 REPO_NAME = "financial_statement_retriever_app"
@@ -11,7 +24,7 @@ REPO_NAME = "financial_statement_retriever_app"
 # For Streamlit Community Cloud deployment, this line should be commented out
 # as Tesseract will be installed as a system package and pytesseract will find it.
 # For local Windows development, uncomment and set your Tesseract path:
-# pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# import pytesseract; pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
 # Helper to format path for display
 def format_github_path(p: Path):
@@ -30,20 +43,836 @@ def format_github_path(p: Path):
     # Prepend REPO_NAME
     return f"{REPO_NAME}/{path_str}"
 
-def run_pdf_to_text_process(company_folder_name, periods_to_process, extraction_method):
+# --- OCR settings shared by the serial and parallel extraction paths ---
+OCR_DPI = 650
+OCR_LANG = "vie" # Assuming 'vie' language pack
+OCR_CONFIG = "--psm 3"
+
+# --- Hybrid mode settings ---
+# Scanned pages start at the lowest DPI and are re-rendered at the next step
+# only while tesseract's mean word confidence stays below the threshold.
+HYBRID_DPI_STEPS = (300, 450, OCR_DPI)
+HYBRID_MIN_CONFIDENCE = 80
+MIN_TEXT_LAYER_CHARS = 50 # Fewer letters/digits than this means the page is a scan
+
+def has_usable_text_layer(text):
+    # Broken font encodings come back as U+FFFD, which is no better than a scan
+    alnum_count = sum(ch.isalnum() for ch in text)
+    return alnum_count >= MIN_TEXT_LAYER_CHARS and text.count("\ufffd") < 0.05 * alnum_count
+
+# --- Page rendering ---
+# Pages are rendered straight to 8-bit grayscale and the pixmap samples are
+# wrapped as a PIL image without a PNG encode/decode round trip. Pages above
+# RENDER_TILE_PIXELS are rendered in horizontal bands into one buffer, so no
+# full-size temporary pixmap exists next to it; pages above MAX_RENDER_PIXELS
+# are rendered at a lower DPI. When pages run in parallel, OCR_MEMORY_BUDGET_BYTES
+# caps how many are rendered and OCRed at once.
+RENDER_TILE_PIXELS = 8_000_000
+MAX_RENDER_PIXELS = 100_000_000
+OCR_BYTES_PER_PIXEL = 4 # The grayscale page plus tesseract's own copies of it
+OCR_MEMORY_BUDGET_BYTES = 2 * 1024**3
+
+def page_render_dpi(page, dpi):
+    # `dpi`, lowered for pages that would exceed MAX_RENDER_PIXELS
+    pixels = page.rect.width * page.rect.height * (dpi / 72) ** 2
+    if pixels <= MAX_RENDER_PIXELS:
+        return dpi
+    return int(dpi * math.sqrt(MAX_RENDER_PIXELS / pixels))
+
+def _grayscale_image(samples, pixmap=None):
+    # pytesseract hands images to tesseract through a temp file in image.format;
+    # uncompressed PPM (PGM for a grayscale image) is much cheaper to write
+    # than its PNG default
+    img = Image.fromarray(samples) if pixmap is None else Image.frombuffer(
+        "L", (pixmap.width, pixmap.height), pixmap.samples_mv, "raw", "L", pixmap.stride, 1)
+    # samples_mv does not keep the pixmap alive, so the image holds on to it
+    img._pixmap = pixmap
+    img.format = "PPM"
+    return img
+
+def render_page_image(page, dpi):
+    zoom = page_render_dpi(page, dpi) / 72
+    matrix = fitz.Matrix(zoom, zoom)
+    target = (page.rect * matrix).irect
+    if target.width * target.height <= RENDER_TILE_PIXELS:
+        return _grayscale_image(None, page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False))
+
+    # The display list is built once and rasterized band by band
+    display_list = page.get_displaylist()
+    buffer = np.full((target.height, target.width), 255, dtype=np.uint8)
+    band_rows = max(1, RENDER_TILE_PIXELS // target.width)
+    for top in range(0, target.height, band_rows):
+        bottom = min(target.height, top + band_rows)
+        clip = fitz.Rect(page.rect.x0, page.rect.y0 + top / zoom, page.rect.x1, page.rect.y0 + bottom / zoom)
+        band = display_list.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+        samples = np.frombuffer(band.samples_mv, dtype=np.uint8).reshape(band.height, band.stride)[:, :band.width]
+        rows, columns = min(band.height, target.height - top), min(band.width, target.width)
+        buffer[top:top + rows, :columns] = samples[:rows, :columns]
+    return _grayscale_image(buffer)
+
+def ocr_page_bytes(page_area, dpi):
+    # Estimated peak memory to render and OCR a page of `page_area` square points
+    return min(page_area * (dpi / 72) ** 2, MAX_RENDER_PIXELS) * OCR_BYTES_PER_PIXEL
+
+class RenderMemoryBudget:
+    # Estimated bytes of the pages in flight across every run that submits to
+    # one worker pool (e.g. all companies of a batch). A page waits until its
+    # bytes fit; a page larger than the whole budget runs once nothing else does.
+    def __init__(self, budget_bytes=OCR_MEMORY_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self._condition:
+            while self.in_use and self.in_use + nbytes > self.budget_bytes:
+                self._condition.wait()
+            self.in_use += nbytes
+
+    def release(self, nbytes):
+        with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+def ocr_image_with_confidence(img, engine, dpi=None, word_boxes=None):
+    # One tesseract pass that yields both the text and the mean word confidence.
+    # Words are regrouped by block/paragraph/line to rebuild image_to_string's layout.
+    # A `word_boxes` list receives (left, top, right, bottom, word) for every word.
+    data = engine.image_to_data(img, dpi)
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        if word_boxes is not None:
+            left, top = data["left"][i], data["top"][i]
+            word_boxes.append((left, top, left + data["width"][i], top + data["height"][i], word))
+        conf = float(data["conf"][i])
+        if conf >= 0:
+            confidences.append(conf)
+
+    text_parts = []
+    previous_paragraph = None
+    for (block_num, par_num, line_num), words in lines.items():
+        if previous_paragraph is not None and previous_paragraph != (block_num, par_num):
+            text_parts.append("")
+        text_parts.append(" ".join(words))
+        previous_paragraph = (block_num, par_num)
+
+    mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return "\n".join(text_parts), mean_confidence
+
+@contextmanager
+def _stopwatch(timings, key):
+    # Adds the seconds spent in the block to timings[key]; timings may be None
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[key] = timings.get(key, 0.0) + time.perf_counter() - started_at
+
+# --- Optional preprocessing of rendered pages before tesseract ---
+# Any subset of the steps can be enabled (`preprocess`); they always run in
+# PREPROCESS_STEPS order on the grayscale page:
+#   binarize         Otsu threshold to pure black text on white
+#   crop             trims the blank margins around the ink
+#   deskew           straightens pages scanned at a slight angle
+#   remove_non_text  whites out large solid regions (logos, stamps, photos)
+# The sizes below are in points, so they mean the same at every DPI.
+PREPROCESS_STEPS = ("binarize", "crop", "deskew", "remove_non_text")
+PREPROCESS_INK_LEVEL = 128 # Darker pixels count as ink
+PREPROCESS_MARGIN_INK_FRACTION = 0.002 # Rows/columns with less ink than this are blank (dust, scan noise)
+PREPROCESS_CROP_PADDING_PT = 6
+PREPROCESS_MAX_SKEW_DEGREES = 5.0
+PREPROCESS_SKEW_STEP_DEGREES = 0.1
+PREPROCESS_MIN_SKEW_DEGREES = 0.2 # Smaller angles do not justify resampling the page
+PREPROCESS_SKEW_SAMPLE_PIXELS = 200_000 # Ink pixels sampled for the skew search
+PREPROCESS_BLOCK_PT = 8 # About one line of statement text
+PREPROCESS_MAX_TEXT_DENSITY = 0.45 # Blocks with more ink than this are not text
+
+def normalize_preprocess_steps(steps):
+    # Accepts None, "binarize,deskew" or a list of step names; returns them in
+    # PREPROCESS_STEPS order
+    if not steps:
+        return ()
+    if isinstance(steps, str):
+        steps = steps.split(",")
+    steps = {step.strip().lower() for step in steps if step.strip()}
+    unknown_steps = steps - set(PREPROCESS_STEPS)
+    if unknown_steps:
+        raise ValueError(f"Unknown preprocessing step(s): {', '.join(sorted(unknown_steps))}. Choose from {', '.join(PREPROCESS_STEPS)}.")
+    return tuple(step for step in PREPROCESS_STEPS if step in steps)
+
+def otsu_threshold(gray):
+    # The gray level that best separates ink from paper (maximum between-class variance)
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    dark_weight = np.cumsum(histogram)
+    light_weight = dark_weight[-1] - dark_weight
+    dark_sum = np.cumsum(histogram * levels)
+    dark_mean = dark_sum / np.maximum(dark_weight, 1)
+    light_mean = (dark_sum[-1] - dark_sum) / np.maximum(light_weight, 1)
+    return int(np.argmax(dark_weight * light_weight * (dark_mean - light_mean) ** 2))
+
+def binarize_page(gray, dpi):
+    return (gray > otsu_threshold(gray)).astype(np.uint8) * np.uint8(255)
+
+def crop_page_margins(gray, dpi):
+    ink = gray < PREPROCESS_INK_LEVEL
+    ink_rows = np.flatnonzero(ink.mean(axis=1) > PREPROCESS_MARGIN_INK_FRACTION)
+    ink_columns = np.flatnonzero(ink.mean(axis=0) > PREPROCESS_MARGIN_INK_FRACTION)
+    if not len(ink_rows) or not len(ink_columns):
+        return gray # A blank page
+    padding = int(PREPROCESS_CROP_PADDING_PT * dpi / 72)
+    top, bottom = max(0, ink_rows[0] - padding), min(gray.shape[0], ink_rows[-1] + 1 + padding)
+    left, right = max(0, ink_columns[0] - padding), min(gray.shape[1], ink_columns[-1] + 1 + padding)
+    return gray[top:bottom, left:right]
+
+def estimate_skew_degrees(gray):
+    # Projection profile search: text lines drawn at the right angle pile the
+    # ink into the fewest rows, which maximizes the sum of squared row counts
+    ys, xs = np.nonzero(gray < PREPROCESS_INK_LEVEL)
+    if len(ys) < 100:
+        return 0.0
+    sample_step = max(1, len(ys) // PREPROCESS_SKEW_SAMPLE_PIXELS)
+    ys, xs = ys[::sample_step].astype(np.float64), xs[::sample_step].astype(np.float64)
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-PREPROCESS_MAX_SKEW_DEGREES, PREPROCESS_MAX_SKEW_DEGREES + 1e-9, PREPROCESS_SKEW_STEP_DEGREES):
+        rows = np.rint(ys - xs * math.tan(math.radians(angle))).astype(np.int64)
+        score = float(np.square(np.bincount(rows - rows.min()), dtype=np.float64).sum())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def deskew_page(gray, dpi):
+    angle = estimate_skew_degrees(gray)
+    if abs(angle) < PREPROCESS_MIN_SKEW_DEGREES:
+        return gray
+    # Lines descending to the right (positive angle) are turned counter-clockwise
+    rotated = Image.fromarray(gray).rotate(angle, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255)
+    return np.asarray(rotated)
+
+def remove_non_text_regions(gray, dpi):
+    # Splits the page into blocks of PREPROCESS_BLOCK_PT; a block far denser
+    # than text with a dense neighbour (one bold glyph is not a logo) is erased
+    block = max(4, int(PREPROCESS_BLOCK_PT * dpi / 72))
+    height, width = gray.shape
+    block_rows, block_columns = -(-height // block), -(-width // block)
+    ink = np.zeros((block_rows * block, block_columns * block), dtype=bool)
+    ink[:height, :width] = gray < PREPROCESS_INK_LEVEL
+    density = ink.reshape(block_rows, block, block_columns, block).mean(axis=(1, 3))
+    dense = density > PREPROCESS_MAX_TEXT_DENSITY
+    neighbours = np.zeros_like(dense)
+    neighbours[1:, :] |= dense[:-1, :]
+    neighbours[:-1, :] |= dense[1:, :]
+    neighbours[:, 1:] |= dense[:, :-1]
+    neighbours[:, :-1] |= dense[:, 1:]
+    erase = dense & neighbours
+    if not erase.any():
+        return gray
+    mask = np.repeat(np.repeat(erase, block, axis=0), block, axis=1)[:height, :width]
+    cleaned = gray.copy()
+    cleaned[mask] = 255
+    return cleaned
+
+_PREPROCESSORS = {
+    "binarize": binarize_page,
+    "crop": crop_page_margins,
+    "deskew": deskew_page,
+    "remove_non_text": remove_non_text_regions,
+}
+
+def preprocess_page_image(img, dpi, steps, timings=None):
+    # Each step is timed as preprocess_<step>
+    gray = np.asarray(img)
+    for step in steps:
+        with _stopwatch(timings, f"preprocess_{step}"):
+            gray = _PREPROCESSORS[step](gray, dpi)
+    return _grayscale_image(np.ascontiguousarray(gray))
+
+def _render_for_ocr(page, dpi, preprocess, timings):
+    with _stopwatch(timings, "page_render"):
+        img = render_page_image(page, dpi)
+    if preprocess:
+        img = preprocess_page_image(img, page_render_dpi(page, dpi), preprocess, timings)
+    return img
+
+# --- Layout tables: statement rows rebuilt from word boxes ---
+# Plain OCR text flattens a statement into loose lines. With `layout` on, each
+# page is also written as a table: words are grouped into rows by their
+# vertical position and split into cells at wide gaps; numeric cells whose
+# right edges line up down the page form the columns (code, note, current
+# year, prior year). A row is written as its item text followed by one cell
+# per column, empty where the row has no value, so an amount stays under its
+# column header even when a neighbouring cell is blank.
+LAYOUT_TABLE_DELIMITER = "|"
+LAYOUT_CELL_GAP = 0.9 # In word heights; wider gaps between words start a new cell
+LAYOUT_COLUMN_TOLERANCE = 1.5 # In word heights; right edges this close share a column
+LAYOUT_MIN_COLUMN_CELLS = 2 # Numbers in fewer rows than this do not make a column
+_LAYOUT_NUMBER = re.compile(r'^[(\-]?\d[\d.,]*\)?$')
+
+def _layout_rows(word_boxes, word_height):
+    # [[cell, ...]] top to bottom; a cell is {"left", "right", "text", "numeric",
+    # "words": [(left, right, word)]}
+    rows = []
+    for box in sorted(word_boxes, key=lambda box: (box[1] + box[3]) / 2):
+        center = (box[1] + box[3]) / 2
+        if rows and abs(center - rows[-1]["center"]) <= word_height / 2:
+            rows[-1]["boxes"].append(box)
+        else:
+            rows.append({"center": center, "boxes": [box]})
+
+    cell_rows = []
+    for row in rows:
+        cells = []
+        for left, _, right, _, word in sorted(row["boxes"]):
+            word = word.replace("|", "/")
+            is_number = bool(_LAYOUT_NUMBER.match(word))
+            # Two numbers side by side are separate amounts even when close
+            if cells and left - cells[-1]["right"] <= LAYOUT_CELL_GAP * word_height and not (is_number and cells[-1]["numeric"]):
+                cells[-1]["text"] += " " + word
+                cells[-1]["right"] = max(cells[-1]["right"], right)
+                cells[-1]["numeric"] = bool(_LAYOUT_NUMBER.match(cells[-1]["text"]))
+                cells[-1]["words"].append((left, right, word))
+            else:
+                cells.append({"left": left, "right": right, "text": word, "numeric": is_number, "words": [(left, right, word)]})
+        cell_rows.append(cells)
+    return cell_rows
+
+def _layout_columns(cell_rows, word_height):
+    # [(left, right)] of the numeric columns, from clusters of right edges
+    edges = sorted(cell["right"] for cells in cell_rows for cell in cells[1:] if cell["numeric"])
+    clusters = []
+    for edge in edges:
+        if clusters and edge - clusters[-1][-1] <= LAYOUT_COLUMN_TOLERANCE * word_height:
+            clusters[-1].append(edge)
+        else:
+            clusters.append([edge])
+    columns = []
+    for cluster in clusters:
+        if len(cluster) < LAYOUT_MIN_COLUMN_CELLS:
+            continue
+        lefts = [cell["left"] for cells in cell_rows for cell in cells[1:]
+                 if cell["numeric"] and cluster[0] <= cell["right"] <= cluster[-1]]
+        columns.append((min(lefts), cluster[-1]))
+    return columns
+
+def _column_over(left, right, columns, tolerance):
+    # The column under the middle of [left, right], if any
+    center = (left + right) / 2
+    for index, (column_left, column_right) in enumerate(columns):
+        if column_left - tolerance <= center <= column_right + tolerance:
+            return index
+    return None
+
+def _column_overlapping(left, right, columns, tolerance):
+    # The column that [left, right] overlaps most, if any
+    overlaps = [min(right, column_right + tolerance) - max(left, column_left - tolerance) for column_left, column_right in columns]
+    index = max(range(len(columns)), key=overlaps.__getitem__)
+    return index if overlaps[index] > 0 else None
+
+def _column_of(cell, columns, word_height):
+    tolerance = LAYOUT_COLUMN_TOLERANCE * word_height
+    if cell["numeric"]:
+        # Amounts are right-aligned in their column
+        distances = [abs(cell["right"] - right) for _, right in columns]
+        index = min(range(len(columns)), key=distances.__getitem__)
+        if distances[index] <= tolerance:
+            return index
+    # Header cells (e.g. "Năm", or a year such as "2023" on the line below it)
+    # sit over their column, often centered
+    return _column_over(cell["left"], cell["right"], columns, tolerance)
+
+def _place_cells(cells, columns, word_height):
+    # [(column index or None for the item, text)] for one row
+    tolerance = LAYOUT_COLUMN_TOLERANCE * word_height
+    placed = []
+    for position, cell in enumerate(cells):
+        # The first cell is the item unless it starts inside the columns, as
+        # on a header line that holds only the years
+        if position == 0 and cell["left"] < columns[0][0] - tolerance:
+            placed.append((None, cell["text"]))
+            continue
+        index = _column_of(cell, columns, word_height)
+        if index is not None or len(cell["words"]) == 1:
+            placed.append((index, cell["text"]))
+        else:
+            # Close header labels such as "Mã số Thuyết minh" merge into one
+            # cell across columns; place those word by word
+            placed.extend((_column_overlapping(left, right, columns, tolerance), word) for left, right, word in cell["words"])
+    return placed
+
+def words_to_table(word_boxes):
+    # word_boxes: [(left, top, right, bottom, word)] in any unit (pixels or points)
+    word_boxes = [box for box in word_boxes if box[4].strip() and box[3] > box[1]]
+    if not word_boxes:
+        return ""
+    word_height = float(np.median([bottom - top for _, top, _, bottom, _ in word_boxes]))
+    cell_rows = _layout_rows(word_boxes, word_height)
+    columns = _layout_columns(cell_rows, word_height)
+
+    lines = []
+    for cells in cell_rows:
+        item_parts = []
+        column_texts = [[] for _ in columns]
+        for index, text in (_place_cells(cells, columns, word_height) if columns else [(None, cell["text"]) for cell in cells]):
+            if index is None:
+                item_parts.append(text)
+            else:
+                column_texts[index].append(text)
+        if not any(column_texts):
+            # Titles and prose: their own gaps are the only structure
+            lines.append(LAYOUT_TABLE_DELIMITER.join(item_parts))
+        else:
+            lines.append(LAYOUT_TABLE_DELIMITER.join([" ".join(item_parts)] + [" ".join(texts) for texts in column_texts]))
+    return "\n".join(lines)
+
+def _text_layer_table(page, timings):
+    with _stopwatch(timings, "layout_table"):
+        return words_to_table([word[:5] for word in page.get_text("words")])
+
+# --- Helper to extract the text of a single page ---
+# Returns (text, source, table) where source describes how the text was
+# obtained and table is the page as a layout table when `layout` is on (else
+# None). `timings` (a dict) collects the seconds spent rendering,
+# preprocessing, in tesseract and reading the text layer. `preprocess` lists
+# the steps applied to rendered pages (see normalize_preprocess_steps);
+# `ocr_engine` names the OCR backend (see ocr_engines.py).
+def extract_page_text(page, extraction_method, timings=None, preprocess=(), ocr_engine=DEFAULT_OCR_ENGINE, layout=False):
+    extraction_method = extraction_method.lower()
+    if extraction_method == "ocr":
+        engine = get_ocr_engine(ocr_engine, OCR_LANG, OCR_CONFIG)
+        img = _render_for_ocr(page, OCR_DPI, preprocess, timings)
+        source = f"ocr@{page_render_dpi(page, OCR_DPI)}"
+        if not layout:
+            with _stopwatch(timings, "ocr"):
+                return engine.image_to_string(img, page_render_dpi(page, OCR_DPI)), source, None
+        # Word boxes come from the same tesseract pass as the text
+        word_boxes = []
+        with _stopwatch(timings, "ocr"):
+            text, _ = ocr_image_with_confidence(img, engine, page_render_dpi(page, OCR_DPI), word_boxes)
+        with _stopwatch(timings, "layout_table"):
+            return text, source, words_to_table(word_boxes)
+    if extraction_method == "hybrid":
+        with _stopwatch(timings, "text_layer"):
+            text = page.get_text("text")
+        if has_usable_text_layer(text):
+            return text, "text layer", _text_layer_table(page, timings) if layout else None
+        engine = get_ocr_engine(ocr_engine, OCR_LANG, OCR_CONFIG)
+        best_text, best_confidence, best_dpi, best_boxes = "", -1.0, None, []
+        for dpi in HYBRID_DPI_STEPS:
+            img = _render_for_ocr(page, dpi, preprocess, timings)
+            word_boxes = [] if layout else None
+            with _stopwatch(timings, "ocr"):
+                text, confidence = ocr_image_with_confidence(img, engine, page_render_dpi(page, dpi), word_boxes)
+            if confidence > best_confidence:
+                best_text, best_confidence, best_dpi, best_boxes = text, confidence, page_render_dpi(page, dpi), word_boxes
+            if confidence >= HYBRID_MIN_CONFIDENCE:
+                break
+        if not layout:
+            return best_text, f"ocr@{best_dpi}", None
+        with _stopwatch(timings, "layout_table"):
+            return best_text, f"ocr@{best_dpi}", words_to_table(best_boxes)
+    # extraction_method == "direct"
+    with _stopwatch(timings, "text_layer"):
+        text = page.get_text("text")
+    return text, "direct", _text_layer_table(page, timings) if layout else None
+
+# Each pool worker keeps its own open handle per PDF, so a document is parsed
+# once per process instead of once per page. Its OCR engine is likewise created
+# once per process (see ocr_engines.get_ocr_engine).
+_worker_docs = {}
+
+def init_ocr_worker(ocr_engine=DEFAULT_OCR_ENGINE):
+    # Pool initializer: loads the OCR model before the first page arrives
+    get_ocr_engine(ocr_engine, OCR_LANG, OCR_CONFIG)
+
+def _record_engine_loads(timings):
+    # Model load time travels back with the first page the process extracts
+    load_seconds = take_engine_load_seconds()
+    if load_seconds:
+        timings["ocr_engine_load"] = sum(load_seconds)
+
+def _extract_page_worker(pdf_path, pageno, extraction_method, preprocess=(), ocr_engine=DEFAULT_OCR_ENGINE, layout=False):
+    # Returns (text, source, table, timings, worker peak RSS); the last two
+    # travel back with the result because the worker cannot record metrics itself
+    timings = {}
+    with _stopwatch(timings, "page_extract"):
+        doc = _worker_docs.get(pdf_path)
+        if doc is None:
+            doc = fitz.open(pdf_path)
+            _worker_docs[pdf_path] = doc
+        text, source, table = extract_page_text(doc.load_page(pageno), extraction_method, timings, preprocess, ocr_engine, layout)
+    _record_engine_loads(timings)
+    return text, source, table, timings, peak_rss_bytes()
+
+# --- Helpers for partial (page range) extraction ---
+def resolve_page_range(page_range, period):
+    # page_range is either one (start_page, end_page) tuple for every period or a
+    # dict of per-period tuples. Pages are 1-based and inclusive; None means open-ended.
+    if isinstance(page_range, dict):
+        page_range = page_range.get(period, page_range.get(str(period)))
+    if not page_range:
+        return None, None
+    start_page, end_page = page_range
+    return start_page, end_page
+
+def read_page_texts(txt_path):
+    # Parses an existing {period}_ocr.txt back into {page_number: text}
+    if not txt_path.exists():
+        return {}
+    with txt_path.open("r", encoding="utf-8") as f:
+        content = f.read()
+    # re.split with a capture group yields [preamble, page, body, page, body, ...]
+    parts = re.split(r'^--- PAGE (\d+) ---\n', content, flags=re.MULTILINE)
+    page_texts = {}
+    for page_number, body in zip(parts[1::2], parts[2::2]):
+        # Each page was written as text + "\n\n"; strip that separator again
+        page_texts[int(page_number)] = body[:-2] if body.endswith("\n\n") else body
+    return page_texts
+
+def write_page_texts(txt_path, page_texts):
+    # Writes {page_number: text} in the --- PAGE n --- format, atomically
+    atomic_write_text(txt_path, "".join(
+        f"--- PAGE {page_number} ---\n" + page_texts[page_number] + "\n\n"
+        for page_number in sorted(page_texts)
+    ))
+
+# --- Financial statement page locator (cheap triage pass before full OCR) ---
+LOCATOR_DPI = 100 # Thumbnail resolution used when a page has no text layer
+MIN_STATEMENT_AMOUNTS = 4 # A statement page must carry at least this many amounts
+
+# Keywords are matched on lowercased, diacritic-free text so OCR slips on the
+# Vietnamese accents ("CÂN ĐÔI" for "CÂN ĐỐI") still hit.
+STATEMENT_SECTIONS = {
+    "balance_sheet": {
+        "titles": ["bang can doi ke toan", "bao cao tinh hinh tai chinh"],
+        "keywords": ["tai san ngan han", "tai san dai han", "nguon von", "tong cong tai san", "no phai tra", "von chu so huu"],
+    },
+    "income_statement": {
+        "titles": ["bao cao ket qua hoat dong kinh doanh", "bao cao ket qua kinh doanh"],
+        "keywords": ["doanh thu", "loi nhuan truoc thue", "loi nhuan sau thue", "chi phi thue", "gia von", "chi phi quan ly"],
+    },
+    "cash_flow": {
+        "titles": ["bao cao luu chuyen tien te"],
+        "keywords": ["luu chuyen tien", "tien thu tu", "tien chi", "tien va tuong duong tien", "dau nam", "cuoi nam"],
+    },
+    "notes": {
+        "titles": ["thuyet minh bao cao tai chinh"],
+        "keywords": [],
+    },
+}
+
+_AMOUNT_PATTERN = re.compile(r'\(?\d{1,3}(?:[.,]\d{3})+\)?')
+
+def normalize_vietnamese(text):
+    text = text.lower().replace("đ", "d")
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return re.sub(r'\s+', ' ', text)
+
+def score_statement_page(text):
+    # Returns ({section: score}, amount_count) for one page of text.
+    # A title only counts when it opens a line, which skips the many prose
+    # mentions of the statement names in the auditor's report.
+    lines = [re.sub(r'^[^a-z]+', '', normalize_vietnamese(line)) for line in text.split("\n")]
+    joined = " ".join(lines)
+    scores = {}
+    for section, words in STATEMENT_SECTIONS.items():
+        score = 0
+        if any(line.startswith(title) for line in lines for title in words["titles"]):
+            score += 5
+        score += sum(1 for keyword in words["keywords"] if keyword in joined)
+        if "ma so" in joined or ("ma thuyet" in joined and "so minh" in joined):
+            score += 2 if section != "notes" else 0
+        scores[section] = score
+    return scores, len(_AMOUNT_PATTERN.findall(text))
+
+def _locator_page_text(page, ocr_engine):
+    text = page.get_text("text")
+    if has_usable_text_layer(text):
+        return text, "text layer"
+    img = render_page_image(page, LOCATOR_DPI)
+    engine = get_ocr_engine(ocr_engine, OCR_LANG, OCR_CONFIG)
+    return engine.image_to_string(img, page_render_dpi(page, LOCATOR_DPI)), "thumbnail OCR"
+
+def locate_statement_pages(pdf_path, sections=("balance_sheet", "income_statement", "cash_flow", "notes"), ocr_engine=DEFAULT_OCR_ENGINE):
+    # Returns {"page_count", "pages", "sections": {section: [pages]}, "methods"} with 1-based pages
+    located = {section: [] for section in sections}
+    methods = {"text layer": 0, "thumbnail OCR": 0}
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+        previous_section = None
+        for pageno in range(page_count):
+            text, method = _locator_page_text(doc.load_page(pageno), ocr_engine)
+            methods[method] += 1
+            scores, amount_count = score_statement_page(text)
+            best_section = max(sections, key=lambda section: scores[section])
+            best_score = scores[best_section]
+
+            if best_section == "notes":
+                is_match = best_score >= 5
+            elif amount_count < MIN_STATEMENT_AMOUNTS:
+                is_match = False
+            elif best_score >= 5:
+                is_match = True
+            else:
+                # Continuation pages often repeat no title; accept them when they
+                # carry statement keywords and follow a page of the same statement.
+                is_match = best_score >= 3 and best_section == previous_section
+
+            if is_match:
+                located[best_section].append(pageno + 1)
+                previous_section = best_section
+            else:
+                previous_section = None
+
+    return {
+        "page_count": page_count,
+        "pages": sorted(page for pages in located.values() for page in pages),
+        "sections": located,
+        "methods": methods,
+    }
+
+def save_located_pages(located, pages_json_path):
+    with pages_json_path.open("w", encoding="utf-8") as f:
+        json.dump(located, f, ensure_ascii=False, indent=2)
+
+# --- Per-page OCR cache ---
+OCR_CACHE_MAX_BYTES = 500 * 1024 * 1024 # Least recently used pages are evicted beyond this
+
+def page_content_hash(doc, page):
+    # Fingerprint of what the page draws: geometry, content streams, form
+    # XObjects (which hold the whole page in many generated or stamped PDFs),
+    # fonts and raw image data. Unchanged pages hash the same even if the PDF
+    # is re-saved.
+    digest = hashlib.sha256()
+    digest.update(f"{tuple(page.rect)}|{page.rotation}".encode("utf-8"))
+    for xref in page.get_contents():
+        digest.update(doc.xref_stream(xref) or b"")
+    for xobject in page.get_xobjects(): # Nested forms included
+        digest.update(doc.xref_stream(xobject[0]) or b"")
+    for font in page.get_fonts(full=True):
+        digest.update(f"{font[3]}|{font[2]}".encode("utf-8"))
+    for image in page.get_images(full=True):
+        digest.update(doc.xref_stream_raw(image[0]) or b"")
+    return digest.hexdigest()
+
+def _optional_settings(preprocess=(), layout=False, extraction_method="ocr", ocr_engine=None):
+    # Preprocessing and layout tables only enter cache keys and checkpoint
+    # fingerprints when enabled, so pages extracted without them keep the keys
+    # they had before these options existed. Likewise the OCR engine only enters
+    # them when it is not pytesseract, the one engine there was before.
+    settings = ()
+    if ocr_engine and ocr_engine != "pytesseract" and extraction_method.lower() != "direct":
+        settings += ("ocr_engine", ocr_engine)
+    if preprocess:
+        settings += (preprocess, PREPROCESS_INK_LEVEL, PREPROCESS_MARGIN_INK_FRACTION, PREPROCESS_CROP_PADDING_PT, PREPROCESS_MAX_SKEW_DEGREES,
+                     PREPROCESS_SKEW_STEP_DEGREES, PREPROCESS_MIN_SKEW_DEGREES, PREPROCESS_BLOCK_PT, PREPROCESS_MAX_TEXT_DENSITY)
+    if layout:
+        settings += ("layout", LAYOUT_CELL_GAP, LAYOUT_COLUMN_TOLERANCE, LAYOUT_MIN_COLUMN_CELLS)
+    return settings
+
+def page_cache_key(content_hash, extraction_method, preprocess=(), layout=False, ocr_engine=None):
+    # Cache keys cover every setting that changes the OCR output; `ocr_engine`
+    # is the resolved engine name (see ocr_engines.resolve_ocr_engine)
+    extraction_method = extraction_method.lower()
+    optional_settings = _optional_settings(preprocess, layout, extraction_method, ocr_engine)
+    if extraction_method == "hybrid":
+        return make_cache_key(content_hash, extraction_method, HYBRID_DPI_STEPS, HYBRID_MIN_CONFIDENCE, MIN_TEXT_LAYER_CHARS, OCR_LANG, OCR_CONFIG, *optional_settings)
+    return make_cache_key(content_hash, extraction_method, OCR_DPI, OCR_LANG, OCR_CONFIG, *optional_settings)
+
+def _lookup_cached_pages(pdf_path, pagenos, extraction_method, cache_dir, preprocess=(), layout=False, ocr_engine=None):
+    # Returns ({pageno: (text, source, table)} for cache hits, {pageno: cache_key} for every page)
+    cached_pages = {}
+    cache_keys = {}
+    with fitz.open(pdf_path) as doc:
+        for pageno in pagenos:
+            cache_key = page_cache_key(page_content_hash(doc, doc.load_page(pageno)), extraction_method, preprocess, layout, ocr_engine)
+            cache_keys[pageno] = cache_key
+            cached_value = cache_get(cache_dir, cache_key)
+            if cached_value is not None:
+                entry = json.loads(cached_value)
+                cached_pages[pageno] = (entry["text"], entry["source"], entry.get("table"))
+    return cached_pages, cache_keys
+
+# --- Checkpointing, so an interrupted extraction resumes where it stopped ---
+# Finished pages are committed one file each to {period}_ocr.partial/ and listed
+# in {period}_ocr.progress.json. {period}_ocr.txt (and {period}_ocr_table.txt)
+# are only ever replaced atomically once every page is done, so they are never
+# left half-written.
+def pdf_fingerprint(pdf_path, extraction_method, pagenos, preprocess=(), layout=False, ocr_engine=None):
+    stat = pdf_path.stat()
+    return make_cache_key(stat.st_size, stat.st_mtime_ns, extraction_method.lower(), pagenos, *_optional_settings(preprocess, layout, extraction_method, ocr_engine))
+
+def checkpoint_paths(ocr_dir, period):
+    return ocr_dir / f"{period}_ocr.partial", ocr_dir / f"{period}_ocr.progress.json"
+
+def load_checkpoint(ocr_dir, period, fingerprint):
+    # Returns {pageno: (text, source, table)} for pages finished by an earlier, interrupted run
+    partial_dir, manifest_path = checkpoint_paths(ocr_dir, period)
+    if not manifest_path.exists():
+        return {}
+    try:
+        with manifest_path.open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("fingerprint") != fingerprint:
+        # The PDF or the requested pages changed; the old progress is useless
+        clear_checkpoint(ocr_dir, period)
+        return {}
+    finished_pages = {}
+    for pageno in manifest.get("completed_pages", []):
+        page_path = partial_dir / f"page_{pageno:05d}.json"
+        try:
+            with page_path.open("r", encoding="utf-8") as f:
+                entry = json.load(f)
+            finished_pages[pageno] = (entry["text"], entry["source"], entry.get("table"))
+        except (OSError, ValueError, KeyError):
+            continue
+    return finished_pages
+
+def _page_entry(text, source, table):
+    # The JSON stored per page in the OCR cache and the checkpoint
+    entry = {"text": text, "source": source}
+    if table is not None:
+        entry["table"] = table
+    return json.dumps(entry, ensure_ascii=False)
+
+def checkpoint_page(ocr_dir, period, fingerprint, pageno, text, source, completed_pages, total_pages, table=None):
+    partial_dir, manifest_path = checkpoint_paths(ocr_dir, period)
+    partial_dir.mkdir(parents=True, exist_ok=True)
+    # The page file is committed before the manifest lists it
+    atomic_write_text(partial_dir / f"page_{pageno:05d}.json", _page_entry(text, source, table))
+    completed_pages.append(pageno)
+    manifest = {"fingerprint": fingerprint, "status": "in_progress", "total_pages": total_pages, "completed_pages": completed_pages}
+    atomic_write_text(manifest_path, json.dumps(manifest))
+
+def clear_checkpoint(ocr_dir, period):
+    partial_dir, manifest_path = checkpoint_paths(ocr_dir, period)
+    manifest_path.unlink(missing_ok=True)
+    shutil.rmtree(partial_dir, ignore_errors=True)
+
+def _iter_page_texts_serial(pdf_path, pagenos, extraction_method, preprocess=(), ocr_engine=DEFAULT_OCR_ENGINE, layout=False):
+    doc = fitz.open(pdf_path)
+    try:
+        for pageno in pagenos:
+            timings = {}
+            with _stopwatch(timings, "page_extract"):
+                text, source, table = extract_page_text(doc.load_page(pageno), extraction_method, timings, preprocess, ocr_engine, layout)
+            _record_engine_loads(timings)
+            yield pageno, text, source, table, timings, peak_rss_bytes()
+    finally:
+        doc.close()
+
+class _PageFeeder:
+    # Keeps at most `max_in_flight` pages submitted to the pool, in period and
+    # page order, so the rendered pages held by the workers stay within the
+    # memory budget. Pages of the next period are submitted while the current
+    # one finishes, which keeps the workers busy across period boundaries.
+    # With a shared_budget (a RenderMemoryBudget), each page also holds
+    # page_bytes of it from submission until it finishes.
+    def __init__(self, executor, extraction_method, max_in_flight, preprocess=(), ocr_engine=DEFAULT_OCR_ENGINE, layout=False, shared_budget=None, page_bytes=0):
+        self.executor = executor
+        self.shared_budget = shared_budget if page_bytes else None
+        self.page_bytes = page_bytes
+        self.extraction_method = extraction_method
+        self.preprocess = preprocess
+        self.ocr_engine = ocr_engine
+        self.layout = layout
+        self.max_in_flight = max(1, max_in_flight)
+        self.pending = deque() # (period, pdf_path, pageno) not yet submitted
+        self.in_flight = deque() # (period, pageno, future) in submission order
+
+    def add(self, period, pdf_path, pagenos):
+        self.pending.extend((period, str(pdf_path), pageno) for pageno in pagenos)
+
+    def _refill(self):
+        while self.pending and len(self.in_flight) < self.max_in_flight:
+            period, pdf_path, pageno = self.pending.popleft()
+            if self.shared_budget is not None:
+                self.shared_budget.acquire(self.page_bytes)
+            future = self.executor.submit(
+                _extract_page_worker, pdf_path, pageno, self.extraction_method, self.preprocess, self.ocr_engine, self.layout)
+            if self.shared_budget is not None:
+                # Also runs when the future is cancelled
+                future.add_done_callback(lambda _, budget=self.shared_budget, nbytes=self.page_bytes: budget.release(nbytes))
+            self.in_flight.append((period, pageno, future))
+
+    def iter_period(self, period):
+        # Futures are consumed in submission order, so pages come back in page
+        # order even though the pool finishes them out of order.
+        self._refill()
+        while self.in_flight and self.in_flight[0][0] == period:
+            _, pageno, future = self.in_flight[0]
+            result = future.result()
+            self.in_flight.popleft()
+            self._refill()
+            yield (pageno,) + result
+
+    def cancel_period(self, period):
+        self.pending = deque(entry for entry in self.pending if entry[0] != period)
+        for entry in [entry for entry in self.in_flight if entry[0] == period]:
+            entry[2].cancel()
+            self.in_flight.remove(entry)
+
+    def cancel_all(self):
+        self.pending.clear()
+        for _, _, future in self.in_flight:
+            future.cancel()
+        self.in_flight.clear()
+
+def run_pdf_to_text_process(company_folder_name, periods_to_process, extraction_method, num_workers=1, page_range=None, auto_locate=False, use_cache=True, cache_max_bytes=OCR_CACHE_MAX_BYTES, executor=None, progress_callback=None, metrics=None, memory_budget_bytes=OCR_MEMORY_BUDGET_BYTES, preprocess=None, ocr_engine=DEFAULT_OCR_ENGINE, layout=False, shared_memory_budget=None):
     company_base_path = Path(company_folder_name)
     base_pdf_dir = company_base_path / "financial_statements"
     ocr_dir = company_base_path / "text_statements"
+    cache_dir = company_base_path / "ocr_cache"
 
     ocr_dir.mkdir(parents=True, exist_ok=True)
 
+    num_workers = max(1, int(num_workers or 1))
+    # Direct text extraction is cheaper than a cache lookup, so only OCR is cached
+    use_cache = use_cache and extraction_method.lower() in ("ocr", "hybrid")
+    # Preprocessing steps for rendered pages; direct extraction renders nothing
+    preprocess = normalize_preprocess_steps(preprocess) if extraction_method.lower() in ("ocr", "hybrid") else ()
+    # Resolved once ("auto" or a fallback), so every worker runs the same engine
+    ocr_engine, ocr_engine_note = resolve_ocr_engine(ocr_engine)
+    engine_load_seconds = []
+
+    # progress_callback(message, done=None, total=None) is called as each page
+    # finishes; an exception it raises (e.g. to cancel a job) stops the run
+    report_progress = progress_callback or (lambda message, done=None, total=None: None)
+    # `metrics` (a stage view of metrics.RunMetrics) gets one span per page
+    # step (render, tesseract, text layer), the locator and the cache lookups
+    # memory_budget_bytes caps the estimated memory of the pages rendered and
+    # OCRed at once when pages run in parallel; a shared_memory_budget
+    # (RenderMemoryBudget) caps it across every run submitting to `executor`
+    # layout=True also writes {period}_ocr_table.txt (see words_to_table)
+
     results = []
     results.append(f"--- Starting PDF Text Extraction Process ({extraction_method.upper()} method) ---")
+    if extraction_method.lower() in ("ocr", "hybrid") or auto_locate:
+        if ocr_engine_note:
+            results.append(f"Warning: {ocr_engine_note}")
+        engine_description = "one tesseract instance per worker process" if ocr_engine == "tesserocr" else "one tesseract process per page"
+        results.append(f"OCR engine: {ocr_engine} ({engine_description}).")
+    if preprocess:
+        results.append(f"Preprocessing rendered pages before OCR: {', '.join(preprocess)}.")
+    if layout:
+        results.append("Layout tables: rebuilding table rows and columns from word positions.")
+    if executor is not None:
+        results.append("Parallel mode: pages are extracted in the worker pool shared by this batch.")
+    elif num_workers > 1:
+        results.append(f"Parallel mode: pages from all periods share a pool of {num_workers} worker processes.")
 
-    processed_any_pdf = False # Track if any PDF was successfully processed
+    # --- Collect the pages to extract for every period up front ---
+    period_jobs = []
     for period in periods_to_process:
         pdf_path = base_pdf_dir / f"{period}.pdf"
-        out_txt = ocr_dir / f"{period}_ocr.txt"
 
         if not pdf_path.exists():
             # Changed: Use the refined format_github_path for display
@@ -52,46 +881,226 @@ def run_pdf_to_text_process(company_folder_name, periods_to_process, extraction_
             results.append(error_message)
             continue
 
-        # Changed: Use the refined format_github_path for display
-        status_message = f"\nProcessing PDF for period: {period} ({format_github_path(pdf_path)}) using {extraction_method.upper()}..."
-        print(status_message)
-        results.append(status_message)
-        
-        doc = None
         try:
-            doc = fitz.open(pdf_path)
-            with out_txt.open("w", encoding="utf-8") as fout:
-                for pageno in range(len(doc)):
-                    page = doc.load_page(pageno)
-                    
-                    if extraction_method.lower() == "ocr":
-                        pix = page.get_pixmap(dpi=650)
-                        img_bytes = pix.tobytes("png")
-                        img = Image.open(io.BytesIO(img_bytes))
-                        text = pytesseract.image_to_string(img, lang="vie", config="--psm 3") # Assuming 'vie' language pack
-                    else: # extraction_method.lower() == "direct"
-                        text = page.get_text("text")
-
-                    fout.write(f"--- PAGE {pageno+1} ---\n")
-                    fout.write(text + "\n\n")
-            # Changed: Use the refined format_github_path for display
-            status_message = f"Text output for {period} saved to: {format_github_path(out_txt)}"
-            print(status_message)
-            results.append(status_message)
-            processed_any_pdf = True # Mark as successful for at least one PDF
-
+            with fitz.open(pdf_path) as doc:
+                page_count = len(doc)
+                largest_page_area = max((page.rect.width * page.rect.height for page in doc), default=0)
         except Exception as e:
-            # Changed: Use the refined format_github_path for display
             error_message = f"An error occurred during {extraction_method.upper()} for {period} at {format_github_path(pdf_path)}: {e}. Skipping this period."
             print(error_message)
             results.append(error_message)
-        finally:
-            if doc:
-                doc.close()
+            continue
+
+        start_page, end_page = resolve_page_range(page_range, period)
+        pagenos = None
+        is_partial = start_page is not None or end_page is not None
+        pages_json_path = ocr_dir / f"{period}_pages.json"
+        if auto_locate and not is_partial:
+            # An explicit range always wins over the locator
+            report_progress(f"Locating statement pages for {period}...")
+            try:
+                with timed(metrics, "page_locator", period=period):
+                    located = locate_statement_pages(pdf_path, ocr_engine=ocr_engine)
+            except Exception as e:
+                located = {"pages": []}
+                results.append(f"Warning: Page locator failed for {period}: {e}.")
+            if located["pages"]:
+                save_located_pages(located, pages_json_path)
+                section_summary = ", ".join(f"{section}: {len(pages)}" for section, pages in located["sections"].items())
+                results.append(f"Page locator for {period} selected {len(located['pages'])} of {page_count} pages ({section_summary}); saved to {format_github_path(pages_json_path)}")
+                pagenos = [page - 1 for page in located["pages"]]
+                is_partial = True
+            else:
+                results.append(f"Warning: Page locator found no statement pages for {period}. Extracting all pages.")
+
+        if pagenos is None:
+            # Nothing located in this run: drop pages an earlier run located,
+            # or the converter would filter the new text down to them
+            pages_json_path.unlink(missing_ok=True)
+            first_index = max(start_page or 1, 1) - 1
+            last_index = min(end_page or page_count, page_count)
+            pagenos = list(range(first_index, last_index))
+            if not pagenos:
+                error_message = f"Warning: Page range {start_page}-{end_page} is outside the {page_count} pages of {format_github_path(pdf_path)}. Skipping text extraction for this period."
+                print(error_message)
+                results.append(error_message)
+                continue
+            if is_partial:
+                results.append(f"Page range for {period}: extracting pages {first_index+1}-{last_index} of {page_count}.")
+
+        job = {"period": period, "pdf_path": pdf_path, "pagenos": pagenos, "is_partial": is_partial, "cached_pages": {}, "cache_keys": {}, "largest_page_area": largest_page_area}
+        if use_cache:
+            try:
+                with timed(metrics, "ocr_cache_lookup", period=period, pages=len(pagenos)):
+                    job["cached_pages"], job["cache_keys"] = _lookup_cached_pages(pdf_path, pagenos, extraction_method, cache_dir, preprocess, layout, ocr_engine)
+            except Exception as e:
+                results.append(f"Warning: OCR cache lookup failed for {period}: {e}. Extracting every page.")
+        job["fingerprint"] = pdf_fingerprint(pdf_path, extraction_method, pagenos, preprocess, layout, ocr_engine)
+        job["checkpointed_pages"] = load_checkpoint(ocr_dir, period, job["fingerprint"])
+        if job["checkpointed_pages"]:
+            results.append(f"Resuming {period} from checkpoint: {len(job['checkpointed_pages'])} of {len(pagenos)} pages already extracted.")
+        job["pending_pagenos"] = [
+            pageno for pageno in pagenos
+            if pageno not in job["cached_pages"] and pageno not in job["checkpointed_pages"]
+        ]
+        period_jobs.append(job)
+
+    # A pool passed in by the caller (e.g. a batch run over several companies)
+    # is shared with other runs, so it is neither created nor shut down here
+    owns_executor = executor is None
+    pending_jobs = [job for job in period_jobs if job["pending_pagenos"]]
+    use_pool = bool(pending_jobs) and (executor is not None or num_workers > 1)
+    page_bytes = 0
+    if use_pool:
+        # Sized for the largest page any period still has to render; direct
+        # extraction renders nothing, so only the pool size limits it
+        if extraction_method.lower() in ("ocr", "hybrid"):
+            page_bytes = max(ocr_page_bytes(job["largest_page_area"], OCR_DPI) for job in pending_jobs)
+        max_in_flight = max(1, int(memory_budget_bytes // page_bytes)) if page_bytes else sum(len(job["pending_pagenos"]) for job in pending_jobs)
+        if owns_executor:
+            max_in_flight = min(max_in_flight, num_workers)
+            # OCR workers load the model up front; hybrid ones only on their
+            # first scanned page, since text-layer pages need no model
+            if extraction_method.lower() == "ocr":
+                executor = ProcessPoolExecutor(max_workers=max_in_flight, initializer=init_ocr_worker, initargs=(ocr_engine,))
+            else:
+                executor = ProcessPoolExecutor(max_workers=max_in_flight)
+        if max_in_flight < num_workers:
+            results.append(f"Memory budget of {memory_budget_bytes / 1024**2:.0f} MB allows {max_in_flight} pages in flight at once (about {page_bytes / 1024**2:.0f} MB per page).")
+        if shared_memory_budget is not None and page_bytes:
+            results.append(f"Pages in flight are also held within {shared_memory_budget.budget_bytes / 1024**2:.0f} MB across every run sharing the worker pool.")
+    processed_any_pdf = False # Track if any PDF was successfully processed
+    total_hits = 0
+    total_misses = 0
+    page_feeder = None
+    total_pages = sum(len(job["pagenos"]) for job in period_jobs)
+    done_pages = 0
+    try:
+        if use_pool:
+            page_feeder = _PageFeeder(executor, extraction_method, max_in_flight, preprocess, ocr_engine, layout, shared_memory_budget, page_bytes)
+            for job in period_jobs:
+                page_feeder.add(job["period"], job["pdf_path"], job["pending_pagenos"])
+
+        for job in period_jobs:
+            period = job["period"]
+            pdf_path = job["pdf_path"]
+            out_txt = ocr_dir / f"{period}_ocr.txt"
+            out_table_txt = ocr_dir / f"{period}_ocr_table.txt"
+
+            # Changed: Use the refined format_github_path for display
+            status_message = f"\nProcessing PDF for period: {period} ({format_github_path(pdf_path)}) using {extraction_method.upper()}..."
+            print(status_message)
+            results.append(status_message)
+
+            try:
+                if page_feeder:
+                    page_texts = page_feeder.iter_period(period)
+                else:
+                    page_texts = _iter_page_texts_serial(pdf_path, job["pending_pagenos"], extraction_method, preprocess, ocr_engine, layout)
+
+                # A partial run keeps the text already extracted for pages outside the range
+                merged_texts = read_page_texts(out_txt) if job["is_partial"] else {}
+                merged_tables = read_page_texts(out_table_txt) if job["is_partial"] and layout else {}
+                kept_pages = len(set(merged_texts) - {pageno+1 for pageno in job["pagenos"]})
+                page_sources = {}
+                for pageno, (text, source, table) in list(job["cached_pages"].items()) + list(job["checkpointed_pages"].items()):
+                    merged_texts[pageno+1] = text
+                    if layout:
+                        merged_tables[pageno+1] = table or ""
+                    page_sources[source] = page_sources.get(source, 0) + 1
+                reused_pages = len(job["pagenos"]) - len(job["pending_pagenos"])
+                done_pages += reused_pages
+                report_progress(f"{period}: {reused_pages} pages from cache or checkpoint, {len(job['pending_pagenos'])} to extract", done_pages, total_pages)
+                completed_pages = sorted(job["checkpointed_pages"])
+                page_seconds = {}
+                step_seconds = {} # Summed over the pages, e.g. {"ocr": ..., "preprocess_deskew": ...}
+                worker_peak_rss = 0
+                for pageno, text, source, table, timings, page_peak_rss in page_texts:
+                    if metrics is not None:
+                        for span_name, seconds in timings.items():
+                            metrics.add_span(span_name, seconds, period=period, page=pageno+1, source=source)
+                    page_seconds[pageno+1] = timings.get("page_extract", 0.0)
+                    if "ocr_engine_load" in timings:
+                        engine_load_seconds.append(timings["ocr_engine_load"])
+                    for step, seconds in timings.items():
+                        step_seconds[step] = step_seconds.get(step, 0.0) + seconds
+                    worker_peak_rss = max(worker_peak_rss, page_peak_rss)
+                    merged_texts[pageno+1] = text
+                    if layout:
+                        merged_tables[pageno+1] = table or ""
+                    page_sources[source] = page_sources.get(source, 0) + 1
+                    done_pages += 1
+                    report_progress(f"{period}: page {pageno+1} extracted ({source})", done_pages, total_pages)
+                    checkpoint_page(ocr_dir, period, job["fingerprint"], pageno, text, source, completed_pages, len(job["pagenos"]), table)
+                    if use_cache and pageno in job["cache_keys"]:
+                        cache_put(cache_dir, job["cache_keys"][pageno], _page_entry(text, source, table))
+
+                write_page_texts(out_txt, merged_texts)
+                if layout:
+                    write_page_texts(out_table_txt, merged_tables)
+                    table_chars, text_chars = sum(map(len, merged_tables.values())), sum(map(len, merged_texts.values()))
+                    results.append(f"Layout tables for {period} saved to: {format_github_path(out_table_txt)} ({table_chars:,} characters, {text_chars:,} in the plain text).")
+                clear_checkpoint(ocr_dir, period)
+                if page_seconds:
+                    slowest_page = max(page_seconds, key=page_seconds.get)
+                    main_peak_rss = peak_rss_bytes()
+                    if metrics is not None:
+                        metrics.set_max("ocr_worker_peak_rss_bytes", worker_peak_rss)
+                    results.append(
+                        f"Extracted {len(page_seconds)} pages of {period} in {sum(page_seconds.values()):.1f}s "
+                        f"({sum(page_seconds.values()) / len(page_seconds):.2f}s per page, slowest page {slowest_page} at {page_seconds[slowest_page]:.2f}s); "
+                        f"peak RSS {main_peak_rss / 1024**2:.0f} MB" + (f", workers {worker_peak_rss / 1024**2:.0f} MB." if page_feeder else ".")
+                    )
+                    if "ocr" in step_seconds:
+                        step_summary = ", ".join(
+                            f"{step.replace('preprocess_', '')} {seconds / len(page_seconds):.2f}s"
+                            for step, seconds in step_seconds.items() if step == "ocr" or step.startswith("preprocess_")
+                        )
+                        results.append(f"Per page for {period}: {step_summary}.")
+                if use_cache:
+                    hits = len(job["cached_pages"])
+                    misses = len(job["pending_pagenos"])
+                    total_hits += hits
+                    total_misses += misses
+                    if metrics is not None:
+                        metrics.count("ocr_cache_hits", hits)
+                        metrics.count("ocr_cache_misses", misses)
+                    results.append(f"OCR cache for {period}: {hits} hits, {misses} misses.")
+                if extraction_method.lower() == "hybrid":
+                    source_summary = ", ".join(f"{source}: {count}" for source, count in sorted(page_sources.items()))
+                    results.append(f"Hybrid extraction for {period} ({source_summary} pages)")
+                if kept_pages:
+                    results.append(f"Kept previously extracted text for {kept_pages} pages outside the range of {period}.")
+                # Changed: Use the refined format_github_path for display
+                status_message = f"Text output for {period} saved to: {format_github_path(out_txt)}"
+                print(status_message)
+                results.append(status_message)
+                processed_any_pdf = True # Mark as successful for at least one PDF
+
+            except Exception as e:
+                # Changed: Use the refined format_github_path for display
+                error_message = f"An error occurred during {extraction_method.upper()} for {period} at {format_github_path(pdf_path)}: {e}. Skipping this period."
+                print(error_message)
+                results.append(error_message)
+                if page_feeder:
+                    page_feeder.cancel_period(period)
+    finally:
+        if page_feeder:
+            page_feeder.cancel_all()
+        if executor and owns_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    # Models loaded in this process and not yet reported (e.g. by the page locator)
+    engine_load_seconds.extend(take_engine_load_seconds())
+    if engine_load_seconds:
+        results.append(f"\nOCR engine {ocr_engine}: model loaded {len(engine_load_seconds)} time(s) in {sum(engine_load_seconds):.2f}s ({max(engine_load_seconds):.2f}s the slowest).")
+    if use_cache:
+        evicted = evict_cache(cache_dir, max_bytes=cache_max_bytes)
+        results.append(f"\nOCR cache totals: {total_hits} hits, {total_misses} misses, {evicted} entries evicted ({format_github_path(cache_dir)}).")
     
     results.append("\n--- PDF Text Extraction Process Complete ---")
     
     if not processed_any_pdf:
         raise ValueError("No PDF files were successfully processed into text. Please check PDF paths and content.")
         
-    return "\n".join(results)
\ No newline at end of file
+    return "\n".join(results)
@@ -6,6 +6,11 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 import re
+import unicodedata
+from statement_store import write_long_frame
+from value_parser import parse_financial_values
+from llm_utils import TokenBucketRateLimiter, LLMResponseCache, parse_llm_json, run_chain_batch, estimate_tokens
+from metrics import timed
 
 # Define the GitHub repository name for display purposes
 REPO_NAME = "financial_statement_retriever_app"
@@ -28,9 +33,12 @@ def format_github_path(p: Path):
     return f"{REPO_NAME}/{path_str}"
 
 # --- Helper function to extract text from a specific page range ---
-def extract_pages(text_content, start_page=None, end_page=None):
-    if start_page is None and end_page is None:
+def extract_pages(text_content, start_page=None, end_page=None, pages=None):
+    # `pages` is an explicit collection of page numbers (e.g. from the page locator)
+    if start_page is None and end_page is None and pages is None:
         return text_content
+    if pages is not None:
+        pages = set(pages)
 
     lines = text_content.split('\n')
     filtered_lines = []
@@ -42,7 +50,8 @@ def extract_pages(text_content, start_page=None, end_page=None):
         if page_header_match:
             current_page = int(page_header_match.group(1))
             if (start_page is None or current_page >= start_page) and \
-               (end_page is None or current_page <= end_page):
+               (end_page is None or current_page <= end_page) and \
+               (pages is None or current_page in pages):
                 in_desired_range = True
                 filtered_lines.append(line)
             else:
@@ -52,7 +61,348 @@ def extract_pages(text_content, start_page=None, end_page=None):
     
     return "\n".join(filtered_lines)
 
-def run_converter_process(company_folder_name, periods_to_process, extraction_method, start_page, end_page):
+# --- Rule-based fast path for coded Vietnamese (VAS) statements ---
+# VAS statements print each row as: item name, "Mã số" code, optional note,
+# current-year amount, prior-year amount. Pages where nearly every amount line
+# parses that way are converted without an LLM call; everything else still
+# goes to Gemini.
+VAS_STATEMENT_TITLES = {
+    "bang can doi ke toan": "Bảng Cân Đối Kế Toán",
+    "bao cao tinh hinh tai chinh": "Bảng Cân Đối Kế Toán",
+    "bao cao ket qua hoat dong kinh doanh": "Báo Cáo Kết Quả Hoạt Động Kinh Doanh",
+    "bao cao ket qua kinh doanh": "Báo Cáo Kết Quả Hoạt Động Kinh Doanh",
+    "bao cao luu chuyen tien te": "Báo Cáo Lưu Chuyển Tiền Tệ",
+}
+RULE_PARSER_MIN_ROWS = 3 # A page needs at least this many parsed rows...
+RULE_PARSER_MIN_COVERAGE = 0.7 # ...and this share of its amount lines parsed
+
+_VAS_AMOUNT = re.compile(r'^\(?-?\d{1,3}(?:[.,]\d{3})*\)?$')
+_VAS_GROUPED_AMOUNT = re.compile(r'\d{1,3}(?:[.,]\d{3})+')
+# The current-year cell must look like money, so a code or note number in front
+# of a row's only amount is not read as that amount
+_VAS_CURRENT_AMOUNT = re.compile(r'^(?:\(-?\d{1,3}(?:[.,]\d{3})*\)|-?\d{1,3}(?:[.,]\d{3})+)$')
+_VAS_BLANK_AMOUNTS = {"-", ".", "—", "–", "_"}
+_VAS_CODE_OR_NOTE = re.compile(r'^\.?\d{1,3}(?:\.\d{1,2})?[a-z]?\.?$')
+_VAS_ENUMERATOR = re.compile(r'^(?:[IVX]+|[A-Z]|\d+(?:\.\d+)*)[.)]\s+|^[-–]\s*')
+_VAS_FORMULA = re.compile(r'\(\s*\d+\s*=.*\)') # e.g. "(30=20+(21-22)-25)"
+
+def _normalize_title(text):
+    text = text.lower().replace("đ", "d")
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return re.sub(r'\s+', ' ', re.sub(r'^[^a-z]+', '', text)).strip()
+
+def _parse_vas_amount(token):
+    if token in _VAS_BLANK_AMOUNTS:
+        return None
+    negative = token.startswith("(") or token.startswith("-")
+    digits = re.sub(r'\D', '', token)
+    if not digits:
+        return None
+    return -int(digits) if negative else int(digits)
+
+def parse_vas_line(line):
+    # Returns (item, code, current_value) for a coded statement row, else None
+    tokens = line.split()
+    if len(tokens) < 3:
+        return None
+    current_token, prior_token = tokens[-2], tokens[-1]
+    if current_token not in _VAS_BLANK_AMOUNTS and not _VAS_CURRENT_AMOUNT.match(current_token):
+        return None
+    if prior_token not in _VAS_BLANK_AMOUNTS and not _VAS_AMOUNT.match(prior_token):
+        return None
+    if not (_VAS_GROUPED_AMOUNT.search(current_token) or _VAS_GROUPED_AMOUNT.search(prior_token)):
+        return None
+
+    # Up to two short numeric tokens before the amounts are the code and the note
+    head = tokens[:-2]
+    trailing_numbers = []
+    while head and len(trailing_numbers) < 2 and _VAS_CODE_OR_NOTE.match(head[-1]):
+        trailing_numbers.insert(0, head.pop())
+    item = " ".join(head)
+    if not re.search(r'[^\W\d_]', item):
+        return None
+    code = trailing_numbers[0].strip(".") if trailing_numbers else ""
+    return item, code, _parse_vas_amount(current_token)
+
+def _clean_vas_item(item):
+    item = re.sub(r'\(\s*\d+\s*=.*$', "", item) # Formulas close the item name
+    item = _VAS_ENUMERATOR.sub("", item.strip())
+    return re.sub(r'\s+', ' ', item).strip(" ,.:;").title()
+
+def parse_vas_page(page_text, statement_type, period):
+    # Returns (statement_type, rows, is_confident) for one page. The statement
+    # type comes from a title line on the page, or carries over from the
+    # previous page for continuation pages without a title.
+    rows = []
+    amount_lines = 0
+    last_row = None
+    for line in page_text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        normalized = _normalize_title(line)
+        for title, name in VAS_STATEMENT_TITLES.items():
+            if normalized.startswith(title):
+                statement_type = name
+                break
+
+        if _VAS_GROUPED_AMOUNT.search(line):
+            amount_lines += 1
+        parsed = parse_vas_line(line)
+        if parsed:
+            item, code, value = parsed
+            last_row = {"item_number": code, "statement_type": statement_type, "item": item, "year": str(period), "value": value}
+            rows.append(last_row)
+        elif last_row is not None and line[0].islower() and not _VAS_GROUPED_AMOUNT.search(line):
+            # Wrapped item names continue on the next line in lower case
+            last_row["item"] += " " + line
+        elif not _VAS_FORMULA.fullmatch(line):
+            last_row = None
+
+    for row in rows:
+        row["item"] = _clean_vas_item(row["item"])
+    is_confident = (
+        statement_type is not None
+        and len(rows) >= RULE_PARSER_MIN_ROWS
+        and len(rows) >= RULE_PARSER_MIN_COVERAGE * amount_lines
+    )
+    return statement_type, rows, is_confident
+
+def split_pages(text_content):
+    # Returns [(page_number, page_text_with_header)] in order
+    pages = []
+    for page in re.split(r'(?m)^(?=--- PAGE \d+ ---$)', text_content):
+        header_match = re.match(r'--- PAGE (\d+) ---', page)
+        if header_match:
+            pages.append((int(header_match.group(1)), page))
+    return pages
+
+def apply_rule_parser(text_content, period):
+    # Returns (rows from confidently parsed pages, text of the remaining pages, handled page numbers)
+    rule_rows = []
+    remaining_pages = []
+    handled_pages = []
+    statement_type = None
+    for page_number, page_text in split_pages(text_content):
+        statement_type, rows, is_confident = parse_vas_page(page_text, statement_type, period)
+        if is_confident:
+            rule_rows.extend(rows)
+            handled_pages.append(page_number)
+        else:
+            remaining_pages.append(page_text)
+            statement_type = None # Only carry the title over from a page we trusted
+    return rule_rows, "".join(remaining_pages), handled_pages
+
+# --- Layout tables written by Step 1 ({period}_ocr_table.txt) ---
+LAYOUT_TABLE_NOTE = (
+    "The text is laid out as tables: each line is one row with its cells separated by '|', the line item first, "
+    "then one cell per column in the order of the header row (code, note, current year, prior year). "
+    "Empty cells are kept, so every value stays in its column.\n\n"
+)
+
+def read_layout_tables(ocr_dir, period, ocr_text_file_path):
+    # Returns (table text or None, log message); tables older than the plain
+    # text come from an earlier Step 1 run and are not used
+    table_path = ocr_dir / f"{period}_ocr_table.txt"
+    if not table_path.exists():
+        return None, f"Warning: No layout tables for {period} at {format_github_path(table_path)}; rerun Step 1 with layout tables on. Using the plain text."
+    if table_path.stat().st_mtime_ns < ocr_text_file_path.stat().st_mtime_ns:
+        return None, f"Warning: Layout tables for {period} predate its latest text extraction; rerun Step 1 with layout tables on. Using the plain text."
+    with table_path.open("r", encoding="utf-8") as f:
+        return f.read(), f"Using layout tables for {period} from {format_github_path(table_path)}"
+
+# --- Prompt compaction ---
+# Annual report dumps carry cover letters, addresses, signature blocks, running
+# page headers and OCR debris around the statements. Compaction keeps the
+# pages that contain amounts, drops boilerplate and garbage lines from them and
+# collapses whitespace. Lines repeated on most pages (running headers and
+# footers) are found across the whole period and kept once per request.
+COMPACT_MIN_AMOUNTS_PER_PAGE = 3 # Pages with fewer grouped amounts are prose
+COMPACT_REPEATED_LINE_MIN_PAGES = 3 # A line on at least this many pages...
+COMPACT_REPEATED_LINE_SHARE = 0.5 # ...and on this share of all pages is a running header
+COMPACT_MIN_ALNUM_SHARE = 0.5 # Lines with fewer letters and digits than this are OCR debris
+
+# Matched against _normalize_title(line), i.e. lower case without diacritics
+_COMPACT_BOILERPLATE = re.compile(
+    r'^(?:tru so|dia chi|dien thoai|tel|fax|e-?mail|website|kinh gui|noi nhan|digitally signed|location|date'
+    r'|nguoi lap|nguoi thuc hien|ke toan truong|tong giam doc|giam doc|chu tich)\b'
+)
+# Column headers ("Chỉ tiêu Mã số Thuyết minh Năm nay Năm trước", "Số cuối năm
+# Số đầu năm") repeat on every statement page, but each page needs its own to
+# tell the current year from the prior one, so they are never running headers.
+# A line is a column header when it holds at least two of these labels; one
+# alone also occurs in footers ("Các thuyết minh kèm theo là bộ phận...").
+_COMPACT_COLUMN_HEADER = re.compile(r'\b(?:ma so|thuyet minh|nam|so cuoi|so dau)\b')
+
+def _is_compactable_line(line):
+    # Boilerplate or debris; lines with amounts are always kept
+    if _VAS_GROUPED_AMOUNT.search(line) or line in _VAS_BLANK_AMOUNTS:
+        return False
+    visible = re.sub(r'\s', '', line)
+    alnum = sum(ch.isalnum() for ch in visible)
+    if not re.search(r'\w\w', line) or alnum < COMPACT_MIN_ALNUM_SHARE * len(visible):
+        return True
+    return bool(_COMPACT_BOILERPLATE.match(_normalize_title(line)))
+
+def _running_header_key(line):
+    # Lines compared across pages; None for lines that are never running headers
+    if _VAS_GROUPED_AMOUNT.search(line):
+        return None
+    key = _normalize_title(line)
+    if not key or len(_COMPACT_COLUMN_HEADER.findall(key)) >= 2:
+        return None
+    return key
+
+def compact_text(text_content):
+    # Returns (compacted text, running header keys, stats) where stats counts
+    # the dropped pages and lines. Page headers are kept.
+    pages = split_pages(text_content) or [(None, text_content)]
+    header_pages = {}
+    for page_number, page_text in pages:
+        for key in {_running_header_key(line.strip()) for line in page_text.split("\n")[1:]} - {None}:
+            header_pages[key] = header_pages.get(key, 0) + 1
+    running_headers = {
+        key for key, count in header_pages.items()
+        if count >= COMPACT_REPEATED_LINE_MIN_PAGES and count >= COMPACT_REPEATED_LINE_SHARE * len(pages)
+    }
+
+    stats = {"dropped_pages": [], "dropped_lines": 0}
+    compacted_pages = []
+    for page_number, page_text in pages:
+        if page_number is not None and len(_VAS_GROUPED_AMOUNT.findall(page_text)) < COMPACT_MIN_AMOUNTS_PER_PAGE:
+            stats["dropped_pages"].append(page_number)
+            continue
+        lines = page_text.split("\n")
+        kept_lines = [lines[0].strip()] if page_number is not None else []
+        for line in lines[1 if page_number is not None else 0:]:
+            line = re.sub(r'\s+', ' ', line).strip()
+            if not line:
+                continue
+            if _is_compactable_line(line):
+                stats["dropped_lines"] += 1
+                continue
+            kept_lines.append(line)
+        compacted_pages.append("\n".join(kept_lines) + "\n")
+    return "".join(compacted_pages), running_headers, stats
+
+def drop_repeated_headers(text_content, running_headers):
+    # Keeps the first occurrence of each running header line; returns (text, lines dropped)
+    seen = set()
+    kept_lines = []
+    dropped = 0
+    for line in text_content.split("\n"):
+        key = _running_header_key(line) if running_headers else None
+        if key in running_headers:
+            if key in seen:
+                dropped += 1
+                continue
+            seen.add(key)
+        kept_lines.append(line)
+    return "\n".join(kept_lines), dropped
+
+# --- Helpers for chunked (map-reduce) extraction of long reports ---
+def _split_oversized_page(page, token_budget):
+    # A page over the budget is split on line boundaries, each part under the
+    # page's header line. A single line over the budget still goes out whole.
+    if estimate_tokens(page) <= token_budget:
+        return [page]
+    header, _, body = page.partition("\n")
+    parts = []
+    part = header + "\n"
+    for line in body.split("\n"):
+        if part != header + "\n" and estimate_tokens(part + line + "\n") > token_budget:
+            parts.append(part)
+            part = header + "\n"
+        part += line + "\n"
+    parts.append(part)
+    return parts
+
+def split_text_into_chunks(text_content, token_budget):
+    # Groups whole pages into windows of at most token_budget estimated tokens.
+    pages = re.split(r'(?m)^(?=--- PAGE \d+ ---$)', text_content)
+    pages = [part for page in pages if page.strip() for part in _split_oversized_page(page, token_budget)]
+    chunks = []
+    current_chunk = ""
+    for page in pages:
+        if current_chunk and estimate_tokens(current_chunk + page) > token_budget:
+            chunks.append(current_chunk)
+            current_chunk = ""
+        current_chunk += page
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+def merge_extracted_rows(rows):
+    # Chunks overlap when a statement spans a page boundary, so the same line
+    # item can come back twice. Keep the first occurrence of each
+    # statement_type/item_number/item/year, filling its value from a later
+    # duplicate if empty. The item number keeps apart VAS rows that share a name,
+    # e.g. "Nguyên giá" under codes 222, 225 and 228.
+    def normalize(value):
+        text = re.sub(r'\s+', ' ', str(value if value is not None else '')).strip().lower()
+        return '' if text in ('nan', 'none', 'null') else text
+
+    merged = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        key = (normalize(row.get('statement_type')), normalize(row.get('item_number')).strip('.'), normalize(row.get('item')), normalize(row.get('year')))
+        if key not in merged:
+            merged[key] = dict(row)
+        elif normalize(merged[key].get('value')) == '' and normalize(row.get('value')) != '':
+            merged[key]['value'] = row.get('value')
+    return list(merged.values())
+
+# --- Helper to normalise the parsed LLM JSON into a list of row dicts ---
+def coerce_extracted_rows(extracted_data, period, results):
+    if not isinstance(extracted_data, list):
+        results.append(f"Warning: Parsed JSON for {period} was not a simple array. Attempting to recover.")
+        if isinstance(extracted_data, dict) and "financial_statements" in extracted_data:
+            extracted_data = extracted_data["financial_statements"]
+        elif isinstance(extracted_data, dict) and "data" in extracted_data:
+            extracted_data = extracted_data["data"]
+        else:
+            extracted_data = []
+    return extracted_data
+
+# --- Helper to turn extracted rows into the per-period DataFrame and save it ---
+def save_extracted_rows(extracted_data, period, excel_dir, results, export_xlsx=False, metrics=None):
+    if not extracted_data:
+        results.append(f"No financial data was extracted or parsed successfully for {period}. Statement file not created.")
+        return False
+
+    df = pd.DataFrame(extracted_data)
+    if 'value' in df.columns:
+        df['value'] = parse_financial_values(df['value'])
+    
+    if 'year' not in df.columns:
+        df['year'] = period
+    else:
+        df['year'] = df['year'].astype(str)
+
+    written_paths = write_long_frame(df, excel_dir, f"{period}_financial_statements", export_xlsx=export_xlsx, metrics=metrics)
+    # Changed: Use the refined format_github_path for display
+    results.append(f"Successfully extracted {len(df)} financial items for {period}, cleaned, and saved to: {', '.join(format_github_path(path) for path in written_paths)}")
+    return True
+
+# Pass `llm` to use another LangChain chat model instead of Gemini, e.g.
+# langchain_core's FakeListChatModel to exercise the pipeline offline.
+# max_concurrency > 1 sends several periods to the model at once; results and
+# logs are still reported in period order. use_llm_cache=False bypasses the
+# response cache in <company>/llm_cache. chunk_token_budget caps the estimated
+# tokens of each request, instructions included: long texts are split on page
+# (or, for an oversized page, line) boundaries into windows that are extracted
+# concurrently and merged; a failed chunk is retried on its own up to
+# chunk_retries times. use_rule_parser converts confidently parsed VAS
+# statement pages directly and only sends the remaining pages to Gemini.
+# use_layout_tables sends Step 1's layout tables instead of the plain text;
+# compact_prompt drops prose pages, boilerplate and repeated headers first. Rows are stored as Parquet for the
+# merger; export_xlsx also writes the per-period Excel file.
+# progress_callback(message, done=None, total=None) is called as each Gemini
+# request finishes and as each period is saved. `metrics` (a stage view of
+# metrics.RunMetrics) records Gemini calls, the rule parser and file writes.
+def run_converter_process(company_folder_name, periods_to_process, extraction_method, start_page, end_page, page_ranges=None, use_located_pages=False, llm=None, max_concurrency=1, requests_per_second=None, max_retries=3, rate_limiter=None, use_llm_cache=True, chunk_token_budget=None, chunk_retries=1, use_rule_parser=False, export_xlsx=False, progress_callback=None, metrics=None, use_layout_tables=False, compact_prompt=False):
     company_base_path = Path(company_folder_name)
     json_dir = company_base_path / "json_statements"
     excel_dir = company_base_path / "excel_statements"
@@ -61,7 +411,8 @@ def run_converter_process(company_folder_name, periods_to_process, extraction_me
     json_dir.mkdir(parents=True, exist_ok=True)
     excel_dir.mkdir(parents=True, exist_ok=True)
 
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.05)
+    if llm is None:
+        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.05)
     prompt_template = ChatPromptTemplate.from_messages(
         [
             ("system", "You are an expert financial analyst. Your task is to extract various line items and their values from the provided text. "
@@ -76,17 +427,30 @@ def run_converter_process(company_folder_name, periods_to_process, extraction_me
     )
     output_parser = StrOutputParser()
     chain = prompt_template | llm | output_parser
+    instruction_tokens = estimate_tokens(prompt_template.format(text=""))
+    if chunk_token_budget and chunk_token_budget <= instruction_tokens:
+        raise ValueError(f"chunk_token_budget ({chunk_token_budget}) leaves no room for the text; the instructions alone take ~{instruction_tokens} tokens.")
 
-    results = []
-    processed_any_period = False # Track if any period was successfully processed
+    response_cache = LLMResponseCache(company_base_path / "llm_cache", llm, prompt_template) if use_llm_cache else None
+
+    # A limiter passed in by the caller (e.g. a batch run) takes precedence
+    if rate_limiter is None and requests_per_second:
+        rate_limiter = TokenBucketRateLimiter(requests_per_second)
+    report_progress = progress_callback or (lambda message, done=None, total=None: None)
+
+    # Each period collects its own log lines so that concurrent requests still
+    # produce the log in period order.
+    period_logs = {period: [] for period in periods_to_process}
+    prepared_periods = []
+    rule_rows = {}
     for period in periods_to_process:
+        results = period_logs[period]
         ocr_text_file_path = ocr_dir / f"{period}_ocr.txt"
-        output_json_file_path = json_dir / f"{period}_financial_statements_raw.json"
-        output_excel_file_path = excel_dir / f"{period}_financial_statements.xlsx"
 
         status_message = f"Processing period: {period}"
         print(status_message)
         results.append(status_message)
+        report_progress(status_message)
 
         if not ocr_text_file_path.exists():
             # Changed: Use the refined format_github_path for display
@@ -95,6 +459,14 @@ def run_converter_process(company_folder_name, periods_to_process, extraction_me
             results.append(error_message)
             continue
         
+        progress_manifest_path = ocr_dir / f"{period}_ocr.progress.json"
+        if progress_manifest_path.exists():
+            # Step 1 only replaces {period}_ocr.txt once every page is done, so the file
+            # is complete, but it predates the extraction run that was interrupted.
+            warning_message = f"Warning: Text extraction for {period} was interrupted ({format_github_path(progress_manifest_path)}). Using the text from the last completed run; rerun Step 1 to resume."
+            print(warning_message)
+            results.append(warning_message)
+
         try:
             with ocr_text_file_path.open("r", encoding="utf-8") as f:
                 ocr_content = f.read()
@@ -105,20 +477,195 @@ def run_converter_process(company_folder_name, periods_to_process, extraction_me
             results.append(error_message)
             continue
 
-        filtered_ocr_content = extract_pages(ocr_content, start_page, end_page)
+        # Gemini gets the layout tables; page selection and the rule parser
+        # still work on the plain text
+        layout_content = None
+        if use_layout_tables:
+            layout_content, layout_message = read_layout_tables(ocr_dir, period, ocr_text_file_path)
+            results.append(layout_message)
+
+        # A per-period range (if given) overrides the range shared by all periods
+        period_start_page, period_end_page = (page_ranges or {}).get(period, (start_page, end_page))
+        located_pages = None
+        pages_json_path = ocr_dir / f"{period}_pages.json"
+        if use_located_pages and period_start_page is None and period_end_page is None and pages_json_path.exists():
+            # Reuse the statement pages selected by the page locator in Step 1
+            with pages_json_path.open("r", encoding="utf-8") as f:
+                located_pages = json.load(f).get("pages") or None
+            if located_pages:
+                results.append(f"Using {len(located_pages)} located statement pages for {period} from {format_github_path(pages_json_path)}")
+        filtered_ocr_content = extract_pages(ocr_content, period_start_page, period_end_page, located_pages)
         
         if not filtered_ocr_content.strip():
-            warning_message = f"No content found in the specified page range ({start_page}-{end_page}) for {period}. Skipping LLM extraction."
+            warning_message = f"No content found in the specified page range ({period_start_page}-{period_end_page}) for {period}. Skipping LLM extraction."
             print(warning_message)
             results.append(warning_message)
             continue
 
-        llm_response = None
+        if use_rule_parser:
+            with timed(metrics, "rule_parser", period=period):
+                period_rule_rows, filtered_ocr_content, handled_pages = apply_rule_parser(filtered_ocr_content, period)
+            if handled_pages:
+                rule_rows[period] = period_rule_rows
+                results.append(f"Rule-based parser extracted {len(period_rule_rows)} rows from pages {', '.join(map(str, handled_pages))} of {period} without an LLM call.")
+            if not filtered_ocr_content.strip():
+                results.append(f"All pages of {period} were handled by the rule-based parser. Skipping Gemini.")
+                prepared_periods.append((period, []))
+                continue
+
+        if layout_content is not None:
+            plain_tokens = estimate_tokens(filtered_ocr_content)
+            remaining_pages = [page_number for page_number, _ in split_pages(filtered_ocr_content)]
+            filtered_ocr_content = extract_pages(layout_content, pages=remaining_pages)
+            results.append(f"Layout tables for {period}: ~{estimate_tokens(filtered_ocr_content)} tokens instead of ~{plain_tokens} for the plain text of the same {len(remaining_pages)} pages.")
+
+        if compact_prompt:
+            tokens_before = estimate_tokens(filtered_ocr_content)
+            with timed(metrics, "prompt_compaction", period=period):
+                filtered_ocr_content, running_headers, compaction_stats = compact_text(filtered_ocr_content)
+            if not filtered_ocr_content.strip():
+                results.append(f"No page of {period} has amounts left after compaction (~{tokens_before} tokens dropped). Skipping Gemini.")
+                if period in rule_rows:
+                    prepared_periods.append((period, []))
+                continue
+
+        chunks = [filtered_ocr_content]
+        if chunk_token_budget:
+            text_token_budget = chunk_token_budget - instruction_tokens - (estimate_tokens(LAYOUT_TABLE_NOTE) if layout_content is not None else 0)
+            if estimate_tokens(filtered_ocr_content) > text_token_budget:
+                chunks = split_text_into_chunks(filtered_ocr_content, max(text_token_budget, 1))
+                results.append(f"Split {period} (~{estimate_tokens(filtered_ocr_content)} tokens) into {len(chunks)} chunks of at most ~{chunk_token_budget} tokens per request (~{text_token_budget} of text) on page boundaries.")
+        if compact_prompt:
+            # Running headers are kept once per request, so every chunk has them
+            compacted_chunks = [drop_repeated_headers(chunk, running_headers) for chunk in chunks]
+            chunks = [chunk for chunk, _ in compacted_chunks]
+            tokens_after = sum(estimate_tokens(chunk) for chunk in chunks)
+            dropped_pages = compaction_stats["dropped_pages"]
+            results.append(
+                f"Compacted the text for {period}: ~{tokens_before} -> ~{tokens_after} tokens; dropped {len(dropped_pages)} pages without amounts"
+                f"{' (' + ', '.join(map(str, dropped_pages)) + ')' if dropped_pages else ''}, {compaction_stats['dropped_lines']} boilerplate or garbled lines "
+                f"and {sum(dropped for _, dropped in compacted_chunks)} repeated header lines."
+            )
+            if metrics is not None:
+                metrics.count("prompt_tokens_before_compaction", tokens_before)
+                metrics.count("prompt_tokens_after_compaction", tokens_after)
+        if layout_content is not None:
+            chunks = [LAYOUT_TABLE_NOTE + chunk for chunk in chunks]
+
+        status_message = f"Sending text for {period} (pages {period_start_page}-{period_end_page} if specified) to Gemini 2.5 Flash for extraction..."
+        print(status_message)
+        results.append(status_message)
+        prepared_periods.append((period, chunks))
+
+    # --- Send every chunk of every period to the LLM, at most max_concurrency at a time ---
+    llm_requests = [(period, chunk_index, chunk) for period, chunks in prepared_periods for chunk_index, chunk in enumerate(chunks)]
+    chunk_counts = {period: len(chunks) for period, chunks in prepared_periods}
+
+    def request_label(index):
+        period, chunk_index, _ = llm_requests[index]
+        if chunk_counts[period] == 1:
+            return period
+        return f"{period} (chunk {chunk_index+1}/{chunk_counts[period]})"
+
+    def send_requests(request_indices):
+        def report_retry(position, attempt, delay, error):
+            index = request_indices[position]
+            period_logs[llm_requests[index][0]].append(f"Transient error from Gemini for {request_label(index)} ({error}); retry {attempt}/{max_retries} in {delay:.1f}s.")
+
+        def report_cache_hit(position):
+            index = request_indices[position]
+            period_logs[llm_requests[index][0]].append(f"Using cached Gemini response for {request_label(index)} (same model, prompt and text as an earlier run).")
+
+        finished = [0]
+        def report_done(position, llm_response):
+            finished[0] += 1
+            outcome = "failed" if isinstance(llm_response, Exception) else "received"
+            report_progress(f"Gemini response {outcome} for {request_label(request_indices[position])}", finished[0], len(request_indices))
+
+        return run_chain_batch(
+            chain,
+            [{"text": llm_requests[index][2]} for index in request_indices],
+            max_concurrency=max_concurrency,
+            rate_limiter=rate_limiter,
+            max_retries=max_retries,
+            on_retry=report_retry,
+            response_cache=response_cache,
+            on_cache_hit=report_cache_hit,
+            on_done=report_done,
+            metrics=metrics,
+        )
+
+    def parse_chunk_response(llm_response):
+        if isinstance(llm_response, Exception):
+            raise llm_response
+        return parse_llm_json(llm_response)
+
+    if max_concurrency > 1 and len(llm_requests) > 1:
+        print(f"Sending {len(llm_requests)} requests to Gemini with up to {max_concurrency} concurrent requests...")
+    llm_responses = send_requests(list(range(len(llm_requests))))
+
+    # A chunk that failed (request error or unparseable JSON) is retried on its
+    # own instead of rerunning the whole period.
+    for retry_round in range(chunk_retries):
+        failed_indices = []
+        for index, llm_response in enumerate(llm_responses):
+            if chunk_counts[llm_requests[index][0]] == 1:
+                continue
+            try:
+                parse_chunk_response(llm_response)
+            except Exception as e:
+                failed_indices.append(index)
+                period_logs[llm_requests[index][0]].append(f"Chunk request failed for {request_label(index)}: {e}. Retrying this chunk.")
+        if not failed_indices:
+            break
+        for index, llm_response in zip(failed_indices, send_requests(failed_indices)):
+            llm_responses[index] = llm_response
+
+    period_responses = {period: [] for period, _ in prepared_periods}
+    for index, llm_response in enumerate(llm_responses):
+        period_responses[llm_requests[index][0]].append((index, llm_response))
+
+    processed_any_period = False # Track if any period was successfully processed
+    for period_index, (period, _) in enumerate(prepared_periods):
+        results = period_logs[period]
+        report_progress(f"Saving extracted rows for {period}", period_index, len(prepared_periods))
+        output_json_file_path = json_dir / f"{period}_financial_statements_raw.json"
+
+        if chunk_counts[period] != 1 or period in rule_rows:
+            # --- Reduce: merge the rule-based rows and the rows of every chunk that succeeded ---
+            try:
+                extracted_rows = list(rule_rows.get(period, []))
+                failed_chunks = 0
+                for index, llm_response in period_responses[period]:
+                    try:
+                        extracted_rows.extend(coerce_extracted_rows(parse_chunk_response(llm_response), request_label(index), results))
+                    except Exception as e:
+                        failed_chunks += 1
+                        results.append(f"Error: Chunk {request_label(index)} failed after retries: {e}. Its rows are missing.")
+                if failed_chunks and failed_chunks == chunk_counts[period] and period not in rule_rows:
+                    results.append(f"All {failed_chunks} chunks failed for {period}. Skipping this period.")
+                    continue
+                if chunk_counts[period]:
+                    results.append(f"Received responses from Gemini for {chunk_counts[period] - failed_chunks} of {chunk_counts[period]} chunks of {period}.")
+
+                extracted_data = merge_extracted_rows(extracted_rows)
+                results.append(f"Merged {len(extracted_rows)} rows into {len(extracted_data)} unique line items for {period}.")
+                with output_json_file_path.open("w", encoding="utf-8") as f:
+                    json.dump(extracted_data, f, ensure_ascii=False, indent=2)
+                # Changed: Use the refined format_github_path for display
+                results.append(f"Successfully saved merged extraction output for {period} to: {format_github_path(output_json_file_path)}")
+                if save_extracted_rows(extracted_data, period, excel_dir, results, export_xlsx, metrics):
+                    processed_any_period = True # Mark as successful for at least one period
+            except Exception as e:
+                error_message = f"An error occurred while merging chunk results or during Excel conversion for {period}: {e}"
+                print(error_message)
+                results.append(error_message)
+            continue
+
+        llm_response = period_responses[period][0][1]
         try:
-            status_message = f"Sending text for {period} (pages {start_page}-{end_page} if specified) to Gemini 2.5 Flash for extraction..."
-            print(status_message)
-            results.append(status_message)
-            llm_response = chain.invoke({"text": filtered_ocr_content})
+            if isinstance(llm_response, Exception):
+                raise llm_response
             status_message = f"Received response from Gemini for {period}."
             print(status_message)
             results.append(status_message)
@@ -130,40 +677,9 @@ def run_converter_process(company_folder_name, periods_to_process, extraction_me
             results.append(status_message)
 
             # --- Convert to Pandas DataFrame and Save to Excel ---
-            cleaned_json_string = llm_response.strip()
-            if cleaned_json_string.startswith("```json"):
-                cleaned_json_string = cleaned_json_string[len("```json"):].strip()
-            if cleaned_json_string.endswith("```"):
-                cleaned_json_string = cleaned_json_string[:-len("```")].strip()
-
-            extracted_data = json.loads(cleaned_json_string)
-
-            if not isinstance(extracted_data, list):
-                results.append(f"Warning: Parsed JSON for {period} was not a simple array. Attempting to recover.")
-                if isinstance(extracted_data, dict) and "financial_statements" in extracted_data:
-                    extracted_data = extracted_data["financial_statements"]
-                elif isinstance(extracted_data, dict) and "data" in extracted_data:
-                    extracted_data = extracted_data["data"]
-                else:
-                    extracted_data = []
-
-            if extracted_data:
-                df = pd.DataFrame(extracted_data)
-                if 'value' in df.columns:
-                    df['value'] = df['value'].astype(str).str.replace(',', '').str.strip()
-                    df['value'] = pd.to_numeric(df['value'], errors='coerce')
-                
-                if 'year' not in df.columns:
-                    df['year'] = period
-                else:
-                    df['year'] = df['year'].astype(str)
-
-                df.to_excel(output_excel_file_path, index=False)
-                # Changed: Use the refined format_github_path for display
-                results.append(f"Successfully extracted {len(df)} financial items for {period}, cleaned, and saved to: {format_github_path(output_excel_file_path)}")
+            extracted_data = coerce_extracted_rows(parse_llm_json(llm_response), period, results)
+            if save_extracted_rows(extracted_data, period, excel_dir, results, export_xlsx, metrics):
                 processed_any_period = True # Mark as successful for at least one period
-            else:
-                results.append(f"No financial data was extracted or parsed successfully for {period}. Excel file not created.")
 
         except json.JSONDecodeError as e:
             results.append(f"Error decoding JSON from LLM response for {period}: {e}")
@@ -173,9 +689,13 @@ def run_converter_process(company_folder_name, periods_to_process, extraction_me
             print(error_message)
             results.append(error_message)
 
+    results = [line for period in periods_to_process for line in period_logs[period]]
+    if response_cache is not None:
+        evicted = response_cache.evict()
+        results.append(f"\n{response_cache.summary()} {evicted} expired or excess entries evicted.")
     results.append("\n--- LLM Extraction Process Complete ---")
     
     if not processed_any_period:
         raise ValueError("No financial data was successfully extracted and converted to Excel for any period.")
         
-    return "\n".join(results)
\ No newline at end of file
+    return "\n".join(results)
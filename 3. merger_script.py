@@ -2,6 +2,10 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 import os
+import json
+import hashlib
+from disk_cache import atomic_write_text, file_digest
+from statement_store import find_stage_file, read_long_frame, write_long_frame
 
 # Define the GitHub repository name for display purposes
 REPO_NAME = "financial_statement_retriever_app"
@@ -23,7 +27,32 @@ def format_github_path(p: Path):
     # Prepend REPO_NAME
     return f"{REPO_NAME}/{path_str}"
 
-def run_merger_process(company_folder_name, periods_to_process):
+# --- Helpers for incremental merging ---
+# period_statements/merge_manifest.json records a content hash of every period's
+# input file and of every statement type's rows. A rerun only reloads periods
+# whose input changed and only rewrites statement files whose rows changed.
+MERGE_MANIFEST_NAME = "merge_manifest.json"
+
+def frame_fingerprint(df):
+    row_hashes = pd.util.hash_pandas_object(df.reset_index(drop=True), index=False).to_numpy()
+    return hashlib.sha256(row_hashes.tobytes() + ",".join(map(str, df.columns)).encode("utf-8")).hexdigest()
+
+def load_merge_manifest(manifest_path):
+    if not manifest_path.exists():
+        return {"periods": {}, "statement_types": {}}
+    try:
+        with manifest_path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"periods": {}, "statement_types": {}}
+
+# Reads the per-period Parquet files from the converter (or legacy Excel files)
+# and writes the combined and per-statement Parquet files; export_xlsx also
+# writes them as Excel. Unchanged periods are reused from the combined store
+# unless full_rebuild is set. progress_callback(message, done=None, total=None)
+# is called as each period is read and each statement type is saved.
+# `metrics` (a stage view of metrics.RunMetrics) times every file read and write.
+def run_merger_process(company_folder_name, periods_to_process, export_xlsx=False, full_rebuild=False, progress_callback=None, metrics=None):
     company_base_path = Path(company_folder_name)
     base_dir = company_base_path / "excel_statements"
     period_statements_dir = company_base_path / "period_statements"
@@ -33,18 +62,52 @@ def run_merger_process(company_folder_name, periods_to_process):
     results = []
     results.append(f"{' BEGINNING CONCATENATING EACH PERIODS ':=^100}")
 
+    manifest_path = period_statements_dir / MERGE_MANIFEST_NAME
+    manifest = {"periods": {}, "statement_types": {}} if full_rebuild else load_merge_manifest(manifest_path)
+    new_manifest = {"periods": {}, "statement_types": {}}
+
+    # Rows of unchanged periods come from the previous combined store, which tags
+    # every row with the period it was loaded from.
+    previous_combined_path = find_stage_file(period_statements_dir, "all_periods_concatenated")
+    previous_combined = None
+    if not full_rebuild and previous_combined_path is not None and previous_combined_path.suffix == ".parquet":
+        try:
+            previous_combined = read_long_frame(previous_combined_path, metrics)
+            if "source_period" not in previous_combined.columns:
+                previous_combined = None
+        except Exception as e:
+            results.append(f"Warning: Could not read the previous combined store ({e}). Rebuilding from all periods.")
+            previous_combined = None
+
     financial_statements = []
     found_files_count = 0
-    for period in periods_to_process:
-        statement_path = base_dir / f"{period}_financial_statements.xlsx"
-        if not statement_path.exists():
+    reused_periods = []
+    reloaded_periods = []
+    report_progress = progress_callback or (lambda message, done=None, total=None: None)
+    for period_index, period in enumerate(periods_to_process):
+        report_progress(f"Reading statements for {period}", period_index, len(periods_to_process))
+        statement_path = find_stage_file(base_dir, f"{period}_financial_statements")
+        if statement_path is None:
             # Changed: Use the refined format_github_path for display
-            msg = f'Warning: Excel file not found for period {period} at {format_github_path(statement_path)}. Skipping this period.'
+            msg = f'Warning: Statement file not found for period {period} at {format_github_path(base_dir / f"{period}_financial_statements.parquet")}. Skipping this period.'
             results.append(msg)
             continue
         try:
-            df_statement = pd.read_excel(statement_path)
+            fingerprint = file_digest(statement_path)
+            previous_entry = manifest["periods"].get(str(period), {})
+            if (previous_combined is not None
+                    and previous_entry.get("hash") == fingerprint
+                    and previous_entry.get("source") == statement_path.name):
+                df_statement = previous_combined[previous_combined["source_period"] == str(period)]
+                reused_periods.append(str(period))
+            else:
+                df_statement = read_long_frame(statement_path, metrics)
+                if 'statement_type' in df_statement.columns:
+                    df_statement['statement_type'] = df_statement['statement_type'].astype(str).str.title()
+                df_statement['source_period'] = str(period)
+                reloaded_periods.append(str(period))
             financial_statements.append(df_statement)
+            new_manifest["periods"][str(period)] = {"source": statement_path.name, "hash": fingerprint}
             found_files_count += 1
         except Exception as e:
             # Changed: Use the refined format_github_path for display
@@ -53,9 +116,10 @@ def run_merger_process(company_folder_name, periods_to_process):
             continue
 
     if found_files_count > 0:
-        results.append(f'Successfully read in {found_files_count} years of financial statements in Excel \n')
+        results.append(f'Successfully read in {found_files_count} years of financial statements \n')
+        results.append(f"Incremental merge: {len(reloaded_periods)} new or changed periods loaded ({', '.join(reloaded_periods) or 'none'}), {len(reused_periods)} unchanged periods reused ({', '.join(reused_periods) or 'none'}).")
     else:
-        msg = f'No financial statements were successfully read from Excel files. Please check paths and file existence.'
+        msg = f'No financial statements were successfully read from the statement files. Please check paths and file existence.'
         results.append(msg)
         raise ValueError(msg) # Raise error if no files found
 
@@ -69,18 +133,25 @@ def run_merger_process(company_folder_name, periods_to_process):
         # This is a warning, not necessarily a hard stop, but could be upgraded to an error if desired.
 
     if 'statement_type' in concatenated_df.columns:
-        concatenated_df['statement_type'] = concatenated_df['statement_type'].astype(str).str.title()
         results.append("Applied proper casing to 'statement_type' column.")
 
     results.append("\n--- Saving Full Concatenated DataFrame ---")
-    full_concatenated_output_path = period_statements_dir / "all_periods_concatenated.xlsx"
-    try:
-        concatenated_df.to_excel(full_concatenated_output_path, index=False)
-        # Changed: Use the refined format_github_path for display
-        results.append(f"Successfully saved full concatenated DataFrame to: {format_github_path(full_concatenated_output_path)}")
-    except Exception as e:
-        results.append(f"ERROR: Could not save full concatenated DataFrame: {e}")
-        raise # Re-raise the exception if saving fails
+    combined_unchanged = (
+        not reloaded_periods
+        and previous_combined is not None
+        and list(manifest["periods"]) == list(new_manifest["periods"])
+        and not export_xlsx
+    )
+    if combined_unchanged:
+        results.append("No period changed since the last merge. Keeping the existing combined store.")
+    else:
+        try:
+            written_paths = write_long_frame(concatenated_df, period_statements_dir, "all_periods_concatenated", export_xlsx=export_xlsx, metrics=metrics)
+            # Changed: Use the refined format_github_path for display
+            results.append(f"Successfully saved full concatenated DataFrame to: {', '.join(format_github_path(path) for path in written_paths)}")
+        except Exception as e:
+            results.append(f"ERROR: Could not save full concatenated DataFrame: {e}")
+            raise # Re-raise the exception if saving fails
     results.append("------------------------------------------")
 
     results.append(f"\n{' SEPARATING BY STATEMENT TYPE AND SAVING ':=^100}")
@@ -90,22 +161,34 @@ def run_merger_process(company_folder_name, periods_to_process):
     if len(unique_statement_types) > 0:
         results.append(f"Found {len(unique_statement_types)} unique statement types: {', '.join(unique_statement_types)}")
         processed_any_statement_type = False
-        for st_type in unique_statement_types:
+        for type_index, st_type in enumerate(unique_statement_types):
+            report_progress(f"Saving '{st_type}'", type_index, len(unique_statement_types))
             df_filtered = concatenated_df[concatenated_df['statement_type'] == st_type].copy()
-            output_file_path = period_statements_dir / f"{st_type}.xlsx"
+            rows_fingerprint = frame_fingerprint(df_filtered)
+            new_manifest["statement_types"][st_type] = rows_fingerprint
+            if (manifest["statement_types"].get(st_type) == rows_fingerprint
+                    and find_stage_file(period_statements_dir, st_type) is not None
+                    and not export_xlsx):
+                results.append(f"  - '{st_type}' is unchanged. Keeping the existing file.")
+                processed_any_statement_type = True
+                continue
             try:
-                df_filtered.to_excel(output_file_path, index=False)
+                written_paths = write_long_frame(df_filtered, period_statements_dir, st_type, export_xlsx=export_xlsx, metrics=metrics)
                 # Changed: Use the refined format_github_path for display
-                results.append(f"  - Successfully saved '{st_type}' to: {format_github_path(output_file_path)}")
+                results.append(f"  - Successfully saved '{st_type}' to: {', '.join(format_github_path(path) for path in written_paths)}")
                 processed_any_statement_type = True
             except Exception as e:
+                # Don't record a fingerprint for a file that failed to save
+                new_manifest["statement_types"].pop(st_type, None)
                 # Changed: Use the refined format_github_path for display
-                results.append(f"  - ERROR: Could not save '{st_type}' to {format_github_path(output_file_path)}: {e}")
+                results.append(f"  - ERROR: Could not save '{st_type}' to {format_github_path(period_statements_dir / f'{st_type}.parquet')}: {e}")
         if not processed_any_statement_type:
             raise ValueError("No individual statement type files could be saved after concatenation.")
     else:
         results.append("No unique 'statement_type' found in the concatenated data. No individual files created.")
         raise ValueError("No unique 'statement_type' found in the concatenated data.")
 
+    atomic_write_text(manifest_path, json.dumps(new_manifest, ensure_ascii=False, indent=2))
+
     results.append("\n--- Statement Separation and Saving Complete ---")
-    return "\n".join(results)
\ No newline at end of file
+    return "\n".join(results)
@@ -1,6 +1,7 @@
-import pandas as pd
 from pathlib import Path
 import os
+from statement_store import find_stage_file, read_long_frame, write_wide_frame
+from value_parser import parse_financial_values
 
 # Define the GitHub repository name for display purposes
 REPO_NAME = "financial_statement_retriever_app"
@@ -22,19 +23,25 @@ def format_github_path(p: Path):
     # Prepend REPO_NAME
     return f"{REPO_NAME}/{path_str}"
 
-def run_formatter_process(company_folder_name, periods_to_process):
+# Reads the combined Parquet file from the merger (or the legacy Excel file) and
+# writes one wide Parquet file per statement; export_xlsx also writes Excel.
+# progress_callback(message, done=None, total=None) is called per statement.
+# `metrics` (a stage view of metrics.RunMetrics) times every file read and write.
+def run_formatter_process(company_folder_name, periods_to_process, export_xlsx=False, progress_callback=None, metrics=None):
     company_base_path = Path(company_folder_name)
     period_statements_dir = company_base_path / "period_statements"
     final_statements_dir = company_base_path / "final_statements"
 
     final_statements_dir.mkdir(parents=True, exist_ok=True)
+    report_progress = progress_callback or (lambda message, done=None, total=None: None)
 
     results = []
     results.append("--- Starting Financial Statement Reformatting ---")
 
-    all_periods_file_path = period_statements_dir / "all_periods_concatenated.xlsx"
+    all_periods_file_path = find_stage_file(period_statements_dir, "all_periods_concatenated")
     
-    if not all_periods_file_path.exists():
+    if all_periods_file_path is None:
+        all_periods_file_path = period_statements_dir / "all_periods_concatenated.parquet"
         # Changed: Use the refined format_github_path for display
         msg = f"Error: Combined file '{format_github_path(all_periods_file_path)}' not found. Cannot proceed with formatting."
         results.append(msg)
@@ -45,7 +52,7 @@ def run_formatter_process(company_folder_name, periods_to_process):
     
     processed_any_statement = False
     try:
-        df_long = pd.read_excel(all_periods_file_path)
+        df_long = read_long_frame(all_periods_file_path, metrics)
 
         required_columns = ['item', 'year', 'value', 'statement_type']
         if not all(col in df_long.columns for col in required_columns):
@@ -54,17 +61,7 @@ def run_formatter_process(company_folder_name, periods_to_process):
             results.append(msg)
             raise ValueError(msg)
         else:
-            def clean_value(x):
-                s = str(x).strip()
-                if s == 'nan' or s == '' or s.lower() == 'n/a':
-                    return pd.NA
-                if s.startswith('(') and s.endswith(')'):
-                    s = '-' + s[1:-1]
-                s = s.replace(',', '').replace(' ', '')
-                s = pd.Series([s]).replace(r'[^\d\.\-]', '', regex=True).iloc[0]
-                return pd.to_numeric(s, errors='coerce')
-
-            df_long['value'] = df_long['value'].apply(clean_value)
+            df_long['value'] = parse_financial_values(df_long['value'])
             df_long = df_long.dropna(subset=['item', 'year'])
             df_long['item'] = df_long['item'].astype(str)
             df_long['year'] = df_long['year'].astype(str)
@@ -76,7 +73,9 @@ def run_formatter_process(company_folder_name, periods_to_process):
                 .agg({'value': 'first'})
             )
 
-            for st_type in df_grouped['statement_type'].unique():
+            statement_types = df_grouped['statement_type'].unique()
+            for type_index, st_type in enumerate(statement_types):
+                report_progress(f"Formatting '{st_type}'", type_index, len(statement_types))
                 df_statement_type = df_grouped[df_grouped['statement_type'] == st_type]
                 
                 df_wide = df_statement_type.pivot_table(index='item', columns='year', values='value', aggfunc='first')
@@ -87,10 +86,9 @@ def run_formatter_process(company_folder_name, periods_to_process):
                     remaining = [c for c in df_wide.columns if c not in ordered]
                     df_wide = df_wide.reindex(columns=ordered + remaining)
 
-                output_file = final_statements_dir / f"{st_type}.xlsx"
-                df_wide.to_excel(output_file)
+                written_paths = write_wide_frame(df_wide, final_statements_dir, st_type, export_xlsx=export_xlsx, metrics=metrics)
                 # Changed: Use the refined format_github_path for display
-                results.append(f"Successfully reformatted and saved '{st_type}' to: {format_github_path(output_file)}")
+                results.append(f"Successfully reformatted and saved '{st_type}' to: {', '.join(format_github_path(path) for path in written_paths)}")
                 processed_any_statement = True
     except Exception as e:
         # Changed: Use the refined format_github_path for display
@@ -1,10 +1,13 @@
-import pandas as pd
 from pathlib import Path
 import os
 import json
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from llm_utils import TokenBucketRateLimiter, LLMResponseCache, parse_llm_json, run_chain_batch
+from statement_store import find_stage_file, list_stage_stems, read_wide_frame
+from standardization_store import StandardizationDictionary, STANDARDIZATION_DICTIONARY_PATH, merge_item_order
+from metrics import timed
 
 # Define the GitHub repository name for display purposes
 REPO_NAME = "financial_statement_retriever_app"
@@ -26,14 +29,30 @@ def format_github_path(p: Path):
     # Prepend REPO_NAME
     return f"{REPO_NAME}/{path_str}"
 
-def run_standardizer_process(company_folder_name):
+# Longest item list sent in one standardization request
+STANDARDIZATION_BATCH_SIZE = 120
+
+# use_llm_cache=False bypasses the response cache in <company>/llm_cache.
+# Items are first looked up in the standardization dictionary shared by all
+# companies (exact, normalized and fuzzy matches); only unresolved items are
+# sent to Gemini and its answers are added to the dictionary.
+# use_dictionary=False sends every item to Gemini as before.
+# Statement files are standardized concurrently, with up to max_concurrency
+# requests in flight; item lists longer than batch_size are split into several
+# requests. The log is still reported in file order. Pass `dictionary` to
+# share one StandardizationDictionary between concurrent runs.
+# progress_callback(message, done=None, total=None) is called as each Gemini
+# request finishes and as each file is saved. `metrics` (a stage view of
+# metrics.RunMetrics) records Gemini calls and every file read and write.
+def run_standardizer_process(company_folder_name, llm=None, use_llm_cache=True, use_dictionary=True, dictionary_path=STANDARDIZATION_DICTIONARY_PATH, max_concurrency=4, requests_per_second=None, max_retries=3, rate_limiter=None, batch_size=STANDARDIZATION_BATCH_SIZE, dictionary=None, progress_callback=None, metrics=None):
     company_base_path = Path(company_folder_name)
     input_dir = company_base_path / "final_statements"
     output_dir = company_base_path / "final_statements_standardized"
 
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.5)
+    if llm is None:
+        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.5)
     prompt_template = ChatPromptTemplate.from_messages(
         [
             ("system", "You are an expert financial analyst specializing in financial statements. "
@@ -47,30 +66,51 @@ def run_standardizer_process(company_folder_name):
                        "Output the mapping as a JSON array of objects. Each object in the array should represent a standardized item and contain two keys: "
                        "'standardized_item' (the proposed standardized name) and 'original_items' (a list of all original items that map to this standardized name). "
                        "The order of objects in the JSON array MUST represent the logical order of items in a financial statement (e.g., assets before liabilities, short-term before long-term, and within sections, by line item number if present). "
-                       "Ensure all original items from the input list are present in your output mapping under their respective standardized items."),
-            ("human", "Standardize the following financial statement items:\n\n{items_list_json}")
+                       "Ensure all original items from the input list are present in your output mapping under their respective standardized items. "
+                       "You may also be given standardized names already in use for this statement; when an item means the same as one of them, reuse that exact name."),
+            ("human", "Standardized names already in use for this statement:\n\n{known_items_json}\n\n"
+                      "Standardize the following financial statement items:\n\n{items_list_json}")
         ]
     )
     output_parser = StrOutputParser()
     chain = prompt_template | llm | output_parser
+    response_cache = LLMResponseCache(company_base_path / "llm_cache", llm, prompt_template) if use_llm_cache else None
+    if not use_dictionary:
+        dictionary = None
+    elif dictionary is None:
+        dictionary = StandardizationDictionary(dictionary_path)
+    match_counts = {"exact": 0, "normalized": 0, "fuzzy": 0, "llm": 0}
+
+    # A limiter passed in by the caller (e.g. a batch run) takes precedence
+    if rate_limiter is None and requests_per_second:
+        rate_limiter = TokenBucketRateLimiter(requests_per_second)
+    report_progress = progress_callback or (lambda message, done=None, total=None: None)
 
     results = []
     results.append("--- Starting Financial Statement Item Standardization ---")
 
-    found_files_to_standardize = False
+    # Each file collects its own log lines so that concurrent requests still
+    # produce the log in file order.
+    statement_names = list_stage_stems(input_dir)
+    file_logs = {statement_name: [] for statement_name in statement_names}
+    prepared_files = []
+    llm_requests = [] # (statement_name, batch number, inputs)
+    found_files_to_standardize = bool(statement_names)
     processed_any_file_successfully = False
 
-    for file_path in input_dir.glob("*.xlsx"):
-        found_files_to_standardize = True
+    # Parquet files from the formatter, or Excel files from older runs
+    for statement_name in statement_names:
+        file_log = file_logs[statement_name]
+        file_path = find_stage_file(input_dir, statement_name)
         # Changed: Use the refined format_github_path for display
-        results.append(f"\nProcessing file for standardization: {format_github_path(file_path)}")
+        file_log.append(f"\nProcessing file for standardization: {format_github_path(file_path)}")
         try:
-            df_wide = pd.read_excel(file_path, index_col=0)
+            df_wide = read_wide_frame(file_path, metrics)
 
             if df_wide.empty:
                 # Changed: Use the refined format_github_path for display
                 msg = f"  Warning: {format_github_path(file_path)} is empty. Skipping standardization."
-                results.append(msg)
+                file_log.append(msg)
                 continue
 
             items_to_standardize = df_wide.index.astype(str).unique().tolist()
@@ -78,61 +118,146 @@ def run_standardizer_process(company_folder_name):
             if not items_to_standardize:
                 # Changed: Use the refined format_github_path for display
                 msg = f"  No items found in {format_github_path(file_path)} to standardize. Skipping."
-                results.append(msg)
+                file_log.append(msg)
                 continue
 
-            results.append(f"  Found {len(items_to_standardize)} unique items. Sending to Gemini for standardization...")
-            
-            items_list_json = json.dumps(items_to_standardize, ensure_ascii=False, indent=2)
-            llm_response = chain.invoke({"items_list_json": items_list_json})
+            file_log.append(f"  Found {len(items_to_standardize)} unique items.")
+
+            if dictionary is not None:
+                with timed(metrics, "dictionary_resolve", items=len(items_to_standardize)):
+                    item_mapping, match_kinds, unresolved_items = dictionary.resolve(statement_name, items_to_standardize)
+                for kind in match_kinds.values():
+                    match_counts[kind] += 1
+                file_log.append(f"  Resolved {len(item_mapping)} items from the standardization dictionary, {len(unresolved_items)} unresolved.")
+            else:
+                item_mapping, unresolved_items = {}, items_to_standardize
+
+            batches = [unresolved_items[i:i + batch_size] for i in range(0, len(unresolved_items), batch_size)]
+            if batches:
+                known_items_json = json.dumps(dictionary.known_names(statement_name) if dictionary is not None else [], ensure_ascii=False, indent=2)
+                batch_note = f" in {len(batches)} batches" if len(batches) > 1 else ""
+                file_log.append(f"  Sending {len(unresolved_items)} items to Gemini for standardization{batch_note}...")
+                for batch_number, batch in enumerate(batches, start=1):
+                    llm_requests.append((statement_name, batch_number, {
+                        "known_items_json": known_items_json,
+                        "items_list_json": json.dumps(batch, ensure_ascii=False, indent=2),
+                    }))
+                match_counts["llm"] += len(unresolved_items)
+            else:
+                file_log.append("  All items resolved locally. No Gemini request needed.")
+            prepared_files.append((statement_name, file_path, df_wide, item_mapping, len(batches)))
+        except Exception as e:
             # Changed: Use the refined format_github_path for display
-            results.append(f"  Received standardization mapping from Gemini for {format_github_path(file_path)}.")
+            file_log.append(f"  ERROR processing {format_github_path(file_path)}: {e}")
+            # Do not re-raise here, allow other files to be processed
 
-            cleaned_json_string = llm_response.strip()
-            if cleaned_json_string.startswith("```json"):
-                cleaned_json_string = cleaned_json_string[len("```json"):].strip()
-            if cleaned_json_string.endswith("```"):
-                cleaned_json_string = cleaned_json_string[:-len("```")].strip()
+    def report_retry(index, attempt, delay, error):
+        statement_name, batch_number, _ = llm_requests[index]
+        file_logs[statement_name].append(f"  Transient error from Gemini for batch {batch_number} ({error}); retry {attempt}/{max_retries} in {delay:.1f}s.")
 
-            standardization_groups = json.loads(cleaned_json_string)
-            
-            item_mapping = {}
-            ordered_standardized_items = []
+    def report_cache_hit(index):
+        statement_name, batch_number, _ = llm_requests[index]
+        file_logs[statement_name].append(f"  Using cached Gemini response for batch {batch_number} (same model, prompt and items as an earlier run).")
 
-            for group in standardization_groups:
-                standardized_name = group['standardized_item']
-                ordered_standardized_items.append(standardized_name)
-                for original_item in group['original_items']:
-                    item_mapping[original_item] = standardized_name
+    finished = [0]
+    def report_done(index, llm_response):
+        statement_name, batch_number, _ = llm_requests[index]
+        finished[0] += 1
+        outcome = "failed" if isinstance(llm_response, Exception) else "received"
+        report_progress(f"Gemini response {outcome} for '{statement_name}' (batch {batch_number})", finished[0], len(llm_requests))
+
+    if max_concurrency > 1 and len(llm_requests) > 1:
+        results.append(f"Sending {len(llm_requests)} standardization requests to Gemini with up to {max_concurrency} in flight.")
+    llm_responses = run_chain_batch(
+        chain,
+        [inputs for _, _, inputs in llm_requests],
+        max_concurrency=max_concurrency,
+        rate_limiter=rate_limiter,
+        max_retries=max_retries,
+        on_retry=report_retry,
+        response_cache=response_cache,
+        on_cache_hit=report_cache_hit,
+        on_done=report_done,
+        metrics=metrics,
+    )
+    responses_by_file = {}
+    for (statement_name, _, _), llm_response in zip(llm_requests, llm_responses):
+        responses_by_file.setdefault(statement_name, []).append(llm_response)
+
+    # Applied in file order, so the dictionary and the log come out the same
+    # whatever order the requests finished in
+    for file_index, (statement_name, file_path, df_wide, item_mapping, batch_count) in enumerate(prepared_files):
+        file_log = file_logs[statement_name]
+        report_progress(f"Saving standardized '{statement_name}'", file_index, len(prepared_files))
+        llm_response = None
+        try:
+            llm_order = []
+            for batch_number, llm_response in enumerate(responses_by_file.get(statement_name, []), start=1):
+                if isinstance(llm_response, Exception):
+                    raise llm_response
+                standardization_groups = parse_llm_json(llm_response)
+                batch_order = []
+                for group in standardization_groups:
+                    batch_order.append(group['standardized_item'])
+                    for original_item in group['original_items']:
+                        item_mapping[original_item] = group['standardized_item']
+                llm_order = merge_item_order(llm_order, batch_order)
+                if dictionary is not None:
+                    dictionary.update(statement_name, standardization_groups)
+            if batch_count:
+                # Changed: Use the refined format_github_path for display
+                file_log.append(f"  Received standardization mapping from Gemini for {format_github_path(file_path)}.")
+
+            if dictionary is not None:
+                ordered_standardized_items = dictionary.ordered_names(statement_name, item_mapping.values())
+            else:
+                ordered_standardized_items = llm_order
 
             df_temp = df_wide.rename(index=item_mapping)
             df_aggregated = df_temp.groupby(df_temp.index).sum()
             df_standardized = df_aggregated.reindex(ordered_standardized_items)
 
-            output_file_path = output_dir / file_path.name
+            # The standardized statements are the final export, so they stay Excel
+            output_file_path = output_dir / f"{statement_name}.xlsx"
             
-            df_standardized.to_excel(output_file_path)
+            with timed(metrics, "excel_write", file=output_file_path.name, rows=len(df_standardized)):
+                df_standardized.to_excel(output_file_path)
             # Changed: Use the refined format_github_path for display
-            results.append(f"  Successfully standardized and saved '{format_github_path(file_path)}' to: {format_github_path(output_file_path)}")
-            results.append(f"  Final standardized DataFrame shape: {df_standardized.shape}")
-            results.append(f"  Final standardized DataFrame head:\n{df_standardized.head().to_string()}")
+            file_log.append(f"  Successfully standardized and saved '{format_github_path(file_path)}' to: {format_github_path(output_file_path)}")
+            file_log.append(f"  Final standardized DataFrame shape: {df_standardized.shape}")
+            file_log.append(f"  Final standardized DataFrame head:\n{df_standardized.head().to_string()}")
             processed_any_file_successfully = True
 
         except json.JSONDecodeError as e:
             # Changed: Use the refined format_github_path for display
-            results.append(f"  ERROR: JSON decoding failed for LLM response for {format_github_path(file_path)}: {e}")
-            results.append(f"  LLM Response (raw):\n{llm_response}")
+            file_log.append(f"  ERROR: JSON decoding failed for LLM response for {format_github_path(file_path)}: {e}")
+            file_log.append(f"  LLM Response (raw):\n{llm_response}")
             # Do not re-raise here, allow other files to be processed
         except Exception as e:
             # Changed: Use the refined format_github_path for display
-            results.append(f"  ERROR processing {format_github_path(file_path)}: {e}")
+            file_log.append(f"  ERROR processing {format_github_path(file_path)}: {e}")
             # Do not re-raise here, allow other files to be processed
 
+    for statement_name in statement_names:
+        results.extend(file_logs[statement_name])
+
+    if dictionary is not None:
+        dictionary.save()
+        results.append(
+            f"\nStandardization dictionary: {match_counts['exact']} exact, {match_counts['normalized']} normalized and "
+            f"{match_counts['fuzzy']} fuzzy matches; {match_counts['llm']} items sent to Gemini. "
+            f"{dictionary.item_count()} items stored in {format_github_path(dictionary.path)}."
+        )
+
     if not found_files_to_standardize:
         # Changed: Use the refined format_github_path for display
-        raise FileNotFoundError(f"No Excel files found in '{format_github_path(input_dir)}' to standardize. Please ensure previous steps completed.")
+        raise FileNotFoundError(f"No statement files found in '{format_github_path(input_dir)}' to standardize. Please ensure previous steps completed.")
     if not processed_any_file_successfully:
         raise ValueError("No financial statements were successfully standardized. Check logs for errors.")
 
+    if response_cache is not None:
+        evicted = response_cache.evict()
+        results.append(f"\n{response_cache.summary()} {evicted} expired or excess entries evicted.")
+
     results.append("\n--- Financial Statement Item Standardization Complete ---")
     return "\n".join(results)
\ No newline at end of file
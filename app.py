@@ -2,12 +2,10 @@ import streamlit as st
 from pathlib import Path
 import os
 
-# Import your refactored scripts
-from pdf_to_text_script import run_pdf_to_text_process
-from converter_script import run_converter_process
-from merger_script import run_merger_process
-from formatter_script import run_formatter_process
-from standardizer_script import run_standardizer_process
+# Runs the refactored scripts as background pipeline jobs
+from jobs import JobRegistry
+
+JOB_REFRESH_SECONDS = 2 # How often the jobs section polls running jobs
 
 st.set_page_config(layout="wide")
 st.title("📊 Financial Statement Data Retriever")
@@ -32,8 +30,45 @@ periods_to_process = [p.strip() for p in periods_input.split(',') if p.strip()]
 
 extraction_method = st.radio(
     "Choose PDF text extraction method:",
-    ('OCR', 'Direct'),
-    index=0 # Default to OCR
+    ('OCR', 'Direct', 'Hybrid'),
+    index=0, # Default to OCR
+    help="Hybrid reads the PDF text layer where a page has one and OCRs only scanned pages, starting at a lower DPI."
+)
+
+ocr_workers = st.number_input(
+    "Number of parallel worker processes for PDF text extraction (1 = sequential):",
+    min_value=1,
+    max_value=os.cpu_count() or 1,
+    value=1
+)
+
+use_ocr_cache = st.checkbox(
+    "Reuse cached OCR text for pages that have not changed",
+    value=True
+)
+
+ocr_engine = st.selectbox(
+    "OCR engine:",
+    ("auto", "tesserocr", "pytesseract"),
+    index=0,
+    help="tesserocr keeps one Tesseract instance loaded per worker instead of starting Tesseract for every page; auto uses it when it is installed."
+)
+
+ocr_preprocess_steps = st.multiselect(
+    "Preprocess scanned pages before OCR:",
+    ["binarize", "crop", "deskew", "remove_non_text"],
+    default=[],
+    help="Binarize (Otsu threshold), crop blank margins, straighten skewed scans and erase logos or stamps before Tesseract reads the page."
+)
+
+use_layout_tables = st.checkbox(
+    "Keep table columns (send Gemini pipe-delimited rows rebuilt from word positions)",
+    value=False
+)
+
+auto_locate_pages = st.checkbox(
+    "Automatically locate the financial statement pages (used for periods without a page range)",
+    value=False
 )
 
 page_range_input = st.text_input(
@@ -58,6 +93,85 @@ if page_range_input:
     except ValueError:
         st.warning("Invalid page number in range. Processing all pages.")
 
+period_page_ranges_input = st.text_input(
+    "Optional page range per period, overriding the range above (e.g., 2021: 5-12; 2022: 6-14):",
+    value=""
+)
+
+# Per-period ranges fall back to the shared range for periods that are not listed
+page_ranges = {}
+if period_page_ranges_input:
+    for entry in period_page_ranges_input.split(';'):
+        if not entry.strip():
+            continue
+        try:
+            period_str, range_str = entry.split(':')
+            start_str, end_str = range_str.split('-')
+            period_start, period_end = int(start_str), int(end_str)
+            if period_start > period_end:
+                st.warning(f"Warning: Start page is greater than end page for '{entry.strip()}'. Using the shared page range.")
+                continue
+            page_ranges[period_str.strip()] = (period_start, period_end)
+        except ValueError:
+            st.warning(f"Invalid per-period page range '{entry.strip()}'. Using the shared page range.")
+for period in periods_to_process:
+    if period not in page_ranges and (start_page is not None or end_page is not None):
+        page_ranges[period] = (start_page, end_page)
+
+llm_concurrency = st.number_input(
+    "Maximum concurrent Gemini requests (periods and statement files are processed in parallel when above 1):",
+    min_value=1,
+    max_value=16,
+    value=4
+)
+
+llm_requests_per_second = st.number_input(
+    "Gemini request rate limit (requests per second, 0 = unlimited):",
+    min_value=0.0,
+    value=0.0,
+    step=0.5
+)
+
+chunk_token_budget = st.number_input(
+    "Split long reports into chunks of at most this many tokens per Gemini request (0 = send each period in one request):",
+    min_value=0,
+    value=0,
+    step=1000
+)
+
+compact_prompt = st.checkbox(
+    "Compact the text before sending it to Gemini (drop cover letters, prose pages, boilerplate and repeated page headers)",
+    value=False
+)
+
+use_rule_parser = st.checkbox(
+    "Parse coded Vietnamese statement pages (Mã số layout) directly and send only the remaining pages to Gemini",
+    value=False
+)
+
+use_llm_cache = st.checkbox(
+    "Reuse cached Gemini responses when the model, prompt and input text are unchanged",
+    value=True
+)
+
+use_standardization_dictionary = st.checkbox(
+    "Resolve line items from the shared standardization dictionary before asking Gemini",
+    value=True,
+    help="Known items are matched locally (exact, normalized and fuzzy). Only new items are sent to Gemini, and its answers are added to standardization_dictionary.json."
+)
+
+export_intermediate_xlsx = st.checkbox(
+    "Also export intermediate Excel files (excel_statements, period_statements, final_statements)",
+    value=False,
+    help="Stages hand data to each other as Parquet; only the standardized statements are always exported to Excel."
+)
+
+skip_up_to_date_stages = st.checkbox(
+    "Skip stages whose inputs, settings and code are unchanged since their last run",
+    value=True,
+    help="Turn off to rerun every stage for the selected periods."
+)
+
 # --- Google API Key Input ---
 google_api_key = st.text_input("Enter your Google API Key (required for LLM steps):", type="password")
 if google_api_key:
@@ -71,6 +185,13 @@ else:
 st.markdown("---")
 st.header("2. Run Workflow")
 
+@st.cache_resource
+def get_job_registry():
+    # One registry per server process, so jobs keep running across reruns and page reloads
+    return JobRegistry()
+
+job_registry = get_job_registry()
+
 if st.button("Start Financial Data Processing"):
     # --- Initial Input Validation ---
     if not company_folder_name:
@@ -83,71 +204,104 @@ if st.button("Start Financial Data Processing"):
         st.error("Google API Key is required to run LLM-based steps. Please provide it.")
         st.stop() # Stop if API key is missing
     else:
-        st.info("Starting the financial data processing workflow...")
-        
+        pipeline_config = {
+            "extraction_method": extraction_method.lower(),
+            "page_ranges": page_ranges or None,
+            "auto_locate": auto_locate_pages,
+            "num_workers": ocr_workers,
+            "use_ocr_cache": use_ocr_cache,
+            "ocr_preprocess": ocr_preprocess_steps or None,
+            "ocr_engine": ocr_engine,
+            "layout_tables": use_layout_tables,
+            "max_concurrency": llm_concurrency,
+            "requests_per_second": llm_requests_per_second or None,
+            "use_llm_cache": use_llm_cache,
+            "chunk_token_budget": chunk_token_budget or None,
+            "compact_prompt": compact_prompt,
+            "use_rule_parser": use_rule_parser,
+            "export_xlsx": export_intermediate_xlsx,
+            "use_dictionary": use_standardization_dictionary,
+        }
+        try:
+            # Forcing the first stage reruns every stage after it as well
+            job = job_registry.submit(
+                company_folder_name,
+                periods_to_process,
+                pipeline_config,
+                force_stages=() if skip_up_to_date_stages else ("pdf_to_text",)
+            )
+        except ValueError as e:
+            st.error(str(e))
+            st.stop()
+
+        st.info(f"Started job {job.job_id} for {company_folder_name}. Its progress is shown below; you can keep working or reload the page.")
+
         # Display current configuration
         st.subheader("Current Configuration:")
         st.write(f"- Company Folder: **{company_folder_name}**")
         st.write(f"- Periods: **{', '.join(periods_to_process)}**")
         st.write(f"- Extraction Method: **{extraction_method}**")
+        st.write(f"- Extraction Workers: **{ocr_workers}**")
         st.write(f"- Page Range: **{page_range_input if page_range_input else 'All Pages'}**")
-        
-        st.subheader("Processing Output:")
-        # Removed st.empty() - Streamlit will now append content sequentially
+        st.write(f"- Automatic Page Locator: **{'On' if auto_locate_pages else 'Off'}**")
+        if period_page_ranges_input:
+            st.write(f"- Per-Period Page Ranges: **{period_page_ranges_input}**")
 
-        # --- Step 1: PDF to Text (OCR or Direct) ---
-        st.write("### Step 1: Converting PDF to Text files...")
-        try:
-            pdf_to_text_log = run_pdf_to_text_process(
-                company_folder_name, 
-                periods_to_process, 
-                extraction_method.lower()
-            )
-            st.markdown(f"```\n{pdf_to_text_log}\n```")
-        except Exception as e:
-            st.error(f"Error in PDF to Text conversion: {e}")
-            st.stop() # Stop execution if this critical step fails
+st.markdown("---")
+st.header("3. Jobs")
 
-        # --- Step 2: LLM Extraction (from 1_test_converter.ipynb) ---
-        st.write("### Step 2: Extracting data using Gemini 2.5 Flash...")
-        try:
-            llm_extraction_log = run_converter_process(
-                company_folder_name, 
-                periods_to_process, 
-                extraction_method.lower(),
-                start_page, 
-                end_page
-            )
-            st.markdown(f"```\n{llm_extraction_log}\n```")
-        except Exception as e:
-            st.error(f"Error during LLM data extraction: {e}")
-            st.stop()
+def show_timing_summary(snapshot):
+    # Where the time went: one row per stage and kind of span (page render,
+    # OCR, Gemini call, Excel/Parquet read or write), plus cache and size counters
+    if not snapshot["timing_summary"]:
+        return
+    with st.expander("Timing Summary"):
+        st.dataframe(snapshot["timing_summary"], hide_index=True)
+        if snapshot["counters"]:
+            st.dataframe(snapshot["counters"], hide_index=True)
 
-        # --- Step 3: Merging Excel Files (from 2_excel_merger.ipynb) ---
-        st.write("### Step 3: Merging Excel Files...")
-        try:
-            merger_log = run_merger_process(company_folder_name, periods_to_process)
-            st.markdown(f"```\n{merger_log}\n```")
-        except Exception as e:
-            st.error(f"Error during Excel merging: {e}")
-            st.stop()
+def show_job(job):
+    snapshot = job.snapshot()
+    with st.container(border=True):
+        status_text = "cancelling" if snapshot["cancel_requested"] and job.is_active else snapshot["status"]
+        st.markdown(f"**Job {snapshot['job_id']}: {snapshot['company']}** ({', '.join(snapshot['periods'])}) · {status_text} · {snapshot['elapsed_seconds']:.0f}s")
 
-        # --- Step 4: Formatting Excel Files (from 3_excel_formatter.ipynb) ---
-        st.write("### Step 4: Formatting Excel Files...")
-        try:
-            formatter_log = run_formatter_process(company_folder_name, periods_to_process)
-            st.markdown(f"```\n{formatter_log}\n```")
-        except Exception as e:
-            st.error(f"Error during Excel formatting: {e}")
-            st.stop()
+        for stage_name, progress in snapshot["stage_progress"].items():
+            if progress["total"]:
+                st.progress(min(1.0, progress["done"] / progress["total"]), text=f"{stage_name}: {progress['message']}")
+            else:
+                st.caption(f"{stage_name}: {progress['message']}")
 
-        # --- Step 5: Standardizing Excel Files (from 4_excel_standardization.ipynb) ---
-        st.write("### Step 5: Standardizing Excel Files...")
-        try:
-            standardizer_log = run_standardizer_process(company_folder_name)
-            st.markdown(f"```\n{standardizer_log}\n```")
-        except Exception as e:
-            st.error(f"Error during Excel standardization: {e}")
-            st.stop()
+        if job.is_active:
+            st.code("\n".join(snapshot["messages"][-10:]) or "Waiting for a free slot...")
+            if st.button("Cancel", key=f"cancel_job_{snapshot['job_id']}", disabled=snapshot["cancel_requested"]):
+                job_registry.cancel(snapshot["job_id"])
+            show_timing_summary(snapshot)
+            return
+
+        if snapshot["status"] == "succeeded" and snapshot["warnings"]:
+            st.warning("Workflow completed for some periods only:\n\n" + "\n".join(f"- {warning}" for warning in snapshot["warnings"]))
+        elif snapshot["status"] == "succeeded":
+            st.success("Workflow completed successfully!")
+        elif snapshot["status"] == "cancelled":
+            st.warning(snapshot["error"] or "Cancelled before it started.")
+        else:
+            st.error(f"Workflow failed: {snapshot['error']}")
+        show_timing_summary(snapshot)
+        with st.expander("Processing Output"):
+            st.markdown(f"```\n{snapshot['log']}\n```")
+
+# Only poll while something is running; a new job triggers a full rerun anyway
+@st.fragment(run_every=JOB_REFRESH_SECONDS if job_registry.active_jobs() else None)
+def show_jobs():
+    jobs = job_registry.jobs()
+    if not jobs:
+        st.write("No jobs yet.")
+        return
+    for job in jobs:
+        show_job(job)
+    if any(not job.is_active for job in jobs) and st.button("Clear finished jobs"):
+        job_registry.clear_finished()
+        st.rerun(scope="fragment")
 
-        st.success("Workflow completed successfully!")
\ No newline at end of file
+show_jobs()
@@ -0,0 +1,286 @@
+import argparse
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from disk_cache import atomic_write_text
+from llm_utils import TokenBucketRateLimiter
+from metrics import RunMetrics
+from standardization_store import StandardizationDictionary, STANDARDIZATION_DICTIONARY_PATH
+from pipeline import (
+    PIPELINE_DEFAULTS, PIPELINE_STAGES, add_pipeline_arguments, config_from_args,
+    load_pipeline_state, load_stage_module, parse_periods, run_pipeline_stage, save_run_report, upstream_periods, validate_stage_names,
+)
+
+# Batch mode: runs the pipeline for many companies at once. Stage work from every
+# company goes through one job queue served by a few worker threads; a company's
+# stages still run in dependency order. Limits are global to the batch:
+#   - ocr_workers: one process pool shared by every company's text extraction,
+#     with one render memory budget (ocr_memory_mb) across all of them
+#   - requests_per_second: one token bucket shared by every Gemini request
+# A failing stage only blocks the rest of that company, and a stage that fails
+# for some periods only leaves those periods out of the company's later stages. The run ends with a
+# per-company summary, optionally written as a JSON report. Each company also
+# gets its own run report with stage timings (see metrics.py).
+#
+#   python batch.py --companies PVIAM,ACME --periods 2021,2022 --workers 8 --requests-per-second 2
+#   python batch.py --jobs jobs.json --report batch_report.json
+#
+# jobs.json maps each company to its periods, or to periods plus settings:
+#   {"PVIAM": ["2021", "2022"], "ACME": {"periods": ["2023"], "extraction_method": "hybrid"}}
+
+DEFAULT_PARALLEL_COMPANIES = 4
+
+class CompanyJob:
+    def __init__(self, company_folder_name, periods, config):
+        self.company_folder_name = company_folder_name
+        self.periods = [str(period) for period in periods]
+        self.config = config
+        self.statuses = {}
+        self.errors = {}
+        self.log = [f"--- Starting pipeline for {company_folder_name} ({', '.join(self.periods)}) ---"]
+        self.stages_state = None
+        self.periods_by_stage = {} # Periods each stage has output for; see pipeline.upstream_periods
+        self.next_stage = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def status(self):
+        if any(status in ("failed", "blocked") for status in self.statuses.values()):
+            return "failed"
+        if any(status == "partial" for status in self.statuses.values()):
+            return "partial"
+        if any(status == "ran" for status in self.statuses.values()):
+            return "completed"
+        if any(status == "would run" for status in self.statuses.values()):
+            return "would run"
+        return "up to date"
+
+    def summary(self):
+        return {
+            "periods": self.periods,
+            "status": self.status(),
+            "stages": dict(self.statuses),
+            "errors": dict(self.errors),
+            "elapsed_seconds": round((self.finished_at or time.time()) - (self.started_at or time.time()), 2),
+        }
+
+def normalize_jobs(jobs):
+    # Accepts {company: [periods]}, {company: {"periods": [...], **settings}} or
+    # a list of {"company": ..., "periods": [...], **settings}
+    if isinstance(jobs, dict):
+        jobs = [
+            {"company": company, **(spec if isinstance(spec, dict) else {"periods": spec})}
+            for company, spec in jobs.items()
+        ]
+    normalized = []
+    for job in jobs:
+        job = dict(job)
+        company = job.pop("company")
+        periods = job.pop("periods")
+        if isinstance(periods, str):
+            periods = parse_periods(periods)
+        normalized.append((company, periods, job))
+    return normalized
+
+def format_batch_summary(company_jobs):
+    lines = ["--- Batch Summary ---"]
+    name_width = max([len("Company")] + [len(job.company_folder_name) for job in company_jobs])
+    lines.append(f"{'Company':<{name_width}}  {'Status':<10}  {'Time':>8}  Stages")
+    for job in company_jobs:
+        summary = job.summary()
+        stage_text = ", ".join(f"{name}: {status}" for name, status in summary["stages"].items() if status != "not selected")
+        lines.append(f"{job.company_folder_name:<{name_width}}  {summary['status']:<10}  {summary['elapsed_seconds']:>7.1f}s  {stage_text}")
+        for stage_name, error in summary["errors"].items():
+            lines.append(f"{'':<{name_width}}  {stage_name} failed: {error}")
+    counts = {}
+    for job in company_jobs:
+        counts[job.status()] = counts.get(job.status(), 0) + 1
+    lines.append(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    return "\n".join(lines)
+
+# Returns {"companies": {company: summary}, "summary": text, "log": text}
+def run_batch(jobs, config=None, ocr_workers=None, requests_per_second=None, parallel_companies=DEFAULT_PARALLEL_COMPANIES,
+              stages=None, force_stages=(), dry_run=False, report_path=None, dictionary_path=STANDARDIZATION_DICTIONARY_PATH):
+    base_config = {**PIPELINE_DEFAULTS, **(config or {})}
+    selected_stages, forced_stages = validate_stage_names(stages, force_stages)
+    ocr_workers = max(1, int(ocr_workers or os.cpu_count() or 1))
+
+    # Resources shared by every company in the batch. Per-company pools and
+    # rate limits are turned off so the global limits hold.
+    shared = {
+        "rate_limiter": TokenBucketRateLimiter(requests_per_second) if requests_per_second else None,
+        "ocr_executor": None,
+        "ocr_memory_budget": None,
+        "num_workers": 1,
+        "requests_per_second": None,
+    }
+    if base_config["use_dictionary"]:
+        shared["dictionary"] = StandardizationDictionary(dictionary_path)
+    ocr_slot = threading.Semaphore(1) # Serial text extraction when there is no pool
+    if ocr_workers > 1 and not dry_run and "pdf_to_text" in selected_stages:
+        # Load the stage module before the pool forks its workers (they need it
+        # by name) and start them before any worker thread exists
+        pdf_to_text_module = load_stage_module("1. pdf_to_text_script.py")
+        if base_config["extraction_method"].lower() == "ocr":
+            # Each worker loads the OCR model once, before its first page; a
+            # company that overrides the method or engine loads its own lazily
+            shared["ocr_executor"] = ProcessPoolExecutor(max_workers=ocr_workers, initializer=pdf_to_text_module.init_ocr_worker, initargs=(base_config["ocr_engine"],))
+        else:
+            shared["ocr_executor"] = ProcessPoolExecutor(max_workers=ocr_workers)
+        shared["ocr_executor"].submit(os.getpid).result()
+        memory_budget_bytes = int(base_config["ocr_memory_mb"] * 1024**2) if base_config["ocr_memory_mb"] else pdf_to_text_module.OCR_MEMORY_BUDGET_BYTES
+        shared["ocr_memory_budget"] = pdf_to_text_module.RenderMemoryBudget(memory_budget_bytes)
+
+    company_jobs = [
+        CompanyJob(company, periods, {**base_config, **overrides, **shared, "metrics": RunMetrics()})
+        for company, periods, overrides in normalize_jobs(jobs)
+    ]
+
+    # Later stages go first, so companies that are nearly done finish early
+    work_queue = queue.PriorityQueue()
+    sequence = itertools.count()
+    remaining = [len(company_jobs)]
+    remaining_lock = threading.Lock()
+
+    def schedule(job):
+        # Queues the job's next stage to run, or finishes the job
+        while job.next_stage < len(PIPELINE_STAGES):
+            stage = PIPELINE_STAGES[job.next_stage]
+            if stage.name not in selected_stages:
+                job.statuses[stage.name] = "not selected"
+                job.next_stage += 1
+                continue
+            if not upstream_periods(stage, job.periods, job.periods_by_stage):
+                failed_upstream = [name for name in stage.depends_on if job.statuses.get(name) in ("failed", "blocked")] or list(stage.depends_on)
+                job.statuses[stage.name] = "blocked"
+                job.periods_by_stage[stage.name] = []
+                job.log.append(f"\n[{stage.name}] Skipped because {', '.join(failed_upstream)} did not complete.")
+                job.next_stage += 1
+                continue
+            work_queue.put((-job.next_stage, next(sequence), job))
+            return
+        job.finished_at = time.time()
+        if not dry_run:
+            job.log.extend(save_run_report(job.company_folder_name, job.periods, job.config["metrics"], job.statuses))
+        with remaining_lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                for _ in range(parallel_companies):
+                    work_queue.put((1, next(sequence), None)) # Stop the workers
+
+    def run_stage(job):
+        stage = PIPELINE_STAGES[job.next_stage]
+        if job.started_at is None:
+            job.started_at = time.time()
+        stage_periods = upstream_periods(stage, job.periods, job.periods_by_stage)
+        if len(stage_periods) < len(job.periods):
+            skipped_periods = [period for period in job.periods if period not in stage_periods]
+            job.log.append(f"\n[{stage.name}] Leaving out {', '.join(skipped_periods)}: an earlier stage produced no output for them.")
+        try:
+            if job.stages_state is None:
+                job.stages_state = load_pipeline_state(job.company_folder_name)
+            if stage.name == "pdf_to_text" and job.config["ocr_executor"] is None:
+                with ocr_slot:
+                    status, stage_log, error, completed_periods = run_pipeline_stage(stage, job.company_folder_name, stage_periods, job.config, job.stages_state, stage.name in forced_stages, dry_run)
+            else:
+                status, stage_log, error, completed_periods = run_pipeline_stage(stage, job.company_folder_name, stage_periods, job.config, job.stages_state, stage.name in forced_stages, dry_run)
+        except Exception as e:
+            status, stage_log, error, completed_periods = "failed", [f"\n[{stage.name}] Failed: {e}"], str(e), []
+        job.statuses[stage.name] = status
+        job.periods_by_stage[stage.name] = completed_periods
+        job.log.extend(stage_log)
+        if error:
+            job.errors[stage.name] = error
+        job.next_stage += 1
+
+    def worker():
+        while True:
+            _, _, job = work_queue.get()
+            if job is None:
+                return
+            run_stage(job)
+            schedule(job)
+
+    started_at = time.time()
+    parallel_companies = max(1, int(parallel_companies or 1))
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(parallel_companies)]
+    try:
+        for job in company_jobs:
+            schedule(job)
+        if not company_jobs:
+            return {"companies": {}, "summary": "No companies to process.", "log": "No companies to process."}
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if shared["ocr_executor"] is not None:
+            shared["ocr_executor"].shutdown(wait=True, cancel_futures=True)
+        if "dictionary" in shared and not dry_run:
+            shared["dictionary"].save()
+
+    results = []
+    results.append(f"--- Batch of {len(company_jobs)} companies: {ocr_workers} text extraction workers, "
+                   f"{requests_per_second or 'unlimited'} Gemini requests/s, {parallel_companies} stages at a time ---")
+    for job in company_jobs:
+        results.append("")
+        results.extend(job.log)
+    summary_text = format_batch_summary(company_jobs)
+    results.append("")
+    results.append(summary_text)
+
+    companies = {job.company_folder_name: job.summary() for job in company_jobs}
+    if report_path:
+        report = {
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "elapsed_seconds": round(time.time() - started_at, 2),
+            "ocr_workers": ocr_workers,
+            "requests_per_second": requests_per_second,
+            "companies": companies,
+        }
+        atomic_write_text(report_path, json.dumps(report, ensure_ascii=False, indent=2))
+        results.append(f"Report saved to {report_path}")
+    return {"companies": companies, "summary": summary_text, "log": "\n".join(results)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the financial statement pipeline for many companies.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--companies", help="Comma-separated company folders; use with --periods")
+    source.add_argument("--jobs", help="JSON file mapping each company to its periods (and optional settings)")
+    parser.add_argument("--periods", help="Comma-separated periods for every company in --companies")
+    parser.add_argument("--parallel-companies", type=int, default=DEFAULT_PARALLEL_COMPANIES,
+                        help="Stages run at the same time (each for a different company)")
+    parser.add_argument("--report", help="Write the per-company summary as JSON to this file")
+    parser.add_argument("--summary-only", action="store_true", help="Print only the summary, not every company's log")
+    add_pipeline_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.companies:
+        if not args.periods:
+            parser.error("--periods is required with --companies")
+        periods = parse_periods(args.periods)
+        jobs = {company.strip(): periods for company in args.companies.split(",") if company.strip()}
+    else:
+        with open(args.jobs, "r", encoding="utf-8") as f:
+            jobs = json.load(f)
+        periods = sorted({str(period) for _, job_periods, _ in normalize_jobs(jobs) for period in job_periods})
+
+    # --workers and --requests-per-second are limits for the whole batch here
+    config = config_from_args(args, periods)
+    stages = [name.strip() for name in args.stages.split(",")] if args.stages else None
+    outcome = run_batch(
+        jobs, config,
+        ocr_workers=args.workers, requests_per_second=args.requests_per_second,
+        parallel_companies=args.parallel_companies, stages=stages, force_stages=args.force,
+        dry_run=args.dry_run, report_path=args.report,
+    )
+    print(outcome["summary"] if args.summary_only else outcome["log"])
+    return 1 if any(summary["status"] == "failed" for summary in outcome["companies"].values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
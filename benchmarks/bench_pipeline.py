@@ -0,0 +1,300 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# Per-stage throughput of the five pipeline stages on synthetic statements,
+# fully offline: the PDFs come from synthetic_statements.py and Gemini is
+# replaced by its deterministic FakeStatementLLM. Each variant (text-layer or
+# scanned PDFs) runs all five run_*_process functions in a fresh company folder
+# with the OCR and LLM caches off. Results are written as JSON so runs can be
+# compared over time; --compare reports the change against an earlier file.
+# Run from the repository root:
+#   python benchmarks/bench_pipeline.py --pages 30 --periods 3 --output bench.json
+#   python benchmarks/bench_pipeline.py --variants text --compare bench.json --max-slowdown 0.2
+#
+# The scanned variant needs Tesseract with Vietnamese language data. Peak memory
+# is the resident set size of this process sampled during each stage, so text
+# extraction worker processes (--workers > 1) are not included.
+#
+# Text extraction also reports seconds per page for each step it times (page
+# render, each --preprocess step, tesseract), so preprocessing can be compared:
+#   python benchmarks/bench_pipeline.py --variants scanned --output plain.json
+#   python benchmarks/bench_pipeline.py --variants scanned --preprocess binarize,crop,deskew --compare plain.json
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+from metrics import RunMetrics
+from pipeline import load_stage_module
+from synthetic_statements import FakeStatementLLM, write_statement_pdf
+
+BENCHMARK_VERSION = 1
+STAGES = ["pdf_to_text", "converter", "merger", "formatter", "standardizer"]
+RSS_SAMPLE_SECONDS = 0.01
+PAGE_STEP_SPANS = ("page_extract", "page_render", "text_layer", "ocr") # Plus every preprocess_<step>
+
+class PeakMemorySampler:
+    # Samples this process's resident set size on a background thread. Uses
+    # /proc where it exists; elsewhere it falls back to the process-wide peak
+    # from getrusage, which cannot be reset between stages.
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _current_rss(self):
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except (OSError, ValueError, IndexError):
+            if resource is None:
+                return 0
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024 # bytes on macOS, KiB on Linux
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, self._current_rss())
+
+    def __enter__(self):
+        self.peak_bytes = self._current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self._current_rss())
+
+def count_parquet_rows(paths):
+    return sum(len(pd.read_parquet(path)) for path in paths)
+
+def count_excel_rows(paths):
+    return sum(len(pd.read_excel(path)) for path in paths)
+
+def stage_calls(company, periods, args, llm, metrics):
+    # [(stage, call, rows produced by the stage)], in pipeline order
+    scripts = {
+        "pdf_to_text": load_stage_module("1. pdf_to_text_script.py"),
+        "converter": load_stage_module("2. converter_script.py"),
+        "merger": load_stage_module("3. merger_script.py"),
+        "formatter": load_stage_module("4. formatter_script.py"),
+        "standardizer": load_stage_module("5. standardizer_script.py"),
+    }
+    company_dir = Path(company)
+    return [
+        ("pdf_to_text",
+         lambda: scripts["pdf_to_text"].run_pdf_to_text_process(company, periods, args.method, num_workers=args.workers, use_cache=False,
+                                                                   preprocess=args.preprocess, layout=args.layout_tables, metrics=metrics.for_stage("pdf_to_text")),
+         lambda: None),
+        ("converter",
+         lambda: scripts["converter"].run_converter_process(company, periods, args.method, None, None, llm=llm, max_concurrency=args.llm_concurrency,
+                                                            use_llm_cache=False, chunk_token_budget=args.chunk_token_budget, use_rule_parser=args.rule_parser,
+                                                            use_layout_tables=args.layout_tables, compact_prompt=args.compact_prompt),
+         lambda: count_parquet_rows((company_dir / "excel_statements").glob("*_financial_statements.parquet"))),
+        ("merger",
+         lambda: scripts["merger"].run_merger_process(company, periods),
+         lambda: count_parquet_rows([company_dir / "period_statements" / "all_periods_concatenated.parquet"])),
+        ("formatter",
+         lambda: scripts["formatter"].run_formatter_process(company, periods),
+         lambda: count_parquet_rows((company_dir / "final_statements").glob("*.parquet"))),
+        ("standardizer",
+         lambda: scripts["standardizer"].run_standardizer_process(company, llm=llm, use_llm_cache=False, use_dictionary=args.use_dictionary,
+                                                                  dictionary_path="standardization_dictionary.json", max_concurrency=args.llm_concurrency),
+         lambda: count_excel_rows((company_dir / "final_statements_standardized").glob("*.xlsx"))),
+    ]
+
+def run_variant(variant, pdf_dir, periods, args, llm):
+    # One pass over the five stages in a fresh working directory
+    work_dir = Path(tempfile.mkdtemp(prefix=f"bench_{variant}_"))
+    company = "BENCH"
+    shutil.copytree(pdf_dir, work_dir / company / "financial_statements")
+    cwd = Path.cwd()
+    os.chdir(work_dir)
+    stages = {}
+    metrics = RunMetrics()
+    try:
+        failed_stage = None
+        for stage, call, count_rows in stage_calls(company, periods, args, llm, metrics):
+            if failed_stage:
+                stages[stage] = {"status": "skipped", "error": f"{failed_stage} failed"}
+                continue
+            with PeakMemorySampler() as memory:
+                started_at = time.perf_counter()
+                try:
+                    # The stages print as they go; keep that out of the report
+                    with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                        call()
+                    error = None
+                except Exception as e:
+                    error = str(e)
+                seconds = time.perf_counter() - started_at
+            if error:
+                failed_stage = stage
+                stages[stage] = {"status": "failed", "error": error, "seconds": round(seconds, 4)}
+                continue
+            stages[stage] = {"status": "ok", "seconds": round(seconds, 4), "peak_rss_mb": round(memory.peak_bytes / 2**20, 1), "rows": count_rows()}
+        if stages["pdf_to_text"]["status"] == "ok":
+            stages["pdf_to_text"]["page_steps"] = {
+                row["span"]: row["total_seconds"] for row in metrics.summary()
+                if row["span"] in PAGE_STEP_SPANS or row["span"].startswith("preprocess_")
+            }
+    finally:
+        os.chdir(cwd)
+        if not args.keep_files:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return stages
+
+def summarize_runs(runs, pages):
+    # Median seconds over the repeats; throughput is derived from it
+    summary = {}
+    for stage in STAGES:
+        results = [run[stage] for run in runs]
+        if any(result["status"] != "ok" for result in results):
+            summary[stage] = next(result for result in results if result["status"] != "ok")
+            continue
+        seconds = statistics.median(result["seconds"] for result in results)
+        rows = results[-1]["rows"]
+        summary[stage] = {
+            "status": "ok",
+            "seconds": round(seconds, 4),
+            "runs": [result["seconds"] for result in results],
+            "pages_per_second": round(pages / seconds, 2) if stage in ("pdf_to_text", "converter") and seconds else None,
+            "rows": rows,
+            "rows_per_second": round(rows / seconds, 1) if rows is not None and seconds else None,
+            "peak_rss_mb": max(result["peak_rss_mb"] for result in results),
+        }
+        if "page_steps" in results[-1]:
+            summary[stage]["seconds_per_page"] = {
+                step: round(statistics.median(result["page_steps"].get(step, 0.0) for result in results) / pages, 4)
+                for step in results[-1]["page_steps"]
+            }
+    return summary
+
+def format_results(results):
+    lines = [f"{'Variant':<8}  {'Stage':<12}  {'Seconds':>8}  {'Pages/s':>8}  {'Rows/s':>10}  {'Peak MB':>8}"]
+    for variant, variant_result in results["variants"].items():
+        for stage, stage_result in variant_result["stages"].items():
+            if stage_result["status"] != "ok":
+                lines.append(f"{variant:<8}  {stage:<12}  {stage_result['status']}: {stage_result['error']}")
+                continue
+            pages_rate = f"{stage_result['pages_per_second']:.1f}" if stage_result["pages_per_second"] is not None else "-"
+            rows_rate = f"{stage_result['rows_per_second']:,.0f}" if stage_result["rows_per_second"] is not None else "-"
+            lines.append(f"{variant:<8}  {stage:<12}  {stage_result['seconds']:>8.3f}  {pages_rate:>8}  {rows_rate:>10}  {stage_result['peak_rss_mb']:>8.1f}")
+    for variant, variant_result in results["variants"].items():
+        page_steps = variant_result["stages"]["pdf_to_text"].get("seconds_per_page")
+        if page_steps:
+            lines.append(f"{variant} text extraction, seconds per page: " + ", ".join(f"{step} {seconds:.3f}" for step, seconds in page_steps.items()))
+    return "\n".join(lines)
+
+def compare_results(results, baseline, max_slowdown=None):
+    # Returns (report lines, stages slower than max_slowdown allows)
+    lines = ["Change in seconds against the baseline:"]
+    regressions = []
+    for variant, variant_result in results["variants"].items():
+        baseline_stages = baseline.get("variants", {}).get(variant, {}).get("stages", {})
+        for stage, stage_result in variant_result["stages"].items():
+            before = baseline_stages.get(stage, {})
+            if stage_result["status"] != "ok" or before.get("status") != "ok" or not before.get("seconds"):
+                continue
+            change = stage_result["seconds"] / before["seconds"] - 1
+            flag = ""
+            if max_slowdown is not None and change > max_slowdown:
+                regressions.append(f"{variant}/{stage}")
+                flag = "  REGRESSION"
+            lines.append(f"  {variant}/{stage}: {before['seconds']:.3f}s -> {stage_result['seconds']:.3f}s ({change:+.0%}){flag}")
+        before_steps = baseline_stages.get("pdf_to_text", {}).get("seconds_per_page", {})
+        for step, seconds in variant_result["stages"].get("pdf_to_text", {}).get("seconds_per_page", {}).items():
+            if step in before_steps:
+                lines.append(f"  {variant}/pdf_to_text {step} per page: {before_steps[step]:.3f}s -> {seconds:.3f}s")
+    return lines, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the five pipeline stages offline on synthetic statements.")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per period PDF")
+    parser.add_argument("--periods", type=int, default=2, help="Number of periods (PDFs) per variant")
+    parser.add_argument("--variants", default="text,scanned", help="Comma-separated: text (text-layer PDFs), scanned (page images)")
+    parser.add_argument("--method", default="hybrid", choices=["ocr", "direct", "hybrid"], help="Text extraction method")
+    parser.add_argument("--workers", type=int, default=1, help="Text extraction worker processes")
+    parser.add_argument("--scan-dpi", type=int, default=150, help="Resolution of the scanned page images")
+    parser.add_argument("--preprocess", metavar="STEPS", help="Image preprocessing before OCR, e.g. binarize,crop,deskew,remove_non_text")
+    parser.add_argument("--layout-tables", action="store_true", help="Send the converter layout tables instead of the plain text")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds added to every fake Gemini call")
+    parser.add_argument("--llm-concurrency", type=int, default=4)
+    parser.add_argument("--chunk-token-budget", type=int, default=None)
+    parser.add_argument("--compact-prompt", action="store_true", help="Compact the converter's text before the fake LLM sees it")
+    parser.add_argument("--rule-parser", action="store_true", help="Let the converter parse VAS pages without the LLM")
+    parser.add_argument("--use-dictionary", action="store_true", help="Resolve items from a (fresh) standardization dictionary")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per variant; the median time is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--max-slowdown", type=float, default=None,
+                        help="With --compare, exit with status 1 if a stage is slower by more than this fraction (e.g. 0.2)")
+    parser.add_argument("--keep-files", action="store_true", help="Keep the temporary company folders")
+    parser.add_argument("--verbose", action="store_true", help="Show the stages' own output")
+    args = parser.parse_args(argv)
+
+    variants = [variant.strip() for variant in args.variants.split(",") if variant.strip()]
+    unknown_variants = set(variants) - {"text", "scanned"}
+    if unknown_variants:
+        parser.error(f"unknown variant(s): {', '.join(sorted(unknown_variants))}")
+    periods = [str(2024 - args.periods + 1 + index) for index in range(args.periods)]
+    llm = FakeStatementLLM(parse_page=load_stage_module("2. converter_script.py").parse_vas_page, latency=args.llm_latency)
+
+    results = {
+        "benchmark": "pipeline",
+        "version": BENCHMARK_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "max_slowdown", "keep_files", "verbose")},
+        "variants": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="bench_pdfs_") as pdf_root:
+        for variant in variants:
+            pdf_dir = Path(pdf_root) / variant
+            for period in periods:
+                write_statement_pdf(pdf_dir / f"{period}.pdf", period, args.pages, scanned=variant == "scanned", scan_dpi=args.scan_dpi, seed=args.seed)
+            runs = [run_variant(variant, pdf_dir, periods, args, llm) for _ in range(max(1, args.repeat))]
+            results["variants"][variant] = {
+                "pages": args.pages * len(periods),
+                "periods": len(periods),
+                "stages": summarize_runs(runs, args.pages * len(periods)),
+            }
+
+    print(format_results(results))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Results saved to {args.output}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        lines, regressions = compare_results(results, baseline, args.max_slowdown)
+        print("\n".join(lines))
+        if regressions:
+            print(f"Slower than allowed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
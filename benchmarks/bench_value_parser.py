@@ -0,0 +1,76 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Throughput of value_parser.parse_financial_values against the per-cell
+# clean_value the formatter used before. Run from the repository root:
+#   python benchmarks/bench_value_parser.py --rows 1000000
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from value_parser import parse_financial_values
+
+def legacy_clean_value(x):
+    # The formatter's former per-cell parser, kept here as the baseline
+    s = str(x).strip()
+    if s == 'nan' or s == '' or s.lower() == 'n/a':
+        return pd.NA
+    if s.startswith('(') and s.endswith(')'):
+        s = '-' + s[1:-1]
+    s = s.replace(',', '').replace(' ', '')
+    s = pd.Series([s]).replace(r'[^\d\.\-]', '', regex=True).iloc[0]
+    return pd.to_numeric(s, errors='coerce')
+
+def make_values(rows, seed=0):
+    # Statement-like amounts in the formats the LLM and Excel exports produce
+    rng = np.random.default_rng(seed)
+    amounts = rng.integers(0, 10**12, size=rows)
+    style = rng.integers(0, 8, size=rows)
+    values = np.empty(rows, dtype=object)
+    for i, (amount, kind) in enumerate(zip(amounts.tolist(), style.tolist())):
+        grouped = f"{amount:,}"
+        if kind == 0:
+            values[i] = grouped.replace(",", ".")
+        elif kind == 1:
+            values[i] = f"({grouped.replace(',', '.')})"
+        elif kind == 2:
+            values[i] = grouped
+        elif kind == 3:
+            values[i] = f"{grouped.replace(',', '.')} VND"
+        elif kind == 4:
+            values[i] = float(amount)
+        elif kind == 5:
+            values[i] = f"{grouped.replace(',', '.')},{amount % 100:02d}"
+        elif kind == 6:
+            values[i] = "n/a" if amount % 2 else ""
+        else:
+            values[i] = str(amount)
+    return pd.Series(values)
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parse_financial_values against the former per-cell parser.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--legacy-rows", type=int, default=20_000,
+                        help="Rows timed with the per-cell baseline (it is too slow for the full set)")
+    args = parser.parse_args()
+
+    values = make_values(args.rows)
+    parsed, seconds = time_call(parse_financial_values, values)
+    print(f"parse_financial_values: {args.rows:,} rows in {seconds:.2f}s ({args.rows / seconds:,.0f} rows/s), {int(parsed.isna().sum()):,} missing")
+
+    sample = values.iloc[:args.legacy_rows]
+    _, legacy_seconds = time_call(lambda s: s.apply(legacy_clean_value), sample)
+    legacy_rate = len(sample) / legacy_seconds
+    print(f"legacy clean_value:     {len(sample):,} rows in {legacy_seconds:.2f}s ({legacy_rate:,.0f} rows/s)")
+    print(f"speed-up: {args.rows / seconds / legacy_rate:.0f}x")
+
+if __name__ == "__main__":
+    main()
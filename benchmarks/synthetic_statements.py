@@ -0,0 +1,179 @@
+import asyncio
+import json
+import random
+import re
+import time
+from pathlib import Path
+
+import fitz  # PyMuPDF
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Synthetic inputs for the offline benchmarks: Vietnamese (VAS) financial
+# statement PDFs with a text layer or as scanned page images, and a
+# deterministic stand-in for ChatGoogleGenerativeAI that answers the
+# converter and standardizer prompts without a network call.
+
+STATEMENT_TEMPLATES = [
+    ("BẢNG CÂN ĐỐI KẾ TOÁN", [
+        ("A. TÀI SẢN NGẮN HẠN", "100"),
+        ("I. Tiền và các khoản tương đương tiền", "110"),
+        ("1. Tiền", "111"),
+        ("2. Các khoản tương đương tiền", "112"),
+        ("II. Đầu tư tài chính ngắn hạn", "120"),
+        ("1. Chứng khoán kinh doanh", "121"),
+        ("III. Các khoản phải thu ngắn hạn", "130"),
+        ("1. Phải thu ngắn hạn của khách hàng", "131"),
+        ("2. Trả trước cho người bán ngắn hạn", "132"),
+        ("3. Phải thu ngắn hạn khác", "136"),
+        ("IV. Hàng tồn kho", "140"),
+        ("V. Tài sản ngắn hạn khác", "150"),
+        ("B. TÀI SẢN DÀI HẠN", "200"),
+        ("I. Tài sản cố định", "220"),
+        ("1. Tài sản cố định hữu hình", "221"),
+        ("- Nguyên giá", "222"),
+        ("- Giá trị hao mòn lũy kế", "223"),
+        ("II. Đầu tư tài chính dài hạn", "250"),
+        ("TỔNG CỘNG TÀI SẢN", "270"),
+        ("C. NỢ PHẢI TRẢ", "300"),
+        ("I. Nợ ngắn hạn", "310"),
+        ("1. Phải trả người bán ngắn hạn", "311"),
+        ("2. Thuế và các khoản phải nộp Nhà nước", "313"),
+        ("3. Phải trả người lao động", "314"),
+        ("D. VỐN CHỦ SỞ HỮU", "400"),
+        ("1. Vốn góp của chủ sở hữu", "411"),
+        ("2. Lợi nhuận sau thuế chưa phân phối", "421"),
+        ("TỔNG CỘNG NGUỒN VỐN", "440"),
+    ]),
+    ("BÁO CÁO KẾT QUẢ HOẠT ĐỘNG KINH DOANH", [
+        ("1. Doanh thu bán hàng và cung cấp dịch vụ", "01"),
+        ("2. Các khoản giảm trừ doanh thu", "02"),
+        ("3. Doanh thu thuần về bán hàng và cung cấp dịch vụ", "10"),
+        ("4. Giá vốn hàng bán", "11"),
+        ("5. Lợi nhuận gộp về bán hàng và cung cấp dịch vụ", "20"),
+        ("6. Doanh thu hoạt động tài chính", "21"),
+        ("7. Chi phí tài chính", "22"),
+        ("8. Chi phí quản lý doanh nghiệp", "26"),
+        ("9. Lợi nhuận thuần từ hoạt động kinh doanh", "30"),
+        ("10. Thu nhập khác", "31"),
+        ("11. Chi phí khác", "32"),
+        ("12. Tổng lợi nhuận kế toán trước thuế", "50"),
+        ("13. Chi phí thuế TNDN hiện hành", "51"),
+        ("14. Lợi nhuận sau thuế thu nhập doanh nghiệp", "60"),
+    ]),
+    ("BÁO CÁO LƯU CHUYỂN TIỀN TỆ", [
+        ("1. Lợi nhuận trước thuế", "01"),
+        ("2. Khấu hao tài sản cố định", "02"),
+        ("3. Các khoản dự phòng", "03"),
+        ("4. Lãi từ hoạt động đầu tư", "05"),
+        ("5. Tăng giảm các khoản phải thu", "09"),
+        ("6. Tăng giảm các khoản phải trả", "11"),
+        ("Lưu chuyển tiền thuần từ hoạt động kinh doanh", "20"),
+        ("1. Tiền chi để mua sắm tài sản cố định", "21"),
+        ("2. Tiền thu lãi cho vay, cổ tức", "27"),
+        ("Lưu chuyển tiền thuần từ hoạt động đầu tư", "30"),
+        ("1. Tiền chi trả cổ tức cho chủ sở hữu", "36"),
+        ("Lưu chuyển tiền thuần từ hoạt động tài chính", "40"),
+        ("Tiền và tương đương tiền cuối năm", "70"),
+    ]),
+]
+ROWS_PER_PAGE = 24
+
+def _amount(rng):
+    # Whole VND amounts with dot grouping, some negative in parentheses
+    text = f"{rng.randrange(10**6, 10**12):,}".replace(",", ".")
+    return f"({text})" if rng.random() < 0.1 else text
+
+def statement_pages(period, page_count, seed=0):
+    # Returns the text of each page: the three statements in turn, each page a
+    # title, a column header and ROWS_PER_PAGE coded rows. Rows repeat with a
+    # numbered suffix once a statement's template runs out, so any page count
+    # yields distinct line items.
+    rng = random.Random(f"{seed}-{period}")
+    pages = []
+    for page_index in range(page_count):
+        title, template = STATEMENT_TEMPLATES[page_index % len(STATEMENT_TEMPLATES)]
+        round_number = page_index // len(STATEMENT_TEMPLATES)
+        lines = [
+            "CÔNG TY CỔ PHẦN MẪU",
+            title,
+            f"Cho năm tài chính kết thúc ngày 31 tháng 12 năm {period}",
+            f"Chỉ tiêu Mã số Thuyết minh Năm {period} Năm {int(period) - 1}",
+        ]
+        for row_index in range(ROWS_PER_PAGE):
+            item, code = template[(round_number * ROWS_PER_PAGE + row_index) % len(template)]
+            repeat = (round_number * ROWS_PER_PAGE + row_index) // len(template)
+            if repeat:
+                item = f"{item} ({repeat})"
+            note = f"{rng.randrange(1, 30)} " if rng.random() < 0.3 else ""
+            lines.append(f"{item} {code} {note}{_amount(rng)} {_amount(rng)}")
+        pages.append("\n".join(lines))
+    return pages
+
+def _escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def write_statement_pdf(path, period, page_count, scanned=False, scan_dpi=150, seed=0):
+    # Text-layer PDF by default; scanned=True replaces every page with a
+    # grayscale image of itself, so extraction has to OCR it
+    text_doc = fitz.open()
+    for page_text in statement_pages(period, page_count, seed):
+        page = text_doc.new_page(width=595, height=842) # A4 in points
+        page.insert_htmlbox(page.rect + (36, 36, -36, -36), f"<pre style='font-size:8px'>{_escape(page_text)}</pre>")
+    if scanned:
+        scanned_doc = fitz.open()
+        for page in text_doc:
+            pixmap = page.get_pixmap(dpi=scan_dpi, colorspace=fitz.csGRAY)
+            image_page = scanned_doc.new_page(width=page.rect.width, height=page.rect.height)
+            image_page.insert_image(image_page.rect, pixmap=pixmap)
+        text_doc.close()
+        text_doc = scanned_doc
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    text_doc.save(str(path), deflate=True)
+    text_doc.close()
+
+_EXTRACTION_MARKER = "put the columns as"
+_STANDARDIZATION_MARKER = "Standardize the following financial statement items:\n\n"
+
+class FakeStatementLLM(BaseChatModel):
+    # Answers like Gemini would, without a network call: extraction prompts get
+    # the rows of the converter's rule-based VAS parser, standardization prompts
+    # map every item to its title-cased name. `latency` seconds are added per
+    # call to stand in for the round trip.
+    parse_page: object = None # The converter's parse_vas_page
+    latency: float = 0.0
+    model: str = "fake-statement-llm"
+    temperature: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "fake-statement-llm"
+
+    def _reply(self, messages):
+        text = messages[-1].content
+        if _STANDARDIZATION_MARKER in text:
+            items = json.loads(text[text.rindex(_STANDARDIZATION_MARKER) + len(_STANDARDIZATION_MARKER):])
+            content = json.dumps([{"standardized_item": str(item).strip().title(), "original_items": [item]} for item in items], ensure_ascii=False)
+        elif _EXTRACTION_MARKER in text:
+            years = re.findall(r"năm (20\d\d)", text)
+            period = years[0] if years else ""
+            rows, statement_type = [], None
+            text = text.replace("|", " ") # Layout tables read like the plain text without the cell separators
+            for page in re.split(r'(?m)^(?=--- PAGE \d+ ---$)', text):
+                statement_type, page_rows, _ = self.parse_page(page, statement_type, period)
+                rows.extend(page_rows)
+            content = "```json\n" + json.dumps(rows, ensure_ascii=False) + "\n```"
+        else:
+            raise ValueError("FakeStatementLLM received a prompt it does not recognise.")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._reply(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._reply(messages)
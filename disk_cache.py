@@ -0,0 +1,94 @@
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+# Small content-addressed disk cache shared by the pipeline scripts.
+# Entries are plain files named by a SHA-256 key and fanned out into
+# two-character subfolders. An entry's mtime is when it was written and is
+# what the TTL is measured from; a hit only moves its atime forward, so
+# eviction can drop the least recently used entries first without a popular
+# entry outliving its TTL.
+
+CACHE_FILE_SUFFIX = ".cache"
+
+def make_cache_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            digest.update(part)
+        else:
+            digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00") # Keep ("ab", "c") and ("a", "bc") apart
+    return digest.hexdigest()
+
+def file_digest(path):
+    # SHA-256 of a file's content, read in blocks
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _entry_path(cache_dir, key):
+    return Path(cache_dir) / key[:2] / f"{key}{CACHE_FILE_SUFFIX}"
+
+def cache_get(cache_dir, key, ttl_seconds=None):
+    entry_path = _entry_path(cache_dir, key)
+    try:
+        stat = entry_path.stat()
+        if ttl_seconds is not None and time.time() - stat.st_mtime > ttl_seconds:
+            return None
+        value = entry_path.read_text(encoding="utf-8")
+        os.utime(entry_path, ns=(time.time_ns(), stat.st_mtime_ns)) # Mark as recently used, keep the write time
+        return value
+    except (FileNotFoundError, OSError):
+        return None
+
+def atomic_write_text(path, text):
+    # Write to a temporary file first so a reader never sees half a file
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def cache_put(cache_dir, key, value):
+    entry_path = _entry_path(cache_dir, key)
+    entry_path.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write_text(entry_path, value)
+
+def evict_cache(cache_dir, max_bytes=None, ttl_seconds=None):
+    # Drops expired entries (by write time), then the least recently used ones
+    # (by access time) until the cache fits in max_bytes. Returns the number of
+    # entries removed.
+    cache_dir = Path(cache_dir)
+    if not cache_dir.exists():
+        return 0
+
+    now = time.time()
+    entries = []
+    removed = 0
+    for entry_path in cache_dir.glob(f"*/*{CACHE_FILE_SUFFIX}"):
+        try:
+            stat = entry_path.stat()
+        except FileNotFoundError:
+            continue
+        if ttl_seconds is not None and now - stat.st_mtime > ttl_seconds:
+            entry_path.unlink(missing_ok=True)
+            removed += 1
+        else:
+            entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry_path))
+
+    if max_bytes is not None:
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_bytes <= max_bytes:
+                break
+            entry_path.unlink(missing_ok=True)
+            total_bytes -= size
+            removed += 1
+    return removed
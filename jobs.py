@@ -0,0 +1,183 @@
+import itertools
+import threading
+import time
+from collections import deque
+from metrics import RunMetrics
+from pipeline import STAGE_NAMES, run_pipeline
+
+# Background pipeline runs for the Streamlit app. A job runs pipeline.run_pipeline
+# on its own thread, so it keeps going across Streamlit reruns and page reloads
+# while the app polls the registry for progress. Stages report progress through
+# the pipeline's progress_callback (page by page for text extraction, request by
+# request for Gemini); the job records it and, once cancel() is called, raises
+# JobCancelled from the next report so the running stage stops at that point.
+# Gemini requests report as each one finishes: the cancel lands when the next
+# request finishes, and the stage then cancels the requests still in flight and
+# sends none of the queued ones.
+
+JOB_MESSAGE_LIMIT = 200 # Recent progress messages kept per job
+DEFAULT_MAX_RUNNING_JOBS = 2
+
+class JobCancelled(BaseException):
+    # Not an Exception, so the stage scripts' per-period and per-file
+    # `except Exception` handlers do not swallow it
+    pass
+
+class PipelineJob:
+    def __init__(self, job_id, company_folder_name, periods, config, stages=None, force_stages=()):
+        self.job_id = job_id
+        self.company_folder_name = company_folder_name
+        self.periods = [str(period) for period in periods]
+        self.config = config
+        self.stages = stages
+        self.force_stages = tuple(force_stages)
+        self.status = "queued" # queued, running, succeeded, failed, cancelled
+        self.current_stage = None
+        self.stage_progress = {} # {stage: {"message": ..., "done": ..., "total": ...}}
+        self.stage_statuses = {}
+        self.messages = deque(maxlen=JOB_MESSAGE_LIMIT)
+        self.log = ""
+        self.error = None
+        self.warnings = [] # Stages that left some periods out
+        self.metrics = RunMetrics() # Stage timings, readable while the job runs
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def report(self, stage_name, message, done=None, total=None):
+        # The pipeline's progress_callback
+        if self._cancel_event.is_set():
+            raise JobCancelled(f"Cancelled during {stage_name}")
+        with self._lock:
+            self.current_stage = stage_name
+            progress = self.stage_progress.setdefault(stage_name, {"message": "", "done": None, "total": None})
+            progress["message"] = message
+            if total:
+                progress["done"], progress["total"] = done, total
+            self.messages.append(f"{time.strftime('%H:%M:%S')} [{stage_name}] {message}")
+
+    def cancel(self):
+        with self._lock:
+            self._cancel_event.set()
+            if self.status == "queued": # Never started, so nothing to stop
+                self.status = "cancelled"
+                self.finished_at = time.time()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def is_active(self):
+        return self.status in ("queued", "running")
+
+    def _finish(self, status, error=None):
+        with self._lock:
+            self.status = status
+            self.error = error
+            self.finished_at = time.time()
+
+    def run(self):
+        with self._lock:
+            if self.status != "queued":
+                return
+            self.status = "running"
+            self.started_at = time.time()
+        try:
+            outcome = run_pipeline(
+                self.company_folder_name, self.periods,
+                {**self.config, "progress_callback": self.report, "metrics": self.metrics},
+                stages=self.stages, force_stages=self.force_stages,
+            )
+        except JobCancelled as e:
+            self.log = "\n".join(self.messages)
+            self._finish("cancelled", str(e))
+            return
+        except Exception as e:
+            self.log = "\n".join(self.messages)
+            self._finish("failed", str(e))
+            return
+        self.log = outcome["log"]
+        self.stage_statuses = outcome["statuses"]
+        failed = [name for name, status in outcome["statuses"].items() if status in ("failed", "blocked")]
+        self.warnings = [
+            f"{name}: {outcome['errors'].get(name, 'some periods did not complete')}"
+            for name, status in outcome["statuses"].items() if status == "partial"
+        ]
+        if failed:
+            self._finish("failed", f"{', '.join(failed)} did not complete")
+        else:
+            self._finish("succeeded")
+
+    def snapshot(self):
+        # A consistent copy for display while the job thread keeps updating
+        counters, gauges = self.metrics.totals()
+        timing_summary = self.metrics.summary()
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "company": self.company_folder_name,
+                "periods": list(self.periods),
+                "status": self.status,
+                "cancel_requested": self.cancel_requested,
+                "current_stage": self.current_stage,
+                "stage_progress": {name: dict(self.stage_progress[name]) for name in STAGE_NAMES if name in self.stage_progress},
+                "stage_statuses": dict(self.stage_statuses),
+                "messages": list(self.messages),
+                "log": self.log,
+                "error": self.error,
+                "warnings": list(self.warnings),
+                "timing_summary": timing_summary,
+                "counters": counters + gauges,
+                "elapsed_seconds": round((self.finished_at or time.time()) - (self.started_at or time.time()), 1),
+            }
+
+class JobRegistry:
+    # Process-wide list of jobs; at most max_running_jobs run at once and the
+    # rest wait in submission order. One company folder has at most one active
+    # job, since two runs would write the same files.
+    def __init__(self, max_running_jobs=DEFAULT_MAX_RUNNING_JOBS):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max(1, int(max_running_jobs)))
+        self._ids = itertools.count(1)
+
+    def submit(self, company_folder_name, periods, config=None, stages=None, force_stages=()):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.company_folder_name == company_folder_name and job.is_active:
+                    raise ValueError(f"A job for {company_folder_name} is already {job.status} (job {job.job_id}).")
+            job = PipelineJob(next(self._ids), company_folder_name, periods, dict(config or {}), stages, force_stages)
+            self._jobs[job.job_id] = job
+        threading.Thread(target=self._run, args=(job,), name=f"pipeline-job-{job.job_id}", daemon=True).start()
+        return job
+
+    def _run(self, job):
+        with self._slots:
+            job.run()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        # Newest first
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.job_id, reverse=True)
+
+    def active_jobs(self):
+        return [job for job in self.jobs() if job.is_active]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            raise ValueError(f"Unknown job {job_id}.")
+        job.cancel()
+        return job
+
+    def clear_finished(self):
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if not job.is_active]:
+                del self._jobs[job_id]
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from disk_cache import make_cache_key, cache_get, cache_put, evict_cache
+from metrics import timed
+
+# Shared helpers for the Gemini-backed stages (converter and standardizer):
+# JSON clean-up of model responses, a token-bucket rate limiter, retries with
+# exponential backoff on transient errors, and a concurrent batch runner.
+
+# --- Helper to turn a raw LLM response into parsed JSON ---
+def strip_code_fences(llm_response):
+    cleaned_json_string = llm_response.strip()
+    if cleaned_json_string.startswith("```json"):
+        cleaned_json_string = cleaned_json_string[len("```json"):].strip()
+    elif cleaned_json_string.startswith("```"):
+        cleaned_json_string = cleaned_json_string[len("```"):].strip()
+    if cleaned_json_string.endswith("```"):
+        cleaned_json_string = cleaned_json_string[:-len("```")].strip()
+    return cleaned_json_string
+
+def parse_llm_json(llm_response):
+    return json.loads(strip_code_fences(llm_response))
+
+# --- Token estimation ---
+# Rough characters-per-token ratio. Vietnamese text with diacritics and long
+# digit groups tokenizes denser than English prose, so this errs on the side
+# of overestimating the prompt size.
+CHARS_PER_TOKEN = 3.0
+
+def estimate_tokens(text):
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+# --- Persistent response cache ---
+LLM_CACHE_TTL_SECONDS = 30 * 24 * 3600
+LLM_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+class LLMResponseCache:
+    # Disk-backed cache of raw LLM responses for one model + prompt template.
+    # Keys cover the model name, temperature, the full prompt template and a
+    # hash of the input variables, so changing any of them is a miss. Only
+    # responses that parse as JSON are stored, so a malformed answer is
+    # retried on the next run instead of being replayed.
+    def __init__(self, cache_dir, llm, prompt_template, ttl_seconds=LLM_CACHE_TTL_SECONDS, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        model_name = getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+        self.key_prefix = make_cache_key(model_name, getattr(llm, "temperature", None), prompt_template.pretty_repr())
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, inputs):
+        return make_cache_key(self.key_prefix, make_cache_key(json.dumps(inputs, sort_keys=True, ensure_ascii=False)))
+
+    def get(self, inputs):
+        response = cache_get(self.cache_dir, self._key(inputs), self.ttl_seconds)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def put(self, inputs, response):
+        try:
+            parse_llm_json(response)
+        except ValueError:
+            return
+        cache_put(self.cache_dir, self._key(inputs), response)
+
+    def evict(self):
+        return evict_cache(self.cache_dir, max_bytes=self.max_bytes, ttl_seconds=self.ttl_seconds)
+
+    def summary(self):
+        return f"LLM cache: {self.hits} hits, {self.misses} misses."
+
+# --- Rate limiting ---
+class TokenBucketRateLimiter:
+    # Allows `rate_per_second` requests per second on average, with bursts of up
+    # to `capacity`. The state is guarded by a thread lock rather than an asyncio
+    # lock, so one limiter can be shared by event loops running in different
+    # threads (e.g. several companies processed at once).
+    def __init__(self, rate_per_second, capacity=None):
+        if rate_per_second <= 0:
+            raise ValueError("rate_per_second must be positive.")
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_second)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_take(self):
+        # Returns 0 when a token was taken, otherwise the seconds until one is available
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate_per_second
+
+    async def acquire(self):
+        while True:
+            wait_seconds = self._try_take()
+            if wait_seconds <= 0:
+                return
+            await asyncio.sleep(wait_seconds)
+
+# --- Retries ---
+# Matched case-insensitively against the exception type name and message.
+# Quota, overload and network problems are worth retrying; a bad prompt or
+# an invalid API key is not.
+TRANSIENT_ERROR_MARKERS = (
+    "429", "500", "502", "503", "504",
+    "resource exhausted", "resourceexhausted", "rate limit", "ratelimit", "quota",
+    "unavailable", "overloaded", "deadline", "timeout", "timed out", "temporarily",
+    "connection", "internalservererror",
+)
+
+def is_transient_error(exc):
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    description = f"{type(exc).__name__} {exc}".lower()
+    return any(marker in description for marker in TRANSIENT_ERROR_MARKERS)
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+async def ainvoke_with_retry(chain, inputs, rate_limiter=None, max_retries=3, base_delay=1.0, on_retry=None, metrics=None):
+    # With `metrics`, every attempt is an "llm_call" span and the wait for the
+    # rate limiter a "rate_limit_wait" span
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            with timed(metrics, "rate_limit_wait"):
+                await rate_limiter.acquire()
+        try:
+            with timed(metrics, "llm_call", attempt=attempt + 1):
+                return await chain.ainvoke(inputs)
+        except Exception as e:
+            if attempt >= max_retries or not is_transient_error(e):
+                raise
+            delay = backoff_delay(attempt, base_delay)
+            if on_retry is not None:
+                on_retry(attempt + 1, delay, e)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+# --- Concurrent execution ---
+def run_coroutine(coro):
+    # asyncio.run refuses to start inside a running loop (e.g. Jupyter), so fall
+    # back to a helper thread with its own loop in that case.
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    outcome = {}
+    def runner():
+        try:
+            outcome["result"] = asyncio.run(coro)
+        except BaseException as e:
+            outcome["error"] = e
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+def run_chain_batch(chain, inputs_list, max_concurrency=1, rate_limiter=None, max_retries=3, base_delay=1.0, on_retry=None, response_cache=None, on_cache_hit=None, on_done=None, metrics=None):
+    # Invokes `chain` once per item of `inputs_list`, with at most `max_concurrency`
+    # requests in flight. Returns one entry per input, in input order: the
+    # response, or the exception that the request finally failed with.
+    # Cache hits skip both the rate limiter and the request. on_done(index,
+    # response or exception) is called as each request finishes; anything it
+    # raises that is not an Exception (e.g. a job cancellation) stops the batch:
+    # requests that have not been sent yet are dropped, requests in flight are
+    # cancelled, and the error is re-raised.
+    # With `metrics` (a stage view of metrics.RunMetrics), calls are timed and
+    # cache hits, prompt and response sizes and estimated tokens are counted.
+    def count_sizes(inputs, response):
+        if metrics is None:
+            return
+        prompt_text = "".join(str(value) for value in inputs.values())
+        metrics.count("llm_prompt_chars", len(prompt_text))
+        metrics.count("llm_prompt_tokens_estimated", estimate_tokens(prompt_text))
+        metrics.count("llm_response_chars", len(response))
+        metrics.count("llm_response_tokens_estimated", estimate_tokens(response))
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(max(1, int(max_concurrency or 1)))
+        stop_errors = [] # Set once on_done raises a non-Exception
+        tasks = []
+
+        def check_stopped():
+            if stop_errors:
+                raise asyncio.CancelledError()
+
+        async def run_one(index, inputs):
+            check_stopped()
+            if response_cache is not None:
+                cached_response = response_cache.get(inputs)
+                if cached_response is not None:
+                    if metrics is not None:
+                        metrics.count("llm_cache_hits")
+                    if on_cache_hit is not None:
+                        on_cache_hit(index)
+                    return cached_response
+                if metrics is not None:
+                    metrics.count("llm_cache_misses")
+            async with semaphore:
+                check_stopped() # Stopped while waiting for a slot: do not take a rate limiter token
+                def report_retry(attempt, delay, error):
+                    if metrics is not None:
+                        metrics.count("llm_retries")
+                    if on_retry is not None:
+                        on_retry(index, attempt, delay, error)
+                response = await ainvoke_with_retry(chain, inputs, rate_limiter, max_retries, base_delay, report_retry, metrics)
+            count_sizes(inputs, response)
+            if response_cache is not None:
+                response_cache.put(inputs, response)
+            return response
+
+        def notify_done(index, outcome):
+            if on_done is None:
+                return
+            try:
+                on_done(index, outcome)
+            except Exception:
+                raise
+            except BaseException as e:
+                # First stop wins: cancel every other request, queued or in flight
+                if not stop_errors:
+                    stop_errors.append(e)
+                    current_task = asyncio.current_task()
+                    for task in tasks:
+                        if task is not current_task:
+                            task.cancel()
+                raise
+
+        async def run_tracked(index, inputs):
+            try:
+                response = await run_one(index, inputs)
+            except Exception as e:
+                notify_done(index, e)
+                raise
+            notify_done(index, response)
+            return response
+
+        tasks.extend(asyncio.ensure_future(run_tracked(index, inputs)) for index, inputs in enumerate(inputs_list))
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
+        if stop_errors:
+            raise stop_errors[0]
+        return responses
+
+    responses = run_coroutine(run_all())
+    for response in responses:
+        if isinstance(response, BaseException) and not isinstance(response, Exception):
+            raise response
+    return responses
@@ -0,0 +1,193 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from disk_cache import atomic_write_text
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# Run metrics for the pipeline stages: timed spans (a stage, a page render, an
+# OCR call, a Gemini request, an Excel or Parquet read/write), counters (cache
+# hits, prompt and response sizes, estimated tokens) and gauges (peak RSS).
+# A run creates one RunMetrics; each stage gets a view bound to its name
+# through for_stage and passes it down as `metrics`. write_run_report saves a
+# JSON run report and a Prometheus text-format file.
+
+RUN_REPORT_VERSION = 1
+RUN_REPORTS_DIR_NAME = "run_reports"
+PROMETHEUS_FILE_NAME = "metrics.prom" # Latest run, for a node_exporter textfile collector
+METRIC_PREFIX = "pipeline_"
+
+def peak_rss_bytes(children=False):
+    # Peak resident set size of this process (or of its finished child
+    # processes, e.g. OCR workers) so far; 0 where getrusage is unavailable
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # Bytes on macOS, KiB elsewhere
+
+def timed(metrics, name, **attributes):
+    # metrics.span(...) when metrics are recorded, else a no-op context
+    return metrics.span(name, **attributes) if metrics is not None else nullcontext({})
+
+class RunMetrics:
+    # Thread-safe; spans may be recorded from worker threads and event loops
+    def __init__(self):
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.spans = []
+        self.counters = {} # {(name, stage): value}
+        self.gauges = {} # {(name, stage): value}
+        self._lock = threading.Lock()
+
+    def for_stage(self, stage):
+        return StageMetrics(self, stage)
+
+    @contextmanager
+    def span(self, name, stage=None, **attributes):
+        # Yields the attribute dict, so the body can add e.g. a response size
+        started_at = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            self.add_span(name, time.perf_counter() - started_at, stage=stage, started_at=started_at, **attributes)
+
+    def add_span(self, name, seconds, stage=None, started_at=None, **attributes):
+        # Also for work timed elsewhere, e.g. inside an OCR worker process
+        record = {"name": name, "stage": stage, "seconds": round(seconds, 6)}
+        if started_at is not None:
+            record["offset_seconds"] = round(started_at - self._origin, 6)
+        record.update(attributes)
+        with self._lock:
+            self.spans.append(record)
+
+    def count(self, name, value=1, stage=None):
+        with self._lock:
+            self.counters[(name, stage)] = self.counters.get((name, stage), 0) + value
+
+    def set_max(self, name, value, stage=None):
+        with self._lock:
+            self.gauges[(name, stage)] = max(self.gauges.get((name, stage), value), value)
+
+    def record_peak_rss(self, stage=None):
+        self.set_max("peak_rss_bytes", peak_rss_bytes(), stage)
+        child_peak = peak_rss_bytes(children=True)
+        if child_peak:
+            self.set_max("peak_child_rss_bytes", child_peak, stage)
+
+    def summary(self):
+        # One row per (stage, span name), in the order they first occurred
+        with self._lock:
+            spans = list(self.spans)
+        rows = {}
+        for span in spans:
+            row = rows.setdefault((span["stage"], span["name"]), {"stage": span["stage"], "span": span["name"], "count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            row["count"] += 1
+            row["total_seconds"] += span["seconds"]
+            row["max_seconds"] = max(row["max_seconds"], span["seconds"])
+        for row in rows.values():
+            row["mean_ms"] = round(1000 * row["total_seconds"] / row["count"], 2)
+            row["max_ms"] = round(1000 * row.pop("max_seconds"), 2)
+            row["total_seconds"] = round(row["total_seconds"], 4)
+        return list(rows.values())
+
+    def totals(self):
+        # ([counter rows], [gauge rows]) as {"stage", "name", "value"}
+        with self._lock:
+            counters = [{"stage": stage, "name": name, "value": value} for (name, stage), value in self.counters.items()]
+            gauges = [{"stage": stage, "name": name, "value": value} for (name, stage), value in self.gauges.items()]
+        return counters, gauges
+
+    def to_dict(self, **context):
+        counters, gauges = self.totals()
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "version": RUN_REPORT_VERSION,
+            **context,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "elapsed_seconds": round(time.perf_counter() - self._origin, 3),
+            "summary": self.summary(),
+            "counters": counters,
+            "gauges": gauges,
+            "spans": spans,
+        }
+
+    def to_prometheus(self, **labels):
+        # Prometheus text exposition format; `labels` are added to every sample
+        families = {}
+        def add(metric, metric_type, help_text, sample_labels, value):
+            family = families.setdefault(metric, {"type": metric_type, "help": help_text, "samples": []})
+            family["samples"].append(({**labels, **sample_labels}, value))
+
+        for row in self.summary():
+            span_labels = {"stage": row["stage"] or "", "span": row["span"]}
+            add(f"{METRIC_PREFIX}span_seconds_total", "counter", "Time spent in spans of this kind", span_labels, row["total_seconds"])
+            add(f"{METRIC_PREFIX}span_count_total", "counter", "Number of spans of this kind", span_labels, row["count"])
+        with self._lock:
+            counters = list(self.counters.items())
+            gauges = list(self.gauges.items())
+        for (name, stage), value in counters:
+            add(f"{METRIC_PREFIX}{name}_total", "counter", name.replace("_", " "), {"stage": stage or ""}, value)
+        for (name, stage), value in gauges:
+            add(f"{METRIC_PREFIX}{name}", "gauge", name.replace("_", " "), {"stage": stage or ""}, value)
+        add(f"{METRIC_PREFIX}run_timestamp_seconds", "gauge", "When the run started", {}, round(self.started_at, 3))
+
+        lines = []
+        for metric, family in families.items():
+            lines.append(f"# HELP {metric} {family['help']}")
+            lines.append(f"# TYPE {metric} {family['type']}")
+            for sample_labels, value in family["samples"]:
+                label_text = ",".join(f'{key}="{_escape_label(value_text)}"' for key, value_text in sample_labels.items())
+                lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+class StageMetrics:
+    # RunMetrics with the stage label filled in
+    def __init__(self, run_metrics, stage):
+        self.run_metrics = run_metrics
+        self.stage = stage
+
+    def span(self, name, **attributes):
+        return self.run_metrics.span(name, stage=self.stage, **attributes)
+
+    def add_span(self, name, seconds, started_at=None, **attributes):
+        self.run_metrics.add_span(name, seconds, stage=self.stage, started_at=started_at, **attributes)
+
+    def count(self, name, value=1):
+        self.run_metrics.count(name, value, stage=self.stage)
+
+    def set_max(self, name, value):
+        self.run_metrics.set_max(name, value, stage=self.stage)
+
+    def record_peak_rss(self):
+        self.run_metrics.record_peak_rss(stage=self.stage)
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def write_run_report(metrics, company_dir, **context):
+    # Writes <company>/run_reports/<timestamp>_run.json and overwrites
+    # <company>/run_reports/metrics.prom; returns both paths
+    reports_dir = Path(company_dir) / RUN_REPORTS_DIR_NAME
+    reports_dir.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(metrics.started_at))
+    json_path = reports_dir / f"{stamp}_run.json"
+    prometheus_path = reports_dir / PROMETHEUS_FILE_NAME
+    atomic_write_text(json_path, json.dumps(metrics.to_dict(**context), ensure_ascii=False, indent=2, default=str))
+    atomic_write_text(prometheus_path, metrics.to_prometheus(company=Path(company_dir).name))
+    return json_path, prometheus_path
+
+def format_summary_table(summary_rows):
+    lines = [f"{'Stage':<13}  {'Span':<18}  {'Count':>6}  {'Total s':>9}  {'Mean ms':>9}  {'Max ms':>9}"]
+    for row in summary_rows:
+        lines.append(f"{row['stage'] or '':<13}  {row['span']:<18}  {row['count']:>6}  {row['total_seconds']:>9.3f}  {row['mean_ms']:>9.1f}  {row['max_ms']:>9.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,164 @@
+import os
+import re
+import threading
+import time
+
+try:
+    import pytesseract
+except ImportError: # Not needed when tesserocr is installed
+    pytesseract = None
+
+try:
+    import tesserocr
+except ImportError: # Optional: pip install tesserocr (needs the Tesseract development headers)
+    tesserocr = None
+
+# OCR backends for text extraction. Each engine takes a grayscale PIL image and
+# the DPI it was rendered at, and returns the page text or tesseract's word
+# data (the dict pytesseract.image_to_data returns).
+#   pytesseract  runs the tesseract executable once per call, which reloads the
+#                language model every time; always available
+#   tesserocr    keeps one initialized tesseract instance in memory and feeds
+#                it raw pixels; needs the optional tesserocr package
+# "auto" picks tesserocr when it is installed and falls back to pytesseract.
+# Engines are created once per process by get_ocr_engine, so a pool worker
+# keeps its engine (and its loaded model) for its whole lifetime.
+
+OCR_ENGINES = ("auto", "tesserocr", "pytesseract")
+DEFAULT_OCR_ENGINE = "auto"
+WORD_DATA_KEYS = ("text", "conf", "block_num", "par_num", "line_num", "left", "top", "width", "height")
+
+def resolve_ocr_engine(name):
+    # Returns (engine name, note); the note explains a fallback, else None
+    name = (name or DEFAULT_OCR_ENGINE).lower()
+    if name not in OCR_ENGINES:
+        raise ValueError(f"Unknown OCR engine '{name}'. Choose from {', '.join(OCR_ENGINES)}.")
+    if name == "pytesseract" and (pytesseract is not None or tesserocr is None):
+        return name, None
+    if name == "pytesseract":
+        return "tesserocr", "pytesseract is not installed; using tesserocr."
+    if tesserocr is None:
+        note = "tesserocr is not installed; using pytesseract." if name == "tesserocr" else None
+        return "pytesseract", note
+    return "tesserocr", None
+
+class PytesseractEngine:
+    name = "pytesseract"
+    persistent = False # The model is loaded by every tesseract process
+
+    def __init__(self, lang, config):
+        if pytesseract is None:
+            raise ImportError("OCR needs pytesseract or tesserocr; install one of them (see requirements.txt).")
+        self.lang = lang
+        self.config = config
+
+    def _config(self, dpi):
+        # The page image goes through an uncompressed temp file that carries no
+        # resolution, so tesseract is told it
+        return f"{self.config} --dpi {int(dpi)}" if dpi else self.config
+
+    def image_to_string(self, img, dpi=None):
+        return pytesseract.image_to_string(img, lang=self.lang, config=self._config(dpi))
+
+    def image_to_data(self, img, dpi=None):
+        return pytesseract.image_to_data(img, lang=self.lang, config=self._config(dpi), output_type=pytesseract.Output.DICT)
+
+    def close(self):
+        pass
+
+class TesserocrEngine:
+    name = "tesserocr"
+    persistent = True
+
+    def __init__(self, lang, config):
+        psm_match = re.search(r'--psm\s+(\d+)', config)
+        psm = int(psm_match.group(1)) if psm_match else tesserocr.PSM.AUTO
+        self.api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm)
+        for key, value in re.findall(r'-c\s+(\w+)=(\S+)', config):
+            self.api.SetVariable(key, value)
+        # One page at a time per instance; threads in one process share it
+        self._lock = threading.Lock()
+
+    def _set_image(self, img, dpi):
+        img = img if img.mode == "L" else img.convert("L")
+        self.api.SetImageBytes(img.tobytes(), img.width, img.height, 1, img.width)
+        if dpi:
+            self.api.SetSourceResolution(int(dpi))
+
+    def image_to_string(self, img, dpi=None):
+        with self._lock:
+            self._set_image(img, dpi)
+            return self.api.GetUTF8Text()
+
+    def image_to_data(self, img, dpi=None):
+        # Words numbered by block, paragraph and line like tesseract's TSV output
+        with self._lock:
+            self._set_image(img, dpi)
+            self.api.Recognize()
+            data = {key: [] for key in WORD_DATA_KEYS}
+            iterator = self.api.GetIterator()
+            if iterator is None:
+                return data
+            block_num = par_num = line_num = 0
+            level = tesserocr.RIL.WORD
+            for word in tesserocr.iterate_level(iterator, level):
+                if word.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                    block_num, par_num, line_num = block_num + 1, 0, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.PARA):
+                    par_num, line_num = par_num + 1, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line_num += 1
+                box = word.BoundingBox(level)
+                if box is None:
+                    continue
+                left, top, right, bottom = box
+                data["text"].append(word.GetUTF8Text(level) or "")
+                data["conf"].append(word.Confidence(level))
+                data["block_num"].append(block_num)
+                data["par_num"].append(par_num)
+                data["line_num"].append(line_num)
+                data["left"].append(left)
+                data["top"].append(top)
+                data["width"].append(right - left)
+                data["height"].append(bottom - top)
+            return data
+
+    def close(self):
+        self.api.End()
+
+_ENGINE_CLASSES = {"pytesseract": PytesseractEngine, "tesserocr": TesserocrEngine}
+_engines = {} # {(name, lang, config): engine}, per process
+_unreported_load_seconds = [] # Model loads not yet passed back to the caller
+_engines_lock = threading.Lock()
+
+def get_ocr_engine(name, lang, config):
+    # The process-wide engine for these settings, created on first use
+    name, _ = resolve_ocr_engine(name)
+    key = (name, lang, config)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            started_at = time.perf_counter()
+            engine = _ENGINE_CLASSES[name](lang, config)
+            if engine.persistent:
+                _unreported_load_seconds.append(time.perf_counter() - started_at)
+            _engines[key] = engine
+        return engine
+
+def _forget_parent_engines():
+    # A forked worker must not share the parent's tesseract instance (or a lock
+    # another parent thread held at fork time); it loads its own
+    global _engines_lock
+    _engines.clear()
+    _unreported_load_seconds.clear()
+    _engines_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"): # POSIX; Windows workers are spawned fresh
+    os.register_at_fork(after_in_child=_forget_parent_engines)
+
+def take_engine_load_seconds():
+    # Seconds spent loading models since the last call, for the run log
+    with _engines_lock:
+        load_seconds = list(_unreported_load_seconds)
+        _unreported_load_seconds.clear()
+    return load_seconds
@@ -0,0 +1,544 @@
+import argparse
+import functools
+import hashlib
+import importlib.util
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+from disk_cache import atomic_write_text, file_digest
+from metrics import RunMetrics, format_summary_table, timed, write_run_report
+from ocr_engines import resolve_ocr_engine
+
+# Headless runner for the five pipeline stages, for cron and batch jobs.
+# Each stage declares the files it reads and writes inside the company folder.
+# A stage is skipped when its inputs, its settings and its code are unchanged
+# since its last successful run and its outputs are still the ones it wrote,
+# much like make with content hashes instead of timestamps. Text extraction
+# and LLM extraction are tracked per period, so a new period does not rerun
+# the others. Forcing a stage reruns it and everything downstream of it.
+#
+#   python pipeline.py PVIAM --periods 2021,2022,2023 --method hybrid
+#   python pipeline.py PVIAM --periods 2021,2022,2023 --force formatter
+
+REPO_DIR = Path(__file__).resolve().parent
+PIPELINE_STATE_NAME = "pipeline_state.json"
+PIPELINE_STATE_VERSION = 1
+
+# Settings shared by the stages; see each run_*_process for their meaning
+PIPELINE_DEFAULTS = {
+    "extraction_method": "ocr",
+    "page_ranges": None, # {period: (start_page, end_page)}, 1-based and inclusive
+    "auto_locate": False,
+    "num_workers": 1,
+    "ocr_memory_mb": None, # Memory budget for pages OCRed in parallel; None keeps the script default
+    "ocr_preprocess": None, # Image preprocessing steps before OCR, e.g. ["binarize", "deskew"]
+    "ocr_engine": "auto", # auto, tesserocr or pytesseract; see ocr_engines.py
+    "layout_tables": False, # Rebuild table columns from word positions and send those tables to Gemini
+    "use_ocr_cache": True,
+    "max_concurrency": 4,
+    "requests_per_second": None,
+    "use_llm_cache": True,
+    "chunk_token_budget": None,
+    "compact_prompt": False, # Drop prose pages, boilerplate and repeated headers before the Gemini prompt
+    "use_rule_parser": False,
+    "export_xlsx": False,
+    "use_dictionary": True,
+    "llm": None, # A LangChain chat model to use instead of Gemini
+    # Shared between companies by a batch run (see batch.py); never fingerprinted
+    "ocr_executor": None,
+    "ocr_memory_budget": None, # Render memory held across every company using ocr_executor
+    "rate_limiter": None,
+    "dictionary": None,
+    # progress_callback(stage_name, message, done=None, total=None); see jobs.py
+    "progress_callback": None,
+    "metrics": None, # metrics.RunMetrics; run_pipeline creates one when missing
+}
+
+# --- Loading the numbered stage scripts ---
+_module_lock = threading.Lock() # Batch runs load stages from several threads
+
+def load_stage_module(script_name):
+    # "2. converter_script.py" is not importable by name, so load it from its path
+    # under the module name app.py uses ("converter_script")
+    module_name = Path(script_name).stem.split(". ", 1)[-1]
+    script_path = REPO_DIR / script_name
+    with _module_lock:
+        module = sys.modules.get(module_name)
+        if module is not None and Path(getattr(module, "__file__", "")).resolve() == script_path:
+            return module
+        spec = importlib.util.spec_from_file_location(module_name, script_path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[module_name]
+            raise
+        return module
+
+# --- Fingerprints ---
+def _period_page_range(config, period):
+    return list((config["page_ranges"] or {}).get(period) or ()) or None
+
+def _resolved_ocr_engine(config):
+    # The engine text extraction will actually run ("auto" and fallbacks
+    # resolved), or None when the method does no OCR
+    if config["extraction_method"].lower() == "direct":
+        return None
+    return resolve_ocr_engine(config["ocr_engine"])[0]
+
+class PipelineStage:
+    # inputs/outputs are glob patterns relative to the company folder; "{period}"
+    # is filled in with the period of a per-period stage, or with every period
+    # for the others. A run only counts as successful for a period (or the
+    # whole company) when every required output exists afterwards.
+    def __init__(self, name, script_name, function_name, depends_on=(), inputs=(), outputs=(), required_outputs=(),
+                 per_period=False, takes_periods=True, shared_modules=(), settings=None, kwargs=None):
+        self.name = name
+        self.script_name = script_name
+        self.function_name = function_name
+        self.depends_on = tuple(depends_on)
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.required_outputs = tuple(required_outputs)
+        self.per_period = per_period
+        self.takes_periods = takes_periods
+        self.shared_modules = tuple(shared_modules)
+        self.settings = settings # (config, period, periods) -> settings that change the stage's output
+        self.kwargs = kwargs # config -> keyword arguments for the run function
+
+    def _files(self, company_dir, patterns, periods):
+        files = set()
+        for pattern in patterns:
+            for expanded in dict.fromkeys(pattern.format(period=period) for period in periods):
+                files.update(path for path in company_dir.glob(expanded) if path.is_file())
+        return sorted(files)
+
+    def _unit_periods(self, period, periods):
+        return [period] if self.per_period else periods
+
+    def input_files(self, company_dir, period, periods):
+        return self._files(company_dir, self.inputs, self._unit_periods(period, periods))
+
+    def output_files(self, company_dir, period, periods):
+        return self._files(company_dir, self.outputs, self._unit_periods(period, periods))
+
+    def has_required_outputs(self, company_dir, period, periods):
+        unit_periods = self._unit_periods(period, periods)
+        return all(self._files(company_dir, (pattern,), unit_periods) for pattern in self.required_outputs)
+
+    def fingerprint(self, company_dir, period, periods, config):
+        digest = hashlib.sha256()
+        for code_file in (self.script_name,) + self.shared_modules:
+            digest.update(f"code:{code_file}:{file_digest(REPO_DIR / code_file)}\n".encode("utf-8"))
+        settings = self.settings(config, period, periods) if self.settings else {}
+        digest.update(f"settings:{json.dumps(settings, sort_keys=True, default=str)}\n".encode("utf-8"))
+        for path in self.input_files(company_dir, period, periods):
+            digest.update(f"input:{path.relative_to(company_dir).as_posix()}:{file_digest(path)}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def run(self, company_folder_name, periods, config):
+        run_function = getattr(load_stage_module(self.script_name), self.function_name)
+        kwargs = self.kwargs(config) if self.kwargs else {}
+        if config.get("progress_callback") is not None:
+            kwargs["progress_callback"] = functools.partial(config["progress_callback"], self.name)
+        if config.get("metrics") is not None:
+            kwargs["metrics"] = config["metrics"].for_stage(self.name)
+        if not self.takes_periods:
+            return run_function(company_folder_name, **kwargs)
+        return run_function(company_folder_name, periods, **kwargs)
+
+PIPELINE_STAGES = [
+    PipelineStage(
+        "pdf_to_text", "1. pdf_to_text_script.py", "run_pdf_to_text_process",
+        inputs=("financial_statements/{period}.pdf",),
+        outputs=("text_statements/{period}_ocr.txt", "text_statements/{period}_ocr_table.txt", "text_statements/{period}_pages.json"),
+        required_outputs=("text_statements/{period}_ocr.txt",),
+        per_period=True,
+        shared_modules=("disk_cache.py", "ocr_engines.py"),
+        settings=lambda config, period, periods: {
+            "extraction_method": config["extraction_method"],
+            "page_range": _period_page_range(config, period),
+            "auto_locate": config["auto_locate"],
+            # Only fingerprinted when set, so runs without it stay up to date
+            **({"ocr_preprocess": sorted(config["ocr_preprocess"])} if config["ocr_preprocess"] else {}),
+            **({"layout_tables": True} if config["layout_tables"] else {}),
+            **({"ocr_engine": _resolved_ocr_engine(config)} if _resolved_ocr_engine(config) not in (None, "pytesseract") else {}),
+        },
+        kwargs=lambda config: {
+            "extraction_method": config["extraction_method"],
+            "num_workers": config["num_workers"],
+            "page_range": config["page_ranges"],
+            "auto_locate": config["auto_locate"],
+            "use_cache": config["use_ocr_cache"],
+            "executor": config["ocr_executor"],
+            "shared_memory_budget": config["ocr_memory_budget"],
+            **({"memory_budget_bytes": int(config["ocr_memory_mb"] * 1024**2)} if config["ocr_memory_mb"] else {}),
+            "preprocess": config["ocr_preprocess"],
+            "ocr_engine": config["ocr_engine"],
+            "layout": config["layout_tables"],
+        },
+    ),
+    PipelineStage(
+        "converter", "2. converter_script.py", "run_converter_process",
+        depends_on=("pdf_to_text",),
+        inputs=("text_statements/{period}_ocr.txt", "text_statements/{period}_ocr_table.txt", "text_statements/{period}_pages.json"),
+        outputs=("excel_statements/{period}_financial_statements.*", "json_statements/{period}_financial_statements_raw.json"),
+        required_outputs=("excel_statements/{period}_financial_statements.parquet",),
+        per_period=True,
+        shared_modules=("disk_cache.py", "llm_utils.py", "statement_store.py", "value_parser.py"),
+        settings=lambda config, period, periods: {
+            "page_range": _period_page_range(config, period),
+            "use_located_pages": config["auto_locate"],
+            "chunk_token_budget": config["chunk_token_budget"],
+            "use_rule_parser": config["use_rule_parser"],
+            "export_xlsx": config["export_xlsx"],
+            **({"use_layout_tables": True} if config["layout_tables"] else {}),
+            **({"compact_prompt": True} if config["compact_prompt"] else {}),
+        },
+        kwargs=lambda config: {
+            "extraction_method": config["extraction_method"],
+            "start_page": None,
+            "end_page": None,
+            "page_ranges": config["page_ranges"],
+            "use_located_pages": config["auto_locate"],
+            "max_concurrency": config["max_concurrency"],
+            "requests_per_second": config["requests_per_second"],
+            "rate_limiter": config["rate_limiter"],
+            "use_llm_cache": config["use_llm_cache"],
+            "llm": config["llm"],
+            "chunk_token_budget": config["chunk_token_budget"],
+            "use_rule_parser": config["use_rule_parser"],
+            "export_xlsx": config["export_xlsx"],
+            "use_layout_tables": config["layout_tables"],
+            "compact_prompt": config["compact_prompt"],
+        },
+    ),
+    PipelineStage(
+        "merger", "3. merger_script.py", "run_merger_process",
+        depends_on=("converter",),
+        inputs=("excel_statements/{period}_financial_statements.parquet", "excel_statements/{period}_financial_statements.xlsx"),
+        outputs=("period_statements/*.parquet", "period_statements/*.xlsx"),
+        required_outputs=("period_statements/all_periods_concatenated.parquet",),
+        shared_modules=("disk_cache.py", "statement_store.py", "value_parser.py"),
+        settings=lambda config, period, periods: {"periods": periods, "export_xlsx": config["export_xlsx"]},
+        kwargs=lambda config: {"export_xlsx": config["export_xlsx"]},
+    ),
+    PipelineStage(
+        "formatter", "4. formatter_script.py", "run_formatter_process",
+        depends_on=("merger",),
+        inputs=("period_statements/all_periods_concatenated.parquet",),
+        outputs=("final_statements/*.parquet", "final_statements/*.xlsx"),
+        required_outputs=("final_statements/*.parquet",),
+        shared_modules=("statement_store.py", "value_parser.py"),
+        settings=lambda config, period, periods: {"periods": periods, "export_xlsx": config["export_xlsx"]},
+        kwargs=lambda config: {"export_xlsx": config["export_xlsx"]},
+    ),
+    # The shared standardization dictionary is deliberately not an input: every
+    # run adds to it, which would otherwise make this stage always out of date.
+    PipelineStage(
+        "standardizer", "5. standardizer_script.py", "run_standardizer_process",
+        depends_on=("formatter",),
+        inputs=("final_statements/*.parquet",),
+        outputs=("final_statements_standardized/*.xlsx",),
+        required_outputs=("final_statements_standardized/*.xlsx",),
+        takes_periods=False,
+        shared_modules=("llm_utils.py", "statement_store.py", "standardization_store.py"),
+        settings=lambda config, period, periods: {"use_dictionary": config["use_dictionary"]},
+        kwargs=lambda config: {
+            "llm": config["llm"],
+            "use_llm_cache": config["use_llm_cache"],
+            "use_dictionary": config["use_dictionary"],
+            "dictionary": config["dictionary"],
+            "max_concurrency": config["max_concurrency"],
+            "requests_per_second": config["requests_per_second"],
+            "rate_limiter": config["rate_limiter"],
+        },
+    ),
+]
+STAGE_NAMES = [stage.name for stage in PIPELINE_STAGES]
+
+def downstream_stages(stage_names):
+    # The given stages plus every stage that depends on them, directly or not
+    selected = set(stage_names)
+    for stage in PIPELINE_STAGES: # Listed in dependency order
+        if selected.intersection(stage.depends_on):
+            selected.add(stage.name)
+    return selected
+
+# --- Run state ---
+def load_pipeline_state(company_dir):
+    state_path = Path(company_dir) / PIPELINE_STATE_NAME
+    try:
+        with state_path.open("r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return state.get("stages", {}) if state.get("version") == PIPELINE_STATE_VERSION else {}
+
+def save_pipeline_state(company_dir, stages_state):
+    atomic_write_text(
+        Path(company_dir) / PIPELINE_STATE_NAME,
+        json.dumps({"version": PIPELINE_STATE_VERSION, "stages": stages_state}, ensure_ascii=False, indent=2, sort_keys=True),
+    )
+
+def _outputs_unchanged(company_dir, recorded_outputs):
+    for relative_path, digest in recorded_outputs.items():
+        path = company_dir / relative_path
+        if not path.exists() or file_digest(path) != digest:
+            return False
+    return True
+
+def is_up_to_date(company_dir, unit_state, fingerprint):
+    return bool(unit_state) and unit_state.get("fingerprint") == fingerprint and _outputs_unchanged(company_dir, unit_state.get("outputs", {}))
+
+def validate_stage_names(stages=None, force_stages=()):
+    # Returns (selected stage names, forced stage names including their downstream)
+    selected_stages = set(stages or STAGE_NAMES)
+    unknown_stages = (selected_stages | set(force_stages)) - set(STAGE_NAMES)
+    if unknown_stages:
+        raise ValueError(f"Unknown pipeline stage(s): {', '.join(sorted(unknown_stages))}. Expected one of: {', '.join(STAGE_NAMES)}.")
+    return selected_stages, downstream_stages(force_stages)
+
+# Runs one stage for one company unless it is up to date. Returns
+# (status, log lines, error or None, periods with output); stages_state is
+# updated and saved after a run. A per-period stage that produced output for
+# some periods but not others is "partial", and later stages run for the
+# periods it did produce.
+def run_pipeline_stage(stage, company_folder_name, periods_to_process, config, stages_state, forced=False, dry_run=False):
+    company_dir = Path(company_folder_name)
+    results = []
+    stage_state = stages_state.setdefault(stage.name, {})
+    units = periods_to_process if stage.per_period else ["all"]
+    fingerprints = {
+        unit: stage.fingerprint(company_dir, unit, periods_to_process, config)
+        for unit in units
+    }
+    if forced:
+        stale_units = units
+    else:
+        stale_units = [unit for unit in units if not is_up_to_date(company_dir, stage_state.get(unit), fingerprints[unit])]
+
+    def unit_periods(completed_units):
+        if stage.per_period:
+            return [period for period in periods_to_process if period in completed_units]
+        return list(periods_to_process) if completed_units else []
+
+    if not stale_units:
+        results.append(f"\n[{stage.name}] Up to date. Skipping.")
+        return "up to date", results, None, list(periods_to_process)
+    stale_periods = stale_units if stage.per_period else periods_to_process
+    reason = "forced" if forced else "inputs, settings, code or outputs changed"
+    period_note = f" for {', '.join(stale_units)}" if stage.per_period else ""
+    if dry_run:
+        results.append(f"\n[{stage.name}] Would run{period_note} ({reason}).")
+        return "would run", results, None, list(periods_to_process)
+
+    results.append(f"\n[{stage.name}] Running{period_note} ({reason})...")
+    report_progress = config.get("progress_callback") or (lambda stage_name, message, done=None, total=None: None)
+    report_progress(stage.name, f"Running{period_note}")
+    started_at = time.perf_counter()
+    metrics = config.get("metrics")
+    try:
+        with timed(metrics, "stage", stage=stage.name, periods=stale_periods):
+            stage_log = stage.run(company_folder_name, stale_periods, config)
+    except Exception as e:
+        if metrics is not None:
+            metrics.record_peak_rss(stage.name)
+        completed_periods = unit_periods([unit for unit in units if unit not in stale_units])
+        results.append(f"[{stage.name}] Failed{period_note}: {e}")
+        report_progress(stage.name, f"Failed{period_note}: {e}")
+        if completed_periods:
+            results.append(f"[{stage.name}] Continuing with {', '.join(completed_periods)}, which are up to date.")
+            return "partial", results, str(e), completed_periods
+        return "failed", results, str(e), []
+    results.append(stage_log)
+    if metrics is not None:
+        metrics.record_peak_rss(stage.name)
+
+    incomplete_units = []
+    for unit in stale_units:
+        if not stage.has_required_outputs(company_dir, unit, periods_to_process):
+            # Retried on the next run instead of being recorded as done
+            stage_state.pop(unit, None)
+            incomplete_units.append(unit)
+            continue
+        stage_state[unit] = {
+            "fingerprint": fingerprints[unit],
+            "outputs": {path.relative_to(company_dir).as_posix(): file_digest(path) for path in stage.output_files(company_dir, unit, periods_to_process)},
+            "completed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+    save_pipeline_state(company_dir, stages_state)
+
+    elapsed = time.perf_counter() - started_at
+    completed_periods = unit_periods([unit for unit in units if unit not in incomplete_units])
+    if incomplete_units:
+        error = f"produced no output for {', '.join(incomplete_units)}"
+        status = "partial" if completed_periods else "failed"
+        results.append(f"[{stage.name}] Finished in {elapsed:.1f}s, but {error}.")
+        report_progress(stage.name, f"Finished in {elapsed:.1f}s, but {error}")
+        return status, results, error, completed_periods
+    results.append(f"[{stage.name}] Finished in {elapsed:.1f}s.")
+    report_progress(stage.name, f"Finished in {elapsed:.1f}s", 1, 1)
+    return "ran", results, None, completed_periods
+
+def upstream_periods(stage, periods_to_process, periods_by_stage):
+    # The periods every upstream stage has output for; a stage that was not
+    # selected (and so is missing from periods_by_stage) does not narrow them
+    periods = list(periods_to_process)
+    for name in stage.depends_on:
+        if name in periods_by_stage:
+            periods = [period for period in periods if period in periods_by_stage[name]]
+    return periods
+
+def save_run_report(company_folder_name, periods_to_process, metrics, statuses):
+    # Writes the run's metrics to <company>/run_reports when a stage ran.
+    # Returns the log lines: a timing summary and where the report went.
+    if not any(status in ("ran", "partial", "failed") for status in statuses.values()):
+        return []
+    results = ["\n--- Timing Summary ---", format_summary_table(metrics.summary())]
+    try:
+        json_path, prometheus_path = write_run_report(
+            metrics, company_folder_name,
+            company=Path(company_folder_name).name, periods=periods_to_process, statuses=statuses,
+        )
+        results.append(f"Run report saved to {json_path.as_posix()} and {prometheus_path.as_posix()}")
+    except OSError as e:
+        results.append(f"Warning: Could not save the run report: {e}")
+    return results
+
+# Returns {"statuses": {stage: status}, "errors": {stage: error}, "log": text,
+# "metrics": RunMetrics}. A status is "up to date", "ran", "partial" (some
+# periods produced no output; the rest carried on), "failed", "blocked" (no
+# upstream output to work from), "would run" (dry run) or "not selected".
+def run_pipeline(company_folder_name, periods_to_process, config=None, stages=None, force_stages=(), dry_run=False):
+    config = {**PIPELINE_DEFAULTS, **(config or {})}
+    if config["metrics"] is None:
+        config["metrics"] = RunMetrics()
+    periods_to_process = [str(period) for period in periods_to_process]
+    selected_stages, forced_stages = validate_stage_names(stages, force_stages)
+    stages_state = load_pipeline_state(company_folder_name)
+
+    results = []
+    results.append(f"--- Starting pipeline for {company_folder_name} ({', '.join(periods_to_process)}) ---")
+    statuses = {}
+    errors = {}
+    periods_by_stage = {}
+    for stage in PIPELINE_STAGES:
+        if stage.name not in selected_stages:
+            statuses[stage.name] = "not selected"
+            continue
+        stage_periods = upstream_periods(stage, periods_to_process, periods_by_stage)
+        if not stage_periods:
+            failed_upstream = [name for name in stage.depends_on if statuses.get(name) in ("failed", "blocked")] or list(stage.depends_on)
+            statuses[stage.name] = "blocked"
+            periods_by_stage[stage.name] = []
+            results.append(f"\n[{stage.name}] Skipped because {', '.join(failed_upstream)} did not complete.")
+            continue
+        if len(stage_periods) < len(periods_to_process):
+            skipped_periods = [period for period in periods_to_process if period not in stage_periods]
+            results.append(f"\n[{stage.name}] Leaving out {', '.join(skipped_periods)}: an earlier stage produced no output for them.")
+        statuses[stage.name], stage_results, error, periods_by_stage[stage.name] = run_pipeline_stage(
+            stage, company_folder_name, stage_periods, config, stages_state,
+            forced=stage.name in forced_stages, dry_run=dry_run,
+        )
+        if error:
+            errors[stage.name] = error
+        results.extend(stage_results)
+
+    results.append("\n--- Pipeline Summary ---")
+    results.extend(f"{name}: {status}" for name, status in statuses.items())
+    if not dry_run:
+        results.extend(save_run_report(company_folder_name, periods_to_process, config["metrics"], statuses))
+    return {"statuses": statuses, "errors": errors, "log": "\n".join(results), "metrics": config["metrics"]}
+
+# --- Command line ---
+def parse_page_range(text):
+    start_str, end_str = text.split("-")
+    start_page, end_page = int(start_str), int(end_str)
+    if start_page > end_page:
+        raise ValueError(f"Start page is greater than end page in '{text}'.")
+    return start_page, end_page
+
+def parse_periods(text):
+    return [period.strip() for period in text.split(",") if period.strip()]
+
+def add_pipeline_arguments(parser):
+    # Options shared with the batch runner (batch.py)
+    parser.add_argument("--method", default=PIPELINE_DEFAULTS["extraction_method"], choices=["ocr", "direct", "hybrid"])
+    parser.add_argument("--pages", help="Page range for every period, e.g. 50-90")
+    parser.add_argument("--period-pages", action="append", default=[], metavar="PERIOD=START-END",
+                        help="Page range for one period, overriding --pages; may be repeated")
+    parser.add_argument("--auto-locate", action="store_true", help="Locate the statement pages automatically")
+    parser.add_argument("--workers", type=int, default=PIPELINE_DEFAULTS["num_workers"], help="Text extraction worker processes")
+    parser.add_argument("--ocr-memory-mb", type=float, default=None,
+                        help="Memory budget for the pages rendered and OCRed at once by the workers")
+    parser.add_argument("--preprocess", metavar="STEPS",
+                        help="Comma-separated image preprocessing before OCR: binarize, crop, deskew, remove_non_text")
+    parser.add_argument("--ocr-engine", default=PIPELINE_DEFAULTS["ocr_engine"], choices=["auto", "tesserocr", "pytesseract"],
+                        help="auto uses tesserocr when installed, else pytesseract")
+    parser.add_argument("--layout-tables", action="store_true",
+                        help="Rebuild table columns from word positions and send those tables to Gemini")
+    parser.add_argument("--no-ocr-cache", action="store_true")
+    parser.add_argument("--llm-concurrency", type=int, default=PIPELINE_DEFAULTS["max_concurrency"])
+    parser.add_argument("--requests-per-second", type=float, default=None)
+    parser.add_argument("--no-llm-cache", action="store_true")
+    parser.add_argument("--chunk-token-budget", type=int, default=None, help="Most estimated tokens per Gemini request, instructions included")
+    parser.add_argument("--compact-prompt", action="store_true",
+                        help="Drop prose pages, boilerplate and repeated headers from the text sent to Gemini")
+    parser.add_argument("--rule-parser", action="store_true", help="Parse coded VAS statement pages without Gemini")
+    parser.add_argument("--export-xlsx", action="store_true", help="Also export intermediate Excel files")
+    parser.add_argument("--no-dictionary", action="store_true", help="Send every item to Gemini during standardization")
+    parser.add_argument("--stages", help=f"Comma-separated subset of stages to consider ({', '.join(STAGE_NAMES)})")
+    parser.add_argument("--force", action="append", default=[], metavar="STAGE",
+                        help="Rerun this stage and everything downstream even if up to date; may be repeated")
+    parser.add_argument("--dry-run", action="store_true", help="Only report which stages would run")
+    return parser
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Run the financial statement pipeline without Streamlit.")
+    parser.add_argument("company_folder_name", help="Company folder, e.g. PVIAM")
+    parser.add_argument("--periods", required=True, help="Comma-separated periods, e.g. 2021,2022,2023")
+    return add_pipeline_arguments(parser)
+
+def config_from_args(args, periods):
+    page_ranges = {}
+    if args.pages:
+        page_ranges = {period: parse_page_range(args.pages) for period in periods}
+    for entry in args.period_pages:
+        period, range_text = entry.split("=", 1)
+        page_ranges[period.strip()] = parse_page_range(range_text)
+    config = {
+        "extraction_method": args.method,
+        "page_ranges": page_ranges or None,
+        "auto_locate": args.auto_locate,
+        "num_workers": args.workers,
+        "ocr_memory_mb": args.ocr_memory_mb,
+        "ocr_engine": args.ocr_engine,
+        "layout_tables": args.layout_tables,
+        "ocr_preprocess": [step.strip() for step in args.preprocess.split(",") if step.strip()] if args.preprocess else None,
+        "use_ocr_cache": not args.no_ocr_cache,
+        "max_concurrency": args.llm_concurrency,
+        "requests_per_second": args.requests_per_second,
+        "use_llm_cache": not args.no_llm_cache,
+        "chunk_token_budget": args.chunk_token_budget,
+        "compact_prompt": args.compact_prompt,
+        "use_rule_parser": args.rule_parser,
+        "export_xlsx": args.export_xlsx,
+        "use_dictionary": not args.no_dictionary,
+    }
+    return config
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    periods = parse_periods(args.periods)
+    config = config_from_args(args, periods)
+    stages = [name.strip() for name in args.stages.split(",")] if args.stages else None
+    outcome = run_pipeline(args.company_folder_name, periods, config, stages=stages, force_stages=args.force, dry_run=args.dry_run)
+    print(outcome["log"])
+    return 1 if any(status in ("failed", "blocked") for status in outcome["statuses"].values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import json
+import re
+import threading
+import unicodedata
+import numpy as np
+from pathlib import Path
+from disk_cache import atomic_write_text
+
+# Persistent dictionary of standardized line items, shared by every company.
+# Per statement it maps original item names to their standardized name and
+# keeps the standardized names in statement order. Items are resolved locally
+# first, by exact name, by normalized name and by character n-gram similarity;
+# only the rest go to the LLM, whose answers are written back.
+
+# Next to the scripts rather than in the working directory, so every run (app,
+# pipeline or batch) shares one dictionary
+STANDARDIZATION_DICTIONARY_PATH = Path(__file__).resolve().parent / "standardization_dictionary.json"
+DICTIONARY_VERSION = 1
+
+NGRAM_SIZE = 3
+FUZZY_MATCH_THRESHOLD = 0.85 # Cosine similarity of character trigram counts
+# Normalized terms that tell otherwise similar items apart. A fuzzy match needs
+# both names to contain the same ones, so "phai thu ngan han khac" never
+# resolves to "phai thu dai han khac" however close their trigrams are.
+DISCRIMINATING_TERMS = ("ngan han", "dai han", "truoc thue", "sau thue", "hien hanh", "hoan lai", "tong cong")
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+_DIGITS = re.compile(r'\d+')
+
+def normalize_item(item):
+    # Lower case without diacritics, punctuation or repeated spaces, so OCR
+    # variants such as "Tiền và các khoản tương đương tiền." and
+    # "TIEN VA CAC KHOAN TUONG DUONG TIEN" share one key
+    text = unicodedata.normalize("NFD", str(item).lower().replace("đ", "d"))
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return _NON_ALNUM.sub(" ", text).strip()
+
+def _fuzzy_signature(key):
+    # What two normalized names must share to be fuzzy matched: their line
+    # numbers (so "221 nguyen gia" stays apart from "227 nguyen gia") and
+    # their discriminating terms
+    padded = f" {key} "
+    return tuple(_DIGITS.findall(key)), tuple(term for term in DISCRIMINATING_TERMS if f" {term} " in padded)
+
+def _ngram_matrix(texts, vocabulary):
+    # Rows of L2-normalized character n-gram counts over `vocabulary`
+    matrix = np.zeros((len(texts), len(vocabulary)), dtype=np.float32)
+    for row, text in enumerate(texts):
+        padded = f" {text} "
+        columns = [vocabulary[padded[i:i + NGRAM_SIZE]] for i in range(len(padded) - NGRAM_SIZE + 1) if padded[i:i + NGRAM_SIZE] in vocabulary]
+        np.add.at(matrix[row], columns, 1.0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+def _ngram_vocabulary(texts):
+    vocabulary = {}
+    for text in texts:
+        padded = f" {text} "
+        for i in range(len(padded) - NGRAM_SIZE + 1):
+            vocabulary.setdefault(padded[i:i + NGRAM_SIZE], len(vocabulary))
+    return vocabulary
+
+def merge_item_order(existing_order, new_order):
+    # Inserts names from `new_order` that are not yet known right after their
+    # predecessor in `new_order`, so the stored statement order is preserved.
+    # Names before the first known one go just ahead of it; with no known name
+    # at all they are appended.
+    merged = list(existing_order)
+    known = set(merged)
+    first_known = next((name for name in new_order if name in known), None)
+    insert_at = merged.index(first_known) if first_known is not None else len(merged)
+    for name in new_order:
+        if name in known:
+            insert_at = merged.index(name) + 1
+            continue
+        merged.insert(insert_at, name)
+        known.add(name)
+        insert_at += 1
+    return merged
+
+class StandardizationDictionary:
+    # Loaded once per run; `save` writes it back atomically. Lookups and
+    # updates are guarded by a lock so several statements can be
+    # standardized at once.
+    def __init__(self, path=STANDARDIZATION_DICTIONARY_PATH, fuzzy_threshold=FUZZY_MATCH_THRESHOLD):
+        self.path = Path(path)
+        self.fuzzy_threshold = fuzzy_threshold
+        self.statements = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                data = {}
+            if data.get("version") == DICTIONARY_VERSION:
+                self.statements = data.get("statements", {})
+
+    def _statement(self, statement_name):
+        return self.statements.setdefault(statement_name, {"items": {}, "order": []})
+
+    def resolve(self, statement_name, items):
+        # Returns ({item: standardized_name}, {item: how it was matched}, unresolved items)
+        with self._lock:
+            statement = self.statements.get(statement_name, {"items": {}, "order": []})
+            known_items = statement["items"]
+            mapping, match_kinds, unresolved = {}, {}, []
+
+            by_normalized = {}
+            for original_item, standardized_name in known_items.items():
+                by_normalized.setdefault(normalize_item(original_item), standardized_name)
+
+            for item in items:
+                if item in known_items:
+                    mapping[item] = known_items[item]
+                    match_kinds[item] = "exact"
+                elif normalize_item(item) in by_normalized:
+                    mapping[item] = by_normalized[normalize_item(item)]
+                    match_kinds[item] = "normalized"
+                else:
+                    unresolved.append(item)
+
+            if unresolved and by_normalized:
+                known_keys = list(by_normalized)
+                query_keys = [normalize_item(item) for item in unresolved]
+                # Both sides' n-grams, so n-grams only the query has lower its score
+                vocabulary = _ngram_vocabulary(known_keys + query_keys)
+                similarity = _ngram_matrix(query_keys, vocabulary) @ _ngram_matrix(known_keys, vocabulary).T
+                known_signatures = [_fuzzy_signature(key) for key in known_keys]
+                for row, query_key in enumerate(query_keys):
+                    query_signature = _fuzzy_signature(query_key)
+                    similarity[row, [signature != query_signature for signature in known_signatures]] = -1.0
+                best = similarity.argmax(axis=1)
+                still_unresolved = []
+                for row, item in enumerate(unresolved):
+                    candidate = known_keys[best[row]]
+                    if similarity[row, best[row]] >= self.fuzzy_threshold:
+                        mapping[item] = by_normalized[candidate]
+                        match_kinds[item] = "fuzzy"
+                    else:
+                        still_unresolved.append(item)
+                unresolved = still_unresolved
+            return mapping, match_kinds, unresolved
+
+    def known_names(self, statement_name):
+        with self._lock:
+            return list(self.statements.get(statement_name, {}).get("order", []))
+
+    def ordered_names(self, statement_name, names):
+        # `names` in stored statement order; names the store does not know keep their order at the end
+        names = list(dict.fromkeys(names))
+        order = self.known_names(statement_name)
+        position = {name: index for index, name in enumerate(order)}
+        known = sorted((name for name in names if name in position), key=position.get)
+        return known + [name for name in names if name not in position]
+
+    def update(self, statement_name, standardization_groups):
+        # Records an LLM answer: [{"standardized_item": ..., "original_items": [...]}, ...]
+        with self._lock:
+            statement = self._statement(statement_name)
+            new_order = []
+            for group in standardization_groups:
+                standardized_name = group["standardized_item"]
+                new_order.append(standardized_name)
+                for original_item in group["original_items"]:
+                    statement["items"][original_item] = standardized_name
+            statement["order"] = merge_item_order(statement["order"], new_order)
+
+    def save(self):
+        with self._lock:
+            text = json.dumps({"version": DICTIONARY_VERSION, "statements": self.statements}, ensure_ascii=False, indent=2, sort_keys=True)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(self.path, text)
+
+    def item_count(self):
+        with self._lock:
+            return sum(len(statement["items"]) for statement in self.statements.values())
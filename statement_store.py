@@ -0,0 +1,105 @@
+import pandas as pd
+from pathlib import Path
+from metrics import timed
+from value_parser import parse_financial_values
+
+# Columnar (Parquet) store for the data handed from one pipeline stage to the
+# next. Every stage writes <dir>/<stem>.parquet; Excel files are only written
+# as an export. Readers fall back to <dir>/<stem>.xlsx so company folders
+# produced before the Parquet store still work. Pass `metrics` (a stage view
+# of metrics.RunMetrics) to time each read and write.
+
+STORE_SUFFIX = ".parquet"
+EXCEL_SUFFIX = ".xlsx"
+
+# Explicit dtypes for the long (one row per line item) statement frames
+LONG_FRAME_DTYPES = {
+    "item_number": "string",
+    "statement_type": "string",
+    "item": "string",
+    "year": "string",
+    "value": "float64",
+}
+
+def store_path(directory, stem):
+    return Path(directory) / f"{stem}{STORE_SUFFIX}"
+
+def find_stage_file(directory, stem):
+    # Returns the Parquet file for `stem`, else a legacy Excel file, else None
+    for suffix in (STORE_SUFFIX, EXCEL_SUFFIX):
+        path = Path(directory) / f"{stem}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+def list_stage_stems(directory):
+    # Stems of every stage file in `directory`, Parquet and legacy Excel alike
+    directory = Path(directory)
+    stems = {path.stem for path in directory.glob(f"*{STORE_SUFFIX}")}
+    stems.update(path.stem for path in directory.glob(f"*{EXCEL_SUFFIX}") if not path.name.startswith("~$"))
+    return sorted(stems)
+
+def coerce_long_frame(df):
+    df = df.copy()
+    for column, dtype in LONG_FRAME_DTYPES.items():
+        if column not in df.columns:
+            continue
+        if dtype == "float64":
+            df[column] = parse_financial_values(df[column])
+        else:
+            # Integral floats read back from Excel (2021.0) should stay "2021"
+            df[column] = df[column].map(lambda v: str(int(v)) if isinstance(v, float) and v.is_integer() else v).astype(dtype)
+    for column in df.columns:
+        # Columns the LLM added on its own get a uniform string type, which
+        # Parquet needs for mixed object columns
+        if column not in LONG_FRAME_DTYPES and df[column].dtype == object:
+            df[column] = df[column].astype("string")
+    return df
+
+def coerce_wide_frame(df):
+    # Wide statements: item index, one float column per period
+    df = df.copy()
+    df.index = df.index.astype("string")
+    df.columns = [str(column) for column in df.columns]
+    return df.apply(pd.to_numeric, errors="coerce").astype("float64")
+
+def write_long_frame(df, directory, stem, export_xlsx=False, metrics=None):
+    # Returns the list of files written
+    path = store_path(directory, stem)
+    with timed(metrics, "parquet_write", file=path.name, rows=len(df)):
+        coerce_long_frame(df).to_parquet(path, index=False)
+    written = [path]
+    if export_xlsx:
+        excel_path = Path(directory) / f"{stem}{EXCEL_SUFFIX}"
+        with timed(metrics, "excel_write", file=excel_path.name, rows=len(df)):
+            df.to_excel(excel_path, index=False)
+        written.append(excel_path)
+    return written
+
+def write_wide_frame(df, directory, stem, export_xlsx=False, metrics=None):
+    path = store_path(directory, stem)
+    with timed(metrics, "parquet_write", file=path.name, rows=len(df)):
+        coerce_wide_frame(df).to_parquet(path)
+    written = [path]
+    if export_xlsx:
+        excel_path = Path(directory) / f"{stem}{EXCEL_SUFFIX}"
+        with timed(metrics, "excel_write", file=excel_path.name, rows=len(df)):
+            df.to_excel(excel_path)
+        written.append(excel_path)
+    return written
+
+def read_long_frame(path, metrics=None):
+    path = Path(path)
+    if path.suffix == STORE_SUFFIX:
+        with timed(metrics, "parquet_read", file=path.name):
+            return pd.read_parquet(path)
+    with timed(metrics, "excel_read", file=path.name):
+        return coerce_long_frame(pd.read_excel(path))
+
+def read_wide_frame(path, metrics=None):
+    path = Path(path)
+    if path.suffix == STORE_SUFFIX:
+        with timed(metrics, "parquet_read", file=path.name):
+            return pd.read_parquet(path)
+    with timed(metrics, "excel_read", file=path.name):
+        return coerce_wide_frame(pd.read_excel(path, index_col=0))
@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The stage scripts and shared modules live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pipeline import load_stage_module
+
+@pytest.fixture(scope="session")
+def converter():
+    return load_stage_module("2. converter_script.py")
+
+@pytest.fixture(scope="session")
+def pdf_to_text():
+    return load_stage_module("1. pdf_to_text_script.py")
+
+@pytest.fixture(scope="session")
+def merger():
+    return load_stage_module("3. merger_script.py")
@@ -0,0 +1,17 @@
+def test_merge_keeps_rows_with_the_same_name_under_different_codes(converter):
+    rows = [
+        {"item_number": "222", "statement_type": "Bảng Cân Đối Kế Toán", "item": "Nguyên giá", "year": "2023", "value": 100},
+        {"item_number": "225", "statement_type": "Bảng Cân Đối Kế Toán", "item": "Nguyên giá", "year": "2023", "value": 200},
+        {"item_number": "228", "statement_type": "Bảng Cân Đối Kế Toán", "item": "Nguyên giá", "year": "2023", "value": 300},
+    ]
+    assert [row["value"] for row in converter.merge_extracted_rows(rows)] == [100, 200, 300]
+
+def test_merge_drops_chunk_overlap_and_fills_empty_values(converter):
+    rows = [
+        {"item_number": "110", "statement_type": "BS", "item": "Tiền", "year": "2023", "value": None},
+        {"item_number": "110", "statement_type": "bs", "item": " tiền ", "year": 2023, "value": 5},
+        {"item_number": "", "statement_type": "BS", "item": "Tổng", "year": "2023", "value": 7},
+        {"statement_type": "BS", "item": "Tổng", "year": "2023", "value": 8},
+    ]
+    merged = converter.merge_extracted_rows(rows)
+    assert [(row["item"], row["value"]) for row in merged] == [("Tiền", 5), ("Tổng", 7)]
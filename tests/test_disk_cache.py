@@ -0,0 +1,71 @@
+import os
+import time
+
+import pytest
+
+import disk_cache
+from disk_cache import _entry_path, cache_get, cache_put, evict_cache
+
+class FakeClock:
+    # Stands in for the time module inside disk_cache; starts at the real time
+    # so the mtimes of freshly written entries line up with it
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def time_ns(self):
+        return int(self.now * 1e9)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(disk_cache, "time", fake_clock)
+    return fake_clock
+
+def set_write_time(cache_dir, key, timestamp):
+    entry_path = _entry_path(cache_dir, key)
+    os.utime(entry_path, (timestamp, timestamp))
+
+def test_round_trip(tmp_path):
+    cache_put(tmp_path, "a" * 64, "value")
+    assert cache_get(tmp_path, "a" * 64) == "value"
+    assert cache_get(tmp_path, "b" * 64) is None
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache_put(tmp_path, "a" * 64, "value")
+    clock.advance(50)
+    assert cache_get(tmp_path, "a" * 64, ttl_seconds=100) == "value"
+    clock.advance(51)
+    assert cache_get(tmp_path, "a" * 64, ttl_seconds=100) is None
+
+def test_hits_do_not_extend_the_ttl(tmp_path, clock):
+    cache_put(tmp_path, "a" * 64, "value")
+    for _ in range(5):
+        clock.advance(30)
+        cache_get(tmp_path, "a" * 64, ttl_seconds=100)
+    assert cache_get(tmp_path, "a" * 64, ttl_seconds=100) is None
+    assert evict_cache(tmp_path, ttl_seconds=100) == 1
+    assert not list(tmp_path.glob("*/*.cache"))
+
+def test_eviction_drops_least_recently_used_first(tmp_path, clock):
+    keys = [letter * 64 for letter in "abc"]
+    for offset, key in enumerate(keys):
+        cache_put(tmp_path, key, "x" * 100)
+        set_write_time(tmp_path, key, clock.now - 30 + offset) # a oldest, c newest
+    clock.advance(10)
+    assert cache_get(tmp_path, keys[0]) is not None # a is now the most recently used
+
+    assert evict_cache(tmp_path, max_bytes=200) == 1
+    assert cache_get(tmp_path, keys[0]) is not None
+    assert cache_get(tmp_path, keys[1]) is None
+    assert cache_get(tmp_path, keys[2]) is not None
+
+def test_eviction_within_budget_removes_nothing(tmp_path):
+    cache_put(tmp_path, "a" * 64, "x" * 100)
+    assert evict_cache(tmp_path, max_bytes=1000, ttl_seconds=3600) == 0
+    assert evict_cache(tmp_path / "missing", max_bytes=0) == 0
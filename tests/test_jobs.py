@@ -0,0 +1,42 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+from jobs import PipelineJob
+from standardization_store import StandardizationDictionary
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+from synthetic_statements import FakeStatementLLM, write_statement_pdf
+
+@pytest.fixture
+def job_config(tmp_path, monkeypatch, converter):
+    monkeypatch.chdir(tmp_path)
+    return {
+        "extraction_method": "direct",
+        "use_ocr_cache": False,
+        "use_llm_cache": False,
+        "llm": FakeStatementLLM(parse_page=converter.parse_vas_page),
+        "dictionary": StandardizationDictionary(tmp_path / "standardization_dictionary.json"),
+    }
+
+def test_job_with_one_period_not_uploaded_returns_the_others(tmp_path, job_config):
+    write_statement_pdf(tmp_path / "ACME" / "financial_statements" / "2022.pdf", "2022", 3)
+    job = PipelineJob(1, "ACME", ["2022", "2023"], job_config)
+    job.run()
+
+    snapshot = job.snapshot()
+    assert snapshot["status"] == "succeeded"
+    assert snapshot["stage_statuses"]["standardizer"] == "ran"
+    assert len(snapshot["warnings"]) == 1
+    assert snapshot["warnings"][0].startswith("pdf_to_text:") and "2023" in snapshot["warnings"][0]
+    assert list((tmp_path / "ACME" / "final_statements_standardized").glob("*.xlsx"))
+
+def test_job_with_no_period_uploaded_fails(tmp_path, job_config):
+    (tmp_path / "ACME" / "financial_statements").mkdir(parents=True)
+    job = PipelineJob(1, "ACME", ["2022"], job_config)
+    job.run()
+
+    snapshot = job.snapshot()
+    assert snapshot["status"] == "failed"
+    assert "pdf_to_text" in snapshot["error"]
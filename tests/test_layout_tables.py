@@ -0,0 +1,56 @@
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+# Word boxes (left, top, right, bottom, word) that PyMuPDF's page.get_text("words")
+# returned for VAS balance sheet pages with right-aligned amount columns
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+BODY_ROWS = [
+    "A. TÀI SẢN NGẮN HẠN|100||125.300.000.000|110.200.000.000",
+    "I. Tiền và các khoản tương đương tiền|110|5|12.000.000.000|3.400.000.000",
+    "1. Tiền|111||2.000.000.000|-",
+    "2. Các khoản tương đương tiền|112||10.000.000.000|3.400.000.000",
+    "II. Đầu tư tài chính ngắn hạn|120|6||(1.250.000.000)",
+    "1. Chứng khoán kinh doanh|121||45.000.000|1.000.000",
+]
+
+def load_words(name):
+    return [tuple(word) for word in json.loads((FIXTURES_DIR / name).read_text(encoding="utf-8"))]
+
+def test_year_header_under_its_label_goes_to_the_amount_column(pdf_to_text):
+    lines = pdf_to_text.words_to_table(load_words("balance_sheet_two_line_header_words.json")).split("\n")
+    assert lines[:4] == [
+        "BẢNG CÂN ĐỐI KẾ TOÁN",
+        "Tại ngày 31 tháng 12 năm 2023",
+        "Chỉ tiêu|Mã số|Thuyết minh|Năm|Năm",
+        "|||2023|2022",
+    ]
+    assert lines[4:] == BODY_ROWS
+
+def test_one_line_header_labels_sit_over_their_columns(pdf_to_text):
+    lines = pdf_to_text.words_to_table(load_words("balance_sheet_one_line_header_words.json")).split("\n")
+    assert lines[2] == "TÀI SẢN|Mã số|Thuyết minh|Số cuối năm|Số đầu năm"
+    assert lines[3:] == BODY_ROWS
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_ocr_pixel_boxes_with_jitter_give_the_same_table(pdf_to_text, seed):
+    # The same page as tesseract would see it at 300 DPI, each edge off by up to 2 pixels
+    rng = random.Random(seed)
+    scale = 300 / 72
+    words = [
+        tuple(round(value * scale + rng.uniform(-2, 2)) for value in box[:4]) + (box[4],)
+        for box in load_words("balance_sheet_two_line_header_words.json")
+    ]
+    expected = pdf_to_text.words_to_table(load_words("balance_sheet_two_line_header_words.json"))
+    assert pdf_to_text.words_to_table(words) == expected
+
+def test_prose_without_columns_keeps_its_lines(pdf_to_text):
+    words = [(40, 100, 80, 110, "Kính"), (84, 100, 110, 110, "gửi:"), (40, 120, 90, 130, "Quý"), (94, 120, 140, 130, "cổ"), (144, 120, 180, 130, "đông")]
+    assert pdf_to_text.words_to_table(words) == "Kính gửi:\nQuý cổ đông"
+
+def test_no_words_gives_an_empty_table(pdf_to_text):
+    assert pdf_to_text.words_to_table([]) == ""
+    assert pdf_to_text.words_to_table([(0, 10, 5, 10, "x"), (0, 0, 5, 8, " ")]) == ""
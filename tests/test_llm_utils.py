@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+import llm_utils
+from jobs import JobCancelled
+from llm_utils import TokenBucketRateLimiter, backoff_delay, is_transient_error, run_chain_batch
+
+class FakeChain:
+    # Stands in for a LangChain runnable: echoes the input text after a short await
+    def __init__(self):
+        self.calls = []
+
+    async def ainvoke(self, inputs):
+        self.calls.append(inputs["text"])
+        await asyncio.sleep(0.01)
+        return f'{{"text": "{inputs["text"]}"}}'
+
+class FlakyChain:
+    # Fails with `error` on the first `failures` calls, then answers
+    def __init__(self, failures, error):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    async def ainvoke(self, inputs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "{}"
+
+class FakeClock:
+    # Replaces time.monotonic in llm_utils and asyncio.sleep, so waiting for
+    # the rate limiter advances the clock instead of sleeping
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(llm_utils, "time", fake_clock)
+    monkeypatch.setattr(llm_utils.asyncio, "sleep", fake_clock.sleep)
+    return fake_clock
+
+def test_token_bucket_allows_a_burst_then_the_rate(clock):
+    limiter = TokenBucketRateLimiter(2, capacity=2)
+    assert limiter._try_take() == 0
+    assert limiter._try_take() == 0
+    assert limiter._try_take() == pytest.approx(0.5)
+    clock.now += 0.25
+    assert limiter._try_take() == pytest.approx(0.25)
+    clock.now += 0.25
+    assert limiter._try_take() == 0
+
+def test_token_bucket_rejects_a_non_positive_rate():
+    with pytest.raises(ValueError):
+        TokenBucketRateLimiter(0)
+
+def test_rate_limiter_spaces_out_batch_requests(clock):
+    chain = FlakyChain(0, None)
+    call_times = []
+    original_ainvoke = chain.ainvoke
+    async def timed_ainvoke(inputs):
+        call_times.append(clock.now)
+        return await original_ainvoke(inputs)
+    chain.ainvoke = timed_ainvoke
+
+    limiter = TokenBucketRateLimiter(2, capacity=1)
+    responses = run_chain_batch(chain, [{"text": str(i)} for i in range(4)], max_concurrency=4, rate_limiter=limiter)
+    assert responses == ["{}"] * 4
+    assert call_times == pytest.approx([0.0, 0.5, 1.0, 1.5])
+
+def test_transient_errors_are_retried(clock):
+    chain = FlakyChain(2, RuntimeError("503 Service Unavailable"))
+    retries = []
+    responses = run_chain_batch(chain, [{"text": "a"}], max_retries=3, base_delay=1.0,
+                                on_retry=lambda index, attempt, delay, error: retries.append((index, attempt)))
+    assert responses == ["{}"]
+    assert chain.calls == 3
+    assert retries == [(0, 1), (0, 2)]
+    # Full jitter: each wait is at most base_delay * 2**attempt
+    assert len(clock.sleeps) == 2 and clock.sleeps[0] <= 1.0 and clock.sleeps[1] <= 2.0
+
+def test_retries_give_up_after_max_retries(clock):
+    chain = FlakyChain(10, RuntimeError("429 Resource exhausted"))
+    responses = run_chain_batch(chain, [{"text": "a"}], max_retries=2)
+    assert isinstance(responses[0], RuntimeError)
+    assert chain.calls == 3
+
+def test_permanent_errors_are_not_retried(clock):
+    chain = FlakyChain(1, ValueError("API key not valid"))
+    responses = run_chain_batch(chain, [{"text": "a"}], max_retries=3)
+    assert isinstance(responses[0], ValueError)
+    assert chain.calls == 1
+    assert clock.sleeps == []
+
+@pytest.mark.parametrize("error, transient", [
+    (RuntimeError("503 Service Unavailable"), True),
+    (RuntimeError("Quota exceeded for requests per minute"), True),
+    (TimeoutError(), True),
+    (ConnectionError("reset by peer"), True),
+    (ValueError("API key not valid"), False),
+    (KeyError("text"), False),
+])
+def test_is_transient_error(error, transient):
+    assert is_transient_error(error) is transient
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, base_delay=1.0, max_delay=30.0) <= min(30.0, 2 ** attempt)
+
+def test_cancel_from_on_done_stops_queued_requests():
+    chain = FakeChain()
+    def on_done(index, response):
+        raise JobCancelled("Cancelled during converter")
+
+    with pytest.raises(JobCancelled):
+        run_chain_batch(chain, [{"text": str(i)} for i in range(10)], max_concurrency=1, on_done=on_done)
+    assert chain.calls == ["0"]
+
+def test_cancel_cancels_requests_in_flight():
+    chain = FakeChain()
+    done = []
+    def on_done(index, response):
+        done.append(index)
+        raise JobCancelled("Cancelled during converter")
+
+    with pytest.raises(JobCancelled):
+        run_chain_batch(chain, [{"text": str(i)} for i in range(10)], max_concurrency=3, on_done=on_done)
+    # The first three were sent together; only the first one got to report
+    assert len(chain.calls) == 3
+    assert len(done) == 1
+
+def test_on_done_exception_does_not_stop_the_batch():
+    chain = FakeChain()
+    def on_done(index, response):
+        raise ValueError("logging failed")
+
+    responses = run_chain_batch(chain, [{"text": str(i)} for i in range(4)], max_concurrency=2, on_done=on_done)
+    assert len(chain.calls) == 4
+    assert all(isinstance(response, ValueError) for response in responses)
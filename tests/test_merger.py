@@ -0,0 +1,54 @@
+import json
+
+import pandas as pd
+import pytest
+
+from statement_store import read_long_frame, write_long_frame
+
+PERIODS = ["2021", "2022", "2023"]
+
+def write_period(company_dir, period, cash):
+    rows = [
+        {"item_number": "110", "statement_type": "balance sheet", "item": "Tiền", "year": period, "value": cash},
+        {"item_number": "01", "statement_type": "income statement", "item": "Doanh thu", "year": period, "value": 1000.0},
+    ]
+    write_long_frame(pd.DataFrame(rows), company_dir / "excel_statements", f"{period}_financial_statements")
+
+@pytest.fixture
+def company_dir(tmp_path):
+    (tmp_path / "excel_statements").mkdir()
+    for period in PERIODS:
+        write_period(tmp_path, period, 100.0)
+    return tmp_path
+
+def test_rerun_reloads_only_the_changed_period(merger, company_dir):
+    merger.run_merger_process(str(company_dir), PERIODS)
+    write_period(company_dir, "2022", 250.0)
+
+    log = merger.run_merger_process(str(company_dir), PERIODS)
+    assert "1 new or changed periods loaded (2022), 2 unchanged periods reused (2021, 2023)" in log
+
+    combined = read_long_frame(company_dir / "period_statements" / "all_periods_concatenated.parquet")
+    cash = combined[combined["item"] == "Tiền"].set_index("source_period")["value"]
+    assert cash.to_dict() == {"2021": 100.0, "2022": 250.0, "2023": 100.0}
+
+def test_unchanged_rerun_keeps_every_file(merger, company_dir):
+    merger.run_merger_process(str(company_dir), PERIODS)
+    log = merger.run_merger_process(str(company_dir), PERIODS)
+    assert "0 new or changed periods loaded (none), 3 unchanged periods reused" in log
+    assert "Keeping the existing combined store" in log
+
+def test_manifest_records_every_period(merger, company_dir):
+    merger.run_merger_process(str(company_dir), PERIODS)
+    manifest = json.loads((company_dir / "period_statements" / merger.MERGE_MANIFEST_NAME).read_text(encoding="utf-8"))
+    assert sorted(manifest["periods"]) == PERIODS
+    assert sorted(manifest["statement_types"]) == ["Balance Sheet", "Income Statement"]
+    assert not list((company_dir / "period_statements").glob("*.tmp"))
+
+def test_truncated_manifest_rebuilds_from_every_period(merger, company_dir):
+    merger.run_merger_process(str(company_dir), PERIODS)
+    manifest_path = company_dir / "period_statements" / merger.MERGE_MANIFEST_NAME
+    manifest_path.write_text(manifest_path.read_text(encoding="utf-8")[:20], encoding="utf-8")
+
+    log = merger.run_merger_process(str(company_dir), PERIODS)
+    assert "3 new or changed periods loaded (2021, 2022, 2023)" in log
@@ -0,0 +1,144 @@
+import json
+import sys
+from pathlib import Path
+
+import fitz  # PyMuPDF
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+from synthetic_statements import write_statement_pdf
+
+class FakeOCREngine:
+    # Stands in for tesseract: numbers the pages it reads, and fails on the
+    # call given by fail_on_call to simulate a crash partway through a PDF
+    name = "pytesseract"
+    persistent = False
+
+    def __init__(self):
+        self.calls = 0
+        self.fail_on_call = None
+
+    def image_to_string(self, img, dpi=None):
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise RuntimeError("tesseract crashed")
+        return f"OCR text {self.calls}"
+
+@pytest.fixture
+def fake_ocr(pdf_to_text, monkeypatch):
+    engine = FakeOCREngine()
+    monkeypatch.setattr(pdf_to_text, "resolve_ocr_engine", lambda name: ("pytesseract", None))
+    monkeypatch.setattr(pdf_to_text, "get_ocr_engine", lambda name, lang, config: engine)
+    return engine
+
+PROSE = "Báo cáo của Ban Tổng Giám đốc về tình hình hoạt động của công ty trong năm. " * 8
+
+def write_prose_pdf(path, page_count=2):
+    doc = fitz.open()
+    for page_number in range(1, page_count + 1):
+        page = doc.new_page(width=595, height=842)
+        page.insert_htmlbox(page.rect + (36, 36, -36, -36), f"<p>{PROSE}</p><p>Trang {page_number}</p>")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    doc.save(str(path))
+    doc.close()
+
+def write_stale_pages_json(company_dir, period):
+    pages_json_path = company_dir / "text_statements" / f"{period}_pages.json"
+    pages_json_path.parent.mkdir(parents=True, exist_ok=True)
+    pages_json_path.write_text(json.dumps({"pages": [7, 8], "sections": {}}), encoding="utf-8")
+    return pages_json_path
+
+@pytest.mark.parametrize("auto_locate", [True, False])
+def test_stale_located_pages_are_removed_when_nothing_is_located(pdf_to_text, tmp_path, auto_locate):
+    write_prose_pdf(tmp_path / "financial_statements" / "2023.pdf")
+    pages_json_path = write_stale_pages_json(tmp_path, "2023")
+
+    log = pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "direct", auto_locate=auto_locate, use_cache=False)
+    assert not pages_json_path.exists()
+    assert (tmp_path / "text_statements" / "2023_ocr.txt").exists()
+    if auto_locate:
+        assert "found no statement pages for 2023" in log
+
+def test_located_pages_are_saved_for_the_converter(pdf_to_text, tmp_path):
+    write_statement_pdf(tmp_path / "financial_statements" / "2023.pdf", "2023", 3)
+    pages_json_path = write_stale_pages_json(tmp_path, "2023")
+
+    pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "direct", auto_locate=True, use_cache=False)
+    assert json.loads(pages_json_path.read_text(encoding="utf-8"))["pages"] == [1, 2, 3]
+
+@pytest.mark.parametrize("extraction_method", ["ocr", "hybrid"])
+def test_ocr_engine_is_part_of_the_page_cache_key(pdf_to_text, extraction_method):
+    keys = {engine: pdf_to_text.page_cache_key("content", extraction_method, ocr_engine=engine) for engine in ("pytesseract", "tesserocr")}
+    assert keys["pytesseract"] != keys["tesserocr"]
+    # Pages OCRed before there was a choice of engine keep their keys
+    assert keys["pytesseract"] == pdf_to_text.page_cache_key("content", extraction_method)
+
+def test_ocr_engine_is_part_of_the_checkpoint_fingerprint(pdf_to_text, tmp_path):
+    pdf_path = tmp_path / "2023.pdf"
+    write_prose_pdf(pdf_path, page_count=1)
+    fingerprints = {engine: pdf_to_text.pdf_fingerprint(pdf_path, "ocr", [0], ocr_engine=engine) for engine in ("pytesseract", "tesserocr")}
+    assert fingerprints["pytesseract"] != fingerprints["tesserocr"]
+    assert pdf_to_text.pdf_fingerprint(pdf_path, "direct", [0], ocr_engine="pytesseract") == pdf_to_text.pdf_fingerprint(pdf_path, "direct", [0], ocr_engine="tesserocr")
+
+def test_cached_pages_skip_ocr(pdf_to_text, fake_ocr, tmp_path):
+    write_prose_pdf(tmp_path / "financial_statements" / "2023.pdf", page_count=3)
+    pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "ocr")
+    assert fake_ocr.calls == 3
+    first_texts = pdf_to_text.read_page_texts(tmp_path / "text_statements" / "2023_ocr.txt")
+
+    log = pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "ocr")
+    assert fake_ocr.calls == 3
+    assert "OCR cache for 2023: 3 hits, 0 misses." in log
+    assert pdf_to_text.read_page_texts(tmp_path / "text_statements" / "2023_ocr.txt") == first_texts
+
+def test_changed_setting_misses_the_page_cache(pdf_to_text, fake_ocr, tmp_path):
+    write_prose_pdf(tmp_path / "financial_statements" / "2023.pdf", page_count=2)
+    pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "ocr")
+    log = pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "ocr", preprocess=["binarize"])
+    assert fake_ocr.calls == 4
+    assert "OCR cache for 2023: 0 hits, 2 misses." in log
+
+def test_cache_off_always_runs_ocr(pdf_to_text, fake_ocr, tmp_path):
+    write_prose_pdf(tmp_path / "financial_statements" / "2023.pdf", page_count=2)
+    pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "ocr", use_cache=False)
+    pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "ocr", use_cache=False)
+    assert fake_ocr.calls == 4
+    assert not (tmp_path / "ocr_cache").exists()
+
+def test_pages_drawn_through_form_xobjects_hash_apart(pdf_to_text, tmp_path):
+    # insert_htmlbox puts the whole page in a form XObject, so every page has
+    # the same content stream
+    pdf_path = tmp_path / "2023.pdf"
+    write_prose_pdf(pdf_path, page_count=2)
+    with fitz.open(pdf_path) as doc:
+        assert len({pdf_to_text.page_content_hash(doc, page) for page in doc}) == 2
+
+def test_interrupted_extraction_resumes_from_the_checkpoint(pdf_to_text, fake_ocr, tmp_path):
+    write_prose_pdf(tmp_path / "financial_statements" / "2023.pdf", page_count=3)
+    ocr_dir = tmp_path / "text_statements"
+    fake_ocr.fail_on_call = 3
+    with pytest.raises(ValueError, match="No PDF files were successfully processed"):
+        pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "ocr", use_cache=False)
+    partial_dir, progress_path = pdf_to_text.checkpoint_paths(ocr_dir, "2023")
+    assert json.loads(progress_path.read_text(encoding="utf-8"))["completed_pages"] == [0, 1]
+    assert not (ocr_dir / "2023_ocr.txt").exists()
+
+    fake_ocr.fail_on_call = None
+    log = pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "ocr", use_cache=False)
+    assert "Resuming 2023 from checkpoint: 2 of 3 pages already extracted." in log
+    assert fake_ocr.calls == 4 # Only the third page was read again
+    assert pdf_to_text.read_page_texts(ocr_dir / "2023_ocr.txt") == {1: "OCR text 1", 2: "OCR text 2", 3: "OCR text 4"}
+    assert not progress_path.exists() and not partial_dir.exists()
+
+def test_checkpoint_of_a_changed_pdf_is_discarded(pdf_to_text, fake_ocr, tmp_path):
+    pdf_path = tmp_path / "financial_statements" / "2023.pdf"
+    write_prose_pdf(pdf_path, page_count=3)
+    fake_ocr.fail_on_call = 3
+    with pytest.raises(ValueError):
+        pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "ocr", use_cache=False)
+
+    write_prose_pdf(pdf_path, page_count=2)
+    log = pdf_to_text.run_pdf_to_text_process(str(tmp_path), ["2023"], "ocr", use_cache=False)
+    assert "Resuming" not in log
+    assert fake_ocr.calls == 5
+    assert pdf_to_text.read_page_texts(tmp_path / "text_statements" / "2023_ocr.txt") == {1: "OCR text 4", 2: "OCR text 5"}
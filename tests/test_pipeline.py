@@ -0,0 +1,139 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+import pipeline
+from pipeline import PIPELINE_DEFAULTS, PIPELINE_STAGES, main, run_pipeline
+from standardization_store import StandardizationDictionary
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+from synthetic_statements import FakeStatementLLM, write_statement_pdf
+
+# Runs the whole pipeline on synthetic text-layer PDFs with the direct method
+# and the benchmarks' fake Gemini, so no OCR or network is needed
+
+PERIODS = ["2022", "2023"]
+PAGE_COUNT = 3
+
+@pytest.fixture
+def company(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for period in PERIODS:
+        write_statement_pdf(tmp_path / "ACME" / "financial_statements" / f"{period}.pdf", period, PAGE_COUNT)
+    return "ACME"
+
+@pytest.fixture
+def config(tmp_path, converter):
+    return {
+        "extraction_method": "direct",
+        "use_ocr_cache": False,
+        "use_llm_cache": False,
+        "llm": FakeStatementLLM(parse_page=converter.parse_vas_page),
+        "dictionary": StandardizationDictionary(tmp_path / "standardization_dictionary.json"),
+    }
+
+def test_first_run_runs_every_stage(company, config):
+    outcome = run_pipeline(company, PERIODS, config)
+    assert set(outcome["statuses"].values()) == {"ran"}
+    assert list(Path(company, "final_statements_standardized").glob("*.xlsx"))
+
+def test_one_missing_pdf_leaves_only_that_period_out(company, config):
+    Path(company, "financial_statements", "2023.pdf").unlink()
+    outcome = run_pipeline(company, PERIODS, config)
+    assert outcome["statuses"] == {
+        "pdf_to_text": "partial", "converter": "ran", "merger": "ran", "formatter": "ran", "standardizer": "ran",
+    }
+    assert "2023" in outcome["errors"]["pdf_to_text"]
+    assert Path(company, "excel_statements", "2022_financial_statements.parquet").exists()
+    assert not Path(company, "excel_statements", "2023_financial_statements.parquet").exists()
+    assert list(Path(company, "final_statements_standardized").glob("*.xlsx"))
+
+    # The missing period is retried on every run; the rest stays up to date
+    outcome = run_pipeline(company, PERIODS, config)
+    assert outcome["statuses"]["pdf_to_text"] == "partial"
+    assert all(outcome["statuses"][name] == "up to date" for name in ("converter", "merger", "formatter", "standardizer"))
+
+def test_no_usable_pdf_fails_and_blocks_later_stages(company, config):
+    for period in PERIODS:
+        Path(company, "financial_statements", f"{period}.pdf").unlink()
+    outcome = run_pipeline(company, PERIODS, config)
+    assert outcome["statuses"] == {
+        "pdf_to_text": "failed", "converter": "blocked", "merger": "blocked", "formatter": "blocked", "standardizer": "blocked",
+    }
+
+def test_second_run_is_up_to_date(company, config):
+    run_pipeline(company, PERIODS, config)
+    outcome = run_pipeline(company, PERIODS, config)
+    assert set(outcome["statuses"].values()) == {"up to date"}
+
+def test_changed_pdf_reruns_only_its_period(company, config):
+    run_pipeline(company, PERIODS, config)
+    write_statement_pdf(Path(company, "financial_statements", "2023.pdf"), "2023", PAGE_COUNT, seed=1)
+    outcome = run_pipeline(company, PERIODS, config)
+    assert outcome["statuses"]["pdf_to_text"] == "ran"
+    assert outcome["statuses"]["converter"] == "ran"
+    assert "[pdf_to_text] Running for 2023 (" in outcome["log"]
+    assert "[converter] Running for 2023 (" in outcome["log"]
+
+def test_changed_period_setting_reruns_only_that_period(company, config):
+    run_pipeline(company, PERIODS, config)
+    outcome = run_pipeline(company, PERIODS, {**config, "page_ranges": {"2022": (1, 2)}})
+    assert "[pdf_to_text] Running for 2022 (" in outcome["log"]
+    assert "[converter] Running for 2022 (" in outcome["log"]
+
+def test_edited_output_forces_a_rerun(company, config):
+    run_pipeline(company, PERIODS, config)
+    text_path = Path(company, "text_statements", "2022_ocr.txt")
+    original_text = text_path.read_text(encoding="utf-8")
+    text_path.write_text("edited by hand", encoding="utf-8")
+    outcome = run_pipeline(company, PERIODS, config)
+    assert "[pdf_to_text] Running for 2022 (" in outcome["log"]
+    assert text_path.read_text(encoding="utf-8") == original_text
+
+def test_deleted_output_forces_a_rerun(company, config):
+    run_pipeline(company, PERIODS, config)
+    for path in Path(company, "final_statements").glob("*.parquet"):
+        path.unlink()
+    outcome = run_pipeline(company, PERIODS, config)
+    assert outcome["statuses"]["pdf_to_text"] == "up to date"
+    assert outcome["statuses"]["merger"] == "up to date"
+    assert outcome["statuses"]["formatter"] == "ran"
+    assert list(Path(company, "final_statements").glob("*.parquet"))
+
+def test_forcing_a_stage_reruns_it_and_everything_after_it(company, config):
+    run_pipeline(company, PERIODS, config)
+    outcome = run_pipeline(company, PERIODS, config, force_stages=["formatter"])
+    assert outcome["statuses"] == {
+        "pdf_to_text": "up to date", "converter": "up to date", "merger": "up to date", "formatter": "ran", "standardizer": "ran",
+    }
+
+def test_dry_run_reports_without_running(company, config):
+    outcome = run_pipeline(company, PERIODS, config, dry_run=True)
+    assert set(outcome["statuses"].values()) == {"would run"}
+    assert not Path(company, "text_statements").exists()
+    assert not Path(company, "pipeline_state.json").exists()
+
+    run_pipeline(company, PERIODS, config)
+    write_statement_pdf(Path(company, "financial_statements", "2022.pdf"), "2022", PAGE_COUNT, seed=1)
+    outcome = run_pipeline(company, PERIODS, config, dry_run=True)
+    assert outcome["statuses"]["pdf_to_text"] == "would run"
+    assert "[pdf_to_text] Would run for 2022 (" in outcome["log"]
+
+def test_command_line_dry_run(company, capsys):
+    assert main([company, "--periods", ",".join(PERIODS), "--method", "direct", "--dry-run"]) == 0
+    assert "[pdf_to_text] Would run for 2022, 2023" in capsys.readouterr().out
+    assert not Path(company, "pipeline_state.json").exists()
+
+def test_unknown_stage_is_rejected(company, config):
+    with pytest.raises(ValueError, match="Unknown pipeline stage"):
+        run_pipeline(company, PERIODS, config, stages=["ocr"])
+
+def test_changing_the_ocr_engine_makes_text_extraction_stale(company, monkeypatch):
+    monkeypatch.setattr(pipeline, "resolve_ocr_engine", lambda name: (name, None)) # As if both engines were installed
+    pdf_to_text_stage = PIPELINE_STAGES[0]
+    def fingerprint(extraction_method, ocr_engine):
+        config = {**PIPELINE_DEFAULTS, "extraction_method": extraction_method, "ocr_engine": ocr_engine}
+        return pdf_to_text_stage.fingerprint(Path(company), "2022", PERIODS, config)
+    assert fingerprint("ocr", "pytesseract") != fingerprint("ocr", "tesserocr")
+    assert fingerprint("direct", "pytesseract") == fingerprint("direct", "tesserocr")
@@ -0,0 +1,93 @@
+import pytest
+
+def page(number, *lines):
+    return "\n".join([f"--- PAGE {number} ---", *lines]) + "\n\n"
+
+def statement_page(number, title, rows):
+    return page(
+        number,
+        "CÔNG TY CỔ PHẦN MẪU",
+        title,
+        "Chỉ tiêu Mã số Thuyết minh Năm nay Năm trước",
+        *rows,
+        "Các thuyết minh kèm theo là bộ phận hợp thành của báo cáo tài chính",
+    )
+
+ROWS = ["Tiền 111 1.234.567 987.654", "Phải thu khách hàng 131 2.000.000 1.500.000", "Hàng tồn kho 141 (3.000) 4.000"]
+
+@pytest.fixture
+def report():
+    return (
+        page(1, "CÔNG TY CỔ PHẦN MẪU", "Kính gửi: Ủy ban Chứng khoán Nhà nước", "Tel: (024) 3256 5555 Fax: (024) 3256 5565",
+             "Chúng tôi xin công bố báo cáo tài chính năm 2023.", "Các thuyết minh kèm theo là bộ phận hợp thành của báo cáo tài chính")
+        + statement_page(2, "BẢNG CÂN ĐỐI KẾ TOÁN", ROWS)
+        + statement_page(3, "BÁO CÁO KẾT QUẢ HOẠT ĐỘNG KINH DOANH", ROWS)
+        + statement_page(4, "BÁO CÁO LƯU CHUYỂN TIỀN TỆ", ROWS)
+    )
+
+def test_drops_pages_without_amounts(converter, report):
+    compacted, _, stats = converter.compact_text(report)
+    assert stats["dropped_pages"] == [1]
+    assert "--- PAGE 1 ---" not in compacted
+    assert [number for number, _ in converter.split_pages(compacted)] == [2, 3, 4]
+
+def test_keeps_every_amount_row_and_statement_title(converter, report):
+    compacted, _, _ = converter.compact_text(report)
+    for row in ROWS:
+        assert compacted.count(row) == 3
+    for title in ("BẢNG CÂN ĐỐI KẾ TOÁN", "BÁO CÁO KẾT QUẢ HOẠT ĐỘNG KINH DOANH", "BÁO CÁO LƯU CHUYỂN TIỀN TỆ"):
+        assert title in compacted
+
+def test_running_headers_are_kept_once_per_request(converter, report):
+    compacted, running_headers, _ = converter.compact_text(report)
+    assert running_headers == {"cong ty co phan mau", "cac thuyet minh kem theo la bo phan hop thanh cua bao cao tai chinh"}
+    deduplicated, dropped = converter.drop_repeated_headers(compacted, running_headers)
+    assert dropped == 4
+    assert deduplicated.count("CÔNG TY CỔ PHẦN MẪU") == 1
+
+def test_column_headers_stay_on_every_page(converter, report):
+    compacted, running_headers, _ = converter.compact_text(report)
+    deduplicated, _ = converter.drop_repeated_headers(compacted, running_headers)
+    assert deduplicated.count("Chỉ tiêu Mã số Thuyết minh Năm nay Năm trước") == 3
+
+@pytest.mark.parametrize("header", ["Số cuối năm Số đầu năm", "Chỉ tiêu|Mã số|Thuyết minh|Năm|Năm", "|||2023|2022"])
+def test_other_column_header_forms_are_not_running_headers(converter, header):
+    text = "".join(page(number, header, *ROWS) for number in range(1, 5))
+    compacted, running_headers, _ = converter.compact_text(text)
+    assert running_headers == set()
+    assert converter.drop_repeated_headers(compacted, running_headers)[0].count(header) == 4
+
+def test_drops_boilerplate_and_ocr_debris_but_not_amount_lines(converter):
+    text = page(
+        1,
+        "Địa chỉ: Tầng 22, Tòa nhà PVI",
+        "—[†m; m m",
+        "h x",
+        "Tổng Giám đốc",
+        "Tổng Giám đốc 1.200.000 1.100.000",
+        "(3.400)",
+        "-",
+        *ROWS,
+    )
+    compacted, _, stats = converter.compact_text(text)
+    assert compacted.split("\n")[1:-1] == ["Tổng Giám đốc 1.200.000 1.100.000", "(3.400)", "-", *ROWS]
+    assert stats["dropped_lines"] == 4
+
+def test_collapses_whitespace(converter):
+    compacted, _, _ = converter.compact_text(page(1, "  Tiền    111\t1.234.567   987.654  ", "", "", *ROWS))
+    assert compacted.split("\n")[1] == "Tiền 111 1.234.567 987.654"
+    assert "\n\n" not in compacted
+
+def test_text_without_page_headers_is_compacted_as_one_page(converter):
+    compacted, _, stats = converter.compact_text("Fax: 024 3256\nTiền 111 1.234.567 987.654\n")
+    assert compacted == "Tiền 111 1.234.567 987.654\n"
+    assert stats["dropped_pages"] == []
+
+def test_chunks_respect_the_token_budget(converter):
+    from llm_utils import estimate_tokens
+    big_page = page(7, *[f"Dòng {index} 111 1.234.567 2.345.678" for index in range(200)])
+    chunks = converter.split_text_into_chunks(page(6, *ROWS) + big_page, 300)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 300 for chunk in chunks)
+    assert all(chunk.startswith(("--- PAGE 6 ---", "--- PAGE 7 ---")) for chunk in chunks)
+    assert sum(chunk.count("Dòng ") for chunk in chunks) == 200
@@ -0,0 +1,68 @@
+import pytest
+
+from standardization_store import STANDARDIZATION_DICTIONARY_PATH, StandardizationDictionary, normalize_item
+
+BALANCE_SHEET = "balance_sheet"
+
+@pytest.fixture
+def dictionary(tmp_path):
+    dictionary = StandardizationDictionary(tmp_path / "standardization_dictionary.json")
+    dictionary.update(BALANCE_SHEET, [
+        {"standardized_item": "Tiền Và Các Khoản Tương Đương Tiền", "original_items": ["Tiền và các khoản tương đương tiền"]},
+        {"standardized_item": "Phải Thu Dài Hạn Khác", "original_items": ["Phải thu dài hạn khác"]},
+        {"standardized_item": "Chi Phí Trả Trước Dài Hạn", "original_items": ["Chi phí trả trước dài hạn"]},
+        {"standardized_item": "Vay Và Nợ Thuê Tài Chính Dài Hạn", "original_items": ["Vay và nợ thuê tài chính dài hạn"]},
+        {"standardized_item": "Tài Sản Dài Hạn Khác", "original_items": ["Tài sản dài hạn khác"]},
+        {"standardized_item": "Phải Trả Người Bán Dài Hạn", "original_items": ["Phải trả người bán dài hạn"]},
+        {"standardized_item": "Tài Sản", "original_items": ["Tài sản"]},
+        {"standardized_item": "Chi Phí Thuế TNDN Hoãn Lại", "original_items": ["Chi phí thuế TNDN hoãn lại"]},
+        {"standardized_item": "Lợi Nhuận Sau Thuế", "original_items": ["Lợi nhuận sau thuế"]},
+        {"standardized_item": "221 Nguyên Giá", "original_items": ["221 Nguyên giá"]},
+    ])
+    return dictionary
+
+def test_exact_and_normalized_matches(dictionary):
+    mapping, kinds, unresolved = dictionary.resolve(BALANCE_SHEET, ["Tài sản", "TIEN VA CAC KHOAN TUONG DUONG TIEN."])
+    assert mapping == {"Tài sản": "Tài Sản", "TIEN VA CAC KHOAN TUONG DUONG TIEN.": "Tiền Và Các Khoản Tương Đương Tiền"}
+    assert kinds == {"Tài sản": "exact", "TIEN VA CAC KHOAN TUONG DUONG TIEN.": "normalized"}
+    assert unresolved == []
+
+def test_fuzzy_match_for_an_ocr_variant(dictionary):
+    mapping, kinds, unresolved = dictionary.resolve(BALANCE_SHEET, ["Tiền và các khoản tương đương tiề"])
+    assert mapping == {"Tiền và các khoản tương đương tiề": "Tiền Và Các Khoản Tương Đương Tiền"}
+    assert kinds["Tiền và các khoản tương đương tiề"] == "fuzzy"
+    assert unresolved == []
+
+@pytest.mark.parametrize("item", [
+    "Tổng cộng tài sản",
+    "Phải thu ngắn hạn khác",
+    "Chi phí trả trước ngắn hạn",
+    "Vay và nợ thuê tài chính ngắn hạn",
+    "Tài sản ngắn hạn khác",
+    "Phải trả người bán ngắn hạn",
+    "Chi phí thuế TNDN hiện hành",
+    "Lợi nhuận trước thuế",
+    "227 Nguyên giá",
+])
+def test_no_fuzzy_match_across_discriminating_terms(dictionary, item):
+    mapping, _, unresolved = dictionary.resolve(BALANCE_SHEET, [item])
+    assert mapping == {}
+    assert unresolved == [item]
+
+def test_fuzzy_match_skips_a_closer_candidate_with_other_terms(dictionary):
+    dictionary.update(BALANCE_SHEET, [{"standardized_item": "Phải Thu Ngắn Hạn Khác", "original_items": ["Phải thu ngắn hạn khác"]}])
+    mapping, kinds, _ = dictionary.resolve(BALANCE_SHEET, ["Phải thu ngắn hạn khá"])
+    assert mapping == {"Phải thu ngắn hạn khá": "Phải Thu Ngắn Hạn Khác"}
+    assert kinds["Phải thu ngắn hạn khá"] == "fuzzy"
+
+def test_saved_dictionary_round_trips(dictionary):
+    dictionary.save()
+    reloaded = StandardizationDictionary(dictionary.path)
+    assert reloaded.item_count() == dictionary.item_count()
+    assert reloaded.known_names(BALANCE_SHEET) == dictionary.known_names(BALANCE_SHEET)
+
+def test_default_path_does_not_depend_on_the_working_directory():
+    assert STANDARDIZATION_DICTIONARY_PATH.is_absolute()
+
+def test_normalize_item():
+    assert normalize_item("  Đầu tư tài chính ngắn hạn.") == "dau tu tai chinh ngan han"
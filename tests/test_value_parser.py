@@ -0,0 +1,51 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from value_parser import parse_financial_values
+
+@pytest.mark.parametrize("text, expected", [
+    ("1.234.567", 1234567),
+    ("1,234,567", 1234567),
+    ("(1.234.567)", -1234567),
+    ("-1.234", -1234),
+    ("1.234-", -1234),
+    ("1.234.567,89", 1234567.89),
+    ("1,234,567.89", 1234567.89),
+    ("12.500", 12500),
+    ("0.5", 0.5),
+    ("12,75", 12.75),
+    ("1 234 567", 1234567),
+    ("1.234.567 VND", 1234567),
+    ("500.000đ", 500000),
+    ("₫ 2.000", 2000),
+    ("15%", 15),
+    ("0", 0),
+])
+def test_parses_statement_amounts(text, expected):
+    assert parse_financial_values([text]).iloc[0] == pytest.approx(expected)
+
+@pytest.mark.parametrize("text", ["", "-", "—", "–", "n/a", "N/A", "null", "None", "abc", None, float("nan")])
+def test_blanks_and_placeholders_are_nan(text):
+    assert math.isnan(parse_financial_values([text]).iloc[0])
+
+def test_numbers_parsed_upstream_keep_their_value():
+    values = pd.Series([1.234, 1234567, "1.234", True], dtype=object)
+    parsed = parse_financial_values(values)
+    assert parsed.iloc[0] == pytest.approx(1.234)
+    assert parsed.iloc[1] == 1234567
+    assert parsed.iloc[2] == 1234
+    assert math.isnan(parsed.iloc[3])
+
+def test_keeps_the_index_and_returns_float64():
+    values = pd.Series(["1.000", None, "(2.000)"], index=[10, 20, 30])
+    parsed = parse_financial_values(values)
+    assert parsed.dtype == np.float64
+    assert list(parsed.index) == [10, 20, 30]
+    assert parsed.loc[10] == 1000 and math.isnan(parsed.loc[20]) and parsed.loc[30] == -2000
+
+def test_numeric_and_empty_columns_pass_through():
+    assert parse_financial_values(pd.Series([1, 2], dtype="int64")).tolist() == [1.0, 2.0]
+    assert parse_financial_values(pd.Series([], dtype=object)).empty
@@ -0,0 +1,49 @@
+import pytest
+
+@pytest.mark.parametrize("line, expected", [
+    ("Tiền 111 1.234.567 987.654", ("Tiền", "111", 1234567)),
+    ("Tiền và các khoản tương đương tiền 110 5.1 12.000.000 3.400.000", ("Tiền và các khoản tương đương tiền", "110", 12000000)),
+    ("Vốn góp của chủ sở hữu 411 21 100.000.000.000 90.000.000.000", ("Vốn góp của chủ sở hữu", "411", 100000000000)),
+    ("Dự phòng giảm giá 129 (1.234.000) (5.678.000)", ("Dự phòng giảm giá", "129", -1234000)),
+    ("Chi phí tài chính 22 -45.000 -12.000", ("Chi phí tài chính", "22", -45000)),
+    ("Lỗ khác 32 (500) 1.200", ("Lỗ khác", "32", -500)),
+    ("Thuế hoãn lại 52 - 1.200.000", ("Thuế hoãn lại", "52", None)),
+])
+def test_parse_vas_line_reads_the_current_year_amount(converter, line, expected):
+    assert converter.parse_vas_line(line) == expected
+
+@pytest.mark.parametrize("line", [
+    "Tiền 111 1.234.567", # One amount: 111 is the code, not the current year
+    "Vốn góp 411 21 100.000.000.000", # One amount after a note column
+    "Phải thu khác 136 5.3 2.000.000", # One amount after a decimal note
+    "Chỉ tiêu Mã số Thuyết minh Năm 2023 Năm 2022",
+    "2023 2022",
+    "Tổng cộng 300",
+])
+def test_parse_vas_line_rejects_rows_without_a_current_year_amount(converter, line):
+    assert converter.parse_vas_line(line) is None
+
+def test_page_with_single_amount_rows_falls_back_to_the_llm(converter):
+    page = "\n".join([
+        "--- PAGE 1 ---",
+        "BẢNG CÂN ĐỐI KẾ TOÁN",
+        "Tiền 111 1.234.567",
+        "Các khoản tương đương tiền 112 2.345.678",
+        "Đầu tư ngắn hạn 121 3.456.789",
+    ])
+    _, rows, is_confident = converter.parse_vas_page(page, None, "2023")
+    assert rows == []
+    assert not is_confident
+
+def test_page_with_coded_rows_is_parsed_without_the_llm(converter):
+    page = "\n".join([
+        "--- PAGE 1 ---",
+        "BẢNG CÂN ĐỐI KẾ TOÁN",
+        "Tiền 111 1.234.567 1.000.000",
+        "Các khoản tương đương tiền 112 2.345.678 -",
+        "Dự phòng 129 (3.456) (1.000)",
+    ])
+    statement_type, rows, is_confident = converter.parse_vas_page(page, None, "2023")
+    assert is_confident
+    assert statement_type == "Bảng Cân Đối Kế Toán"
+    assert [(row["item_number"], row["value"]) for row in rows] == [("111", 1234567), ("112", 2345678), ("129", -3456)]
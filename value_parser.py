@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+# Vectorized parser for the amounts found in financial statements, shared by the
+# converter (LLM output) and the formatter (combined long frame). Works on a
+# whole column with pandas string operations instead of one Python call per cell.
+#
+# Handles:
+#   - parenthesized negatives "(1.234.567)" and leading/trailing minus signs
+#   - Vietnamese dot grouping "1.234.567" and English comma grouping "1,234,567"
+#   - mixed grouping with a decimal part: "1.234.567,89" / "1,234,567.89"
+#   - spaces inside numbers, currency and unit suffixes ("VND", "đ", "₫", "USD", "%")
+#   - blanks, dashes and "n/a" style placeholders, which become NaN
+#
+# A single separator followed by exactly three digits ("1.234", "12,500") is read
+# as a thousands separator, because statement amounts are whole VND figures.
+# Anything else with a single separator ("0.5", "12,75") is a decimal part.
+
+MISSING_VALUE_TOKENS = ("", "nan", "none", "null", "n/a", "na", "n.a", "n.a.", "-", "--", "—", "–", "_")
+
+_SINGLE_GROUP = r'^[1-9]\d{0,2}[.,]\d{3}$'
+
+def _parse_numeric_strings(s):
+    # s: stripped, lower-cased strings without missing-value tokens
+    negative = (
+        s.str.startswith("(") & s.str.endswith(")")
+        | s.str.startswith("-") | s.str.startswith("−")
+        | s.str.endswith("-")
+    )
+    body = s.str.replace(r'[^\d.,]', '', regex=True)
+
+    # body only holds digits and separators, so this tells which separator is last
+    dot_is_last = body.str.contains(r'\.\d*$')
+    dot_count = body.str.count(r'\.')
+    comma_count = body.str.count(",")
+    has_dot = dot_count > 0
+    has_comma = comma_count > 0
+    single_group = body.str.match(_SINGLE_GROUP)
+
+    # Which character (if any) marks the decimal part
+    decimal_dot = (
+        has_dot & has_comma & dot_is_last
+        | has_dot & ~has_comma & (dot_count == 1) & ~single_group
+    )
+    decimal_comma = (
+        has_dot & has_comma & ~dot_is_last
+        | has_comma & ~has_dot & (comma_count == 1) & ~single_group
+    )
+
+    normalized = body.str.replace(r'[.,]', '', regex=True)
+    if decimal_dot.any():
+        normalized[decimal_dot] = body[decimal_dot].str.replace(",", "", regex=False)
+    if decimal_comma.any():
+        normalized[decimal_comma] = body[decimal_comma].str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+
+    numbers = pd.to_numeric(normalized.where(normalized != ""), errors="coerce").astype("float64")
+    return numbers.where(~negative, -numbers)
+
+def parse_financial_values(values):
+    # Returns a float64 Series with the index of `values`; unparseable cells are NaN
+    values = pd.Series(values, copy=False)
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return pd.Series(np.nan, index=values.index, dtype="float64")
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return values.astype("float64")
+
+    result = np.full(len(values), np.nan)
+    if values.empty:
+        return pd.Series(result, index=values.index)
+
+    # Numbers already parsed upstream (e.g. by json.loads) keep their value;
+    # turning 1.234 into the string "1.234" would read it as a thousands group.
+    if values.dtype == object:
+        is_number = np.fromiter(
+            (isinstance(v, (int, float, np.number)) and not isinstance(v, bool) for v in values),
+            dtype=bool, count=len(values),
+        )
+        if is_number.any():
+            result[is_number] = values[is_number].astype("float64").to_numpy()
+        is_text = ~is_number & values.notna().to_numpy()
+    else:
+        is_text = values.notna().to_numpy()
+
+    positions = np.flatnonzero(is_text)
+    if positions.size:
+        text = values.iloc[positions].astype(str).str.strip().str.lower().to_numpy()
+        keep = ~pd.Series(text).isin(MISSING_VALUE_TOKENS).to_numpy()
+        positions, text = positions[keep], text[keep]
+    if positions.size:
+        # Amount columns repeat a lot (zeros, subtotals copied across periods),
+        # so each distinct string is parsed once
+        codes, uniques = pd.factorize(text)
+        parsed = _parse_numeric_strings(pd.Series(uniques, dtype="str")).to_numpy()
+        result[positions] = parsed[codes]
+    return pd.Series(result, index=values.index)